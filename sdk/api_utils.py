@@ -14,6 +14,7 @@ It includes functionality for:
 
 Classes:
     APIUtils: Main utility class for API operations
+    APIUtilsBase: url building, config object builders and name index shared with AsyncAPIUtils
     InvalidInputException: Exception for invalid input parameters
     APISessionException: Exception for API session errors
 
@@ -25,14 +26,58 @@ Example usage:
     status, provider = api_utils.create_or_update_base_provider(session, provider_obj)
 """
 
+import copy
+import functools
 import logging
+import threading
+import time
 import traceback
-from typing import Optional
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Generator, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from sdk.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+# connections kept per host, at least the number of concurrent requests of a crawl
+DEFAULT_POOL_SIZE = 16
+# (connect, read) timeout in seconds of the requests that do not set their own
+DEFAULT_TIMEOUT = (10, 240)
+# a 401 is an expired session, a 403 only when its body says the session or token expired,
+# any other 403 is a permission error and is returned as is
+AUTH_EXPIRED_STATUS_CODE = 401
+SESSION_EXPIRED_MARKERS = ('session expired', 'session has expired', 'expired session',
+                           'token expired', 'token has expired', 'expired token')
+# a 401 right after a login is a real authentication error, not an expired session
+MIN_REAUTH_INTERVAL_S = 30
+# seconds a resource name index of get_resource_by_name is used before it is loaded again,
+# 0 (the default) disables the indexes: every lookup is a filtered get
+DEFAULT_NAME_INDEX_TTL_S = 0
+# page size of the REST list calls of iter_resources
+DEFAULT_REST_PAGE_SIZE = 100
+# fields set by the server, ignored when comparing the desired state of a resource with the existing one
+SERVER_MANAGED_FIELDS = frozenset({'id', 'createdAt', 'updatedAt', 'createdBy', 'updatedBy', 'version', 'etag'})
+# responses that are retried, only 429 (the request was not processed) for the non idempotent methods
+RETRY_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+# longest wait of request_with_retry, whatever the Retry-After says
+MAX_RETRY_WAIT_S = 120
+# freshness of the cached GET responses, after it they are revalidated with the ETag / Last-Modified
+DEFAULT_RESPONSE_CACHE_TTL_S = 30
+DEFAULT_RESPONSE_CACHE_MAX_ENTRIES = 1024
+WRITE_METHODS = frozenset({'POST', 'PUT', 'PATCH', 'DELETE'})
+# op of an UpsertResult
+UPSERT_CREATED = 'created'
+UPSERT_UPDATED = 'updated'
+UPSERT_UNCHANGED = 'unchanged'
+UPSERT_ERROR = 'error'
+
 
 class InvalidInputException(Exception):
     """
@@ -47,44 +92,313 @@ class APISessionException(Exception):
     pass
 
 
-class APIUtils:
-    def __init__(self, api_endpoint: str = "https://api.staging.andromedasecurity.com", api_session: requests.Session=None) -> None:
-        self.api_endpoint = api_endpoint
-        self.api_session = api_session
+class UpsertResult(tuple):
+    """
+    (status_code, obj) of a create or update, it unpacks like the tuple the create_or_update_*
+    methods always returned. op is UPSERT_CREATED, UPSERT_UPDATED or UPSERT_UNCHANGED, and
+    for an unchanged resource obj is the existing resource and no write was made. A write
+    that did not return a 2xx is UPSERT_ERROR and obj is the error response.
+    """
+    def __new__(cls, status_code: int, obj: dict, op: str):
+        result = super().__new__(cls, (status_code, obj))
+        result.op = op
+        return result
 
-    def get_api_session_w_api_token(self, login_token: str) -> requests.Session:
-        """
-        This function returns a requests session object with the correct headers
-        to authenticate with the Andromeda API
-        """
-        response = None
+    def __getnewargs__(self) -> tuple:
+        # pickle (eg. the results of a ProcessPoolExecutor) calls cls(*args) with these
+        return self.status_code, self.obj, self.op
+
+    @property
+    def status_code(self) -> int:
+        return self[0]
+
+    @property
+    def obj(self) -> dict:
+        return self[1]
+
+
+def changed_fields(existing: dict, desired: dict) -> list:
+    """
+    Fields of the desired state that differ from the existing resource, the server managed
+    fields and the fields the desired state does not set are ignored
+    """
+    return sorted(k for k, v in desired.items()
+                  if k not in SERVER_MANAGED_FIELDS and (k not in existing or existing[k] != v))
+
+
+def write_op(status_code: int, op: str) -> str:
+    """ op of a create ('post') or update ('put') that returned status_code """
+    if not 200 <= status_code < 300:
+        return UPSERT_ERROR
+    return UPSERT_UPDATED if op == 'put' else UPSERT_CREATED
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter with a default timeout for the requests that do not set one
+    """
+    __attrs__ = HTTPAdapter.__attrs__ + ['timeout']
+
+    def __init__(self, *args, timeout: tuple = DEFAULT_TIMEOUT, **kwargs) -> None:
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def is_auth_expired(status_code: int, body: bytes) -> bool:
+    """ True when the response is the one of an expired session, to log in again and replay """
+    if status_code == AUTH_EXPIRED_STATUS_CODE:
+        return True
+    if status_code != 403 or not body:
+        return False
+    text = body.decode('utf-8', errors='replace').lower()
+    return any(marker in text for marker in SESSION_EXPIRED_MARKERS)
+
+
+def retry_after_s(response: requests.Response, default_s: float, max_s: float = MAX_RETRY_WAIT_S) -> float:
+    """
+    Seconds to wait before retrying, from the Retry-After of the response: a number of seconds or
+    an HTTP date. default_s when there is none or it cannot be parsed, capped to max_s.
+    """
+    retry_after = response.headers.get('Retry-After')
+    wait_s = default_s
+    if retry_after:
         try:
-            session = requests.Session()
-            data = {
-                'code': login_token
-            }
-            response = session.post(
-                f"{self.api_endpoint}/login/access-key", json=data,
-                verify=False, headers={'Content-Type': 'application/json'})
-        except Exception as exc:
-            logger.error('Failed to login to API server %s', self.api_endpoint)
-            logger.error('exception %s\n %s', exc, traceback.format_exc())
-            raise exc
-        if response.status_code != 200:
-            logger.error('Failed to login to API server %s', self.api_endpoint)
-            logger.error('API Response: %s', response.text)
-        self.api_session = session
-        return session
+            wait_s = float(retry_after)
+            if wait_s != wait_s:
+                wait_s = default_s
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                if retry_at.tzinfo is None:
+                    retry_at = retry_at.replace(tzinfo=timezone.utc)
+                wait_s = (retry_at - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                logger.debug("invalid Retry-After %s", retry_after)
+    return min(max(wait_s, 0), max_s)
+
+
+def _request_url(url: str, params: Optional[dict]) -> str:
+    """ Full url of a request, the query params included """
+    return requests.Request('GET', url, params=params).prepare().url if params else url
+
+
+class ResponseCache:
+    """
+    Cache of the GET responses of a session, keyed by the full url.
+
+    A response is returned as is for ttl_s, then revalidated with a conditional GET
+    (If-None-Match / If-Modified-Since) when it has an ETag or a Last-Modified, a 304 refreshes
+    it. Responses without validators are fetched again after the ttl. A write (POST, PUT,
+    PATCH, DELETE) drops the cached responses of its url, the urls under it and the
+    collections above it, eg. a PUT of providers/1/aws/config drops providers/1/aws/config,
+    providers/1 and the providers listings.
+    """
+    def __init__(self, ttl_s: float = DEFAULT_RESPONSE_CACHE_TTL_S,
+                 max_entries: int = DEFAULT_RESPONSE_CACHE_MAX_ENTRIES) -> None:
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.hits = 0
+        self.revalidations = 0
+        # url -> (stored at, response), oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _path(url: str) -> str:
+        return url.split('?', 1)[0].rstrip('/')
+
+    def invalidate(self, url: Optional[str] = None) -> None:
+        """ Drop the responses related to the url, or all of them """
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+                return
+            path = self._path(url)
+            for key in list(self._entries):
+                key_path = self._path(key)
+                if key_path == path or key_path.startswith(f"{path}/") or path.startswith(f"{key_path}/"):
+                    del self._entries[key]
+
+    def request(self, send: Callable, method: str, url: str, **kwargs) -> requests.Response:
+        """ Answer a GET from the cache or with send(method, url, **kwargs), the requests.Session.request signature """
+        method = method.upper()
+        if method != 'GET' or kwargs.get('stream') or kwargs.get('data') or kwargs.get('json') is not None:
+            response = send(method, url, **kwargs)
+            if method in WRITE_METHODS:
+                self.invalidate(url)
+            return response
+        key = _request_url(url, kwargs.get('params'))
+        with self._lock:
+            stored_at, cached = self._entries.get(key, (0, None))
+        if cached is not None and time.time() - stored_at < self.ttl_s:
+            self.hits += 1
+            return copy.copy(cached)
+        headers = dict(kwargs.get('headers') or {})
+        if cached is not None and cached.headers.get('ETag'):
+            headers['If-None-Match'] = cached.headers['ETag']
+        if cached is not None and cached.headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = cached.headers['Last-Modified']
+        response = send(method, url, **dict(kwargs, headers=headers))
+        if response.status_code == 304 and cached is not None:
+            self.revalidations += 1
+            self._store(key, cached)
+            return copy.copy(cached)
+        if response.status_code == 200 and 'no-store' not in response.headers.get('Cache-Control', ''):
+            self._store(key, response)
+        return response
+
+    def _store(self, key: str, response: requests.Response) -> None:
+        # reading the content detaches the response from the connection, the copies share it
+        response.content
+        with self._lock:
+            self._entries[key] = (time.time(), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class ReauthSession(requests.Session):
+    """
+    requests.Session that logs in again when the session expires. A 401 response, or a 403
+    whose body says the session expired (see is_auth_expired), runs login_fn(session) once, under a lock so that concurrent workers do not all log in, and
+    replays the request. The GraphQL transport runs on the same session, so the REST and
+    GraphQL calls are both covered.
 
-    def get_api_session_w_cookie(self, cookie: str) -> requests.Session:
-        """
-        This function returns a requests session object with the correct headers
-        to authenticate with the Andromeda API
-        """
-        session = requests.Session()
-        session.cookies.set('DS', cookie)
-        return session
+    auth_generation counts the logins: a request that failed with the credentials of an
+    older generation is replayed without logging in again.
 
+    With a response_cache the GET responses are cached, see ResponseCache. With a
+    single_flight the identical concurrent GETs share one request, see SingleFlight.
+    """
+    def __init__(self, login_fn: Optional[Callable[[requests.Session], bool]] = None,
+                 min_reauth_interval_s: float = MIN_REAUTH_INTERVAL_S) -> None:
+        super().__init__()
+        self.login_fn = login_fn
+        self.min_reauth_interval_s = min_reauth_interval_s
+        self.auth_generation = 0
+        self.last_login_at = 0.0
+        self._auth_lock = threading.Lock()
+        self._in_login = threading.local()
+        self.response_cache: Optional[ResponseCache] = None
+        self.single_flight: Optional[SingleFlight] = None
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.login_fn = None
+        self.min_reauth_interval_s = MIN_REAUTH_INTERVAL_S
+        self.auth_generation = 0
+        self.last_login_at = 0.0
+        self._auth_lock = threading.Lock()
+        self._in_login = threading.local()
+        self.response_cache = None
+        self.single_flight = None
+
+    def login(self) -> bool:
+        """ Run the login exchange, called with the auth lock held or before the session is shared """
+        self._in_login.active = True
+        try:
+            logged_in = self.login_fn(self)
+        finally:
+            self._in_login.active = False
+        if logged_in:
+            self.auth_generation += 1
+            self.last_login_at = time.time()
+        return logged_in
+
+    def reauthenticate(self, generation: int) -> bool:
+        """ Log in again unless another thread already did since generation. Returns True to replay """
+        with self._auth_lock:
+            if self.auth_generation != generation:
+                return True
+            if time.time() - self.last_login_at < self.min_reauth_interval_s:
+                return False
+            logger.info("API session expired, logging in again")
+            return self.login()
+
+    def request(self, method, url, *args, **kwargs):
+        if self.response_cache is not None and not args:
+            return self.response_cache.request(self._coalesced_request, method, url, **kwargs)
+        return self._coalesced_request(method, url, *args, **kwargs)
+
+    def _coalesced_request(self, method, url, *args, **kwargs):
+        if (self.single_flight is None or args or method.upper() != 'GET' or kwargs.get('stream')
+                or kwargs.get('data') or kwargs.get('json') is not None):
+            return self._request_w_reauth(method, url, *args, **kwargs)
+        # the conditional headers of the response cache are part of the key
+        key = ('GET', _request_url(url, kwargs.get('params')),
+               tuple(sorted((kwargs.get('headers') or {}).items())))
+        return self.single_flight.do(
+            key, functools.partial(self._read_request, method, url, **kwargs), share_fn=copy.copy)
+
+    def _read_request(self, method, url, **kwargs):
+        response = self._request_w_reauth(method, url, **kwargs)
+        # the content is read before the response is shared, the copies share it
+        response.content
+        return response
+
+    def _request_w_reauth(self, method, url, *args, **kwargs):
+        generation = self.auth_generation
+        response = super().request(method, url, *args, **kwargs)
+        # the body is only read for the 401/403 responses, the others may be streamed
+        if (response.status_code in (AUTH_EXPIRED_STATUS_CODE, 403) and self.login_fn
+                and not getattr(self._in_login, 'active', False)
+                and is_auth_expired(response.status_code, response.content) and self.reauthenticate(generation)):
+            response = super().request(method, url, *args, **kwargs)
+        return response
+
+
+def create_api_session(pool_size: int = DEFAULT_POOL_SIZE, timeout: tuple = DEFAULT_TIMEOUT,
+                       login_fn: Optional[Callable[[requests.Session], bool]] = None,
+                       cache_ttl_s: Optional[float] = None, coalesce: bool = False) -> requests.Session:
+    """
+    Create a requests session with a connection pool of pool_size keep-alive connections per
+    host, default timeouts and gzip. The REST calls and the GraphQL transport of
+    AndromedaInventory share it, so parallel requests reuse the pooled connections.
+    With login_fn the session logs in again when it expires, see ReauthSession.
+    With cache_ttl_s the GET responses are cached, see ResponseCache. With coalesce the
+    identical concurrent GETs of the workers share one request, see SingleFlight. A GET
+    sent after a write can join a GET sent before it and see the pre-write body, coalesce
+    is for the read-only sessions (the inventory crawls).
+    """
+    session = ReauthSession(login_fn)
+    if coalesce:
+        session.single_flight = SingleFlight()
+    if cache_ttl_s is not None:
+        session.response_cache = ResponseCache(cache_ttl_s)
+    adapter = TimeoutHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, timeout=timeout)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+    return session
+
+
+class APIUtilsBase:
+    """
+    What APIUtils and AsyncAPIUtils share: the url building, the get_*_config_object builders,
+    patch_policy_rules, the bookkeeping of the name indexes and the create_or_update_*_provider_config
+    helpers. The helpers build the config url and return what create_or_update_provider of the
+    client returns, the UpsertResult of APIUtils or the coroutine of AsyncAPIUtils.
+    """
+    def __init__(self, api_endpoint: str, api_session, pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: tuple = DEFAULT_TIMEOUT, name_index_ttl_s: float = DEFAULT_NAME_INDEX_TTL_S) -> None:
+        self.api_endpoint = api_endpoint
+        self.api_session = api_session
+        self.pool_size = pool_size
+        self.timeout = timeout
+        # resource_type -> (loaded at, {name: resource}), 0 ttl disables the indexes. Every
+        # type is listed under its own lock of _name_index_locks, set by the clients,
+        # _name_index_lock only guards the dicts
+        self.name_index_ttl_s = name_index_ttl_s
+        self._name_indexes = {}
+        self._name_index_locks = {}
+        # resource_type -> number of invalidations, an index listed across one is not kept
+        self._name_index_generations = {}
+        self._name_index_lock = threading.Lock()
 
     def get_resource_url(self, resoure_type: str, resource_name: str = "", resource_id: str = "", subresource_path: str = "",
                          subresource_id: str = ""):
@@ -106,82 +420,32 @@ class APIUtils:
             url = "?".join([url, f"filter= name = {resource_name}"])
         return url
 
-    def create_or_update_resource(
-            self, api_session: requests.Session, resource_type: str,
-            resource_id: str = "", resource_name: str = "", obj: dict = None) -> tuple[int, dict]:
-        try:
-            status_code = 200
-            logger.info("resource_type %s resource_name %s resource_id %s",
-                         resource_type, resource_name, resource_id)
-            if resource_name and not resource_id:
-                status_code, existing_obj = self.get_resource_by_name(
-                    api_session, resource_type, resource_name)
-                if status_code == 200 and existing_obj:
-                    existing_obj.update(obj)
-                    obj = existing_obj
-                    op = 'put'
-                    url = self.get_resource_url(
-                        resoure_type=resource_type, resource_id=obj['id'])
-                    #logger.debug("found existing resource %s with id %s status_code %s",
-                    #            resource_name, existing_obj, status_code)
-                else:
-                    # did not find the object so create it. Note cannot be subresource here
-                    #logger.debug("creating new resource %s", resource_name)
-                    op = 'post'
-                    url = self.get_resource_url(
-                        resoure_type=resource_type)
-            elif resource_id:
-                op = 'put'
-                url = self.get_resource_url(
-                    resoure_type=resource_type, resource_id=resource_id)
-            else:
-                op = 'post'
-                url = self.get_resource_url(
-                    resoure_type=resource_type, resource_id=resource_id)
-
-            response = getattr(api_session, op)(url, json=obj, verify=False)
-            status_code, obj = response.status_code, response.json()
-            logger.debug("url:%s op:%s status_code:%s obj:%s", url, op, status_code, obj)
-        except Exception as exc:
-            logger.error('Failed to create provider object')
-            logger.error('exception %s\n %s', exc, traceback.format_exc())
-            raise exc
-        return status_code, obj
-
-    def get_resource_by_name(self, api_session: requests.Session, resource_type: str, resource_name: str) -> (int, dict):
-        """
-        This function returns a resource by name
-        """
-        response = api_session.get(self.get_resource_url(
-            resoure_type=resource_type, resource_name=resource_name))
-        resource_obj = None
-        status_code = response.status_code
-        if status_code == 200:
-            if response.json()['results']:
-                # adding a hack to iterate over the results because sometimes the filters don't work
-                r = [r for r in response.json()['results'] if r['name'] == resource_name]
-                if r :
-                    resource_obj = r[0]
-                    logger.debug("found resource %s %s",resource_type, resource_obj['name'])
-                else:
-                    status_code = 404
-            else:
-                status_code = 404
-        return status_code, resource_obj
-
-    def get_resources(self, api_session: requests.Session, resource_type: str) -> tuple[int, dict]:
+    def invalidate_resource_name_index(self, resource_type: Optional[str] = None) -> None:
+        """ Drop the name index of the resource type, or all of them """
+        with self._name_index_lock:
+            resource_types = list(self._name_indexes) if resource_type is None else [resource_type]
+            for r_type in resource_types:
+                self._name_indexes.pop(r_type, None)
+                self._name_index_generations[r_type] = self._name_index_generations.get(r_type, 0) + 1
+            if resource_type is None:
+                # an index being listed is not in _name_indexes yet
+                for r_type in self._name_index_locks:
+                    self._name_index_generations[r_type] = self._name_index_generations.get(r_type, 0) + 1
+
+    def _update_resource_name_index(self, resource_type: str, resource_name: str, obj: dict) -> None:
         """
-        This function returns all resources of a given type
+        Store the resource written under resource_name in the name index of the type, instead of
+        dropping the index and listing the type again at the next lookup
         """
-        response = api_session.get(self.get_resource_url(
-            resoure_type=resource_type))
-        return response.status_code, response.json()['results']
-
-    def create_or_update_base_provider(self, api_session: requests.Session, provider_obj: dict) -> tuple[int, dict]:
-        return self.create_or_update_resource(
-            api_session, resource_type='providers', resource_id=provider_obj.get('id', ""),
-            resource_name=provider_obj.get('name'),
-            obj=provider_obj)
+        if not isinstance(obj, dict) or obj.get('name') != resource_name:
+            self.invalidate_resource_name_index(resource_type)
+            return
+        with self._name_index_lock:
+            # a listing in flight may have missed the resource, it is not kept
+            self._name_index_generations[resource_type] = self._name_index_generations.get(resource_type, 0) + 1
+            loaded_at, index = self._name_indexes.get(resource_type, (0, None))
+            if index is not None:
+                index[resource_name] = obj
 
     def create_or_update_azure_provider_config(self, api_session: requests.Session, provider_id: str, azure_provider_obj: dict) -> tuple[int, dict]:
         """
@@ -220,7 +484,6 @@ class APIUtils:
             api_session=api_session,
             provider_id=provider_id, provider_config=aws_provider_obj, provider_url=url)
 
-
     def create_or_update_okta_provider_config(self, api_session: requests.Session, provider_id: str, okta_provider_obj: dict) -> tuple[int, dict]:
         """
         This function creates or updates the cloud specific settings for a provider
@@ -242,60 +505,6 @@ class APIUtils:
             api_session=api_session, provider_id=provider_id,
             provider_obj=customapp_provider_obj, provider_type="customapp")
 
-    def create_or_update_workday_provider_config(self, andromeda_base_url, api_session: requests.Session, provider_obj: dict) -> tuple[int, dict]:
-        """
-        This function creates or updates the cloud specific settings for a provider
-        """
-        config_url = f"{andromeda_base_url}/integrations/{provider_obj['id']}/workday"
-
-        # Base data always includes name
-        data = {
-            "name": provider_obj['name'],
-        }
-
-        # Add workday configuration if present
-        if 'workdayConfiguration' in provider_obj:
-            workday_config = provider_obj['workdayConfiguration']
-            data.update(workday_config)
-
-        # Add fileId only if present (for CSV mode)
-        if 'fileId' in provider_obj:
-            data["fileId"] = provider_obj['fileId']
-
-        response = api_session.get(config_url)
-        resource_id = ""
-        if response.status_code == 200 and response.json():
-            resource_id = response.json()['id']
-            new_config = response.json()
-            # For updates, start fresh with just the existing config and carefully merge
-            # Remove any fields that might cause duplicates
-            if 'api_config' in new_config:
-                del new_config['api_config']
-            if 'apiConfig' in new_config:
-                del new_config['apiConfig']
-            # Update with new data
-            for key, value in data.items():
-                new_config[key] = value
-            # Remove immutable fields for PUT operations (mode)
-            if 'defaultMode' in new_config:
-                del new_config['defaultMode']
-            if 'userDataMappingProfile' in new_config:
-                del new_config['userDataMappingProfile']
-        else:
-            new_config = data
-
-        op = "put" if resource_id else "post"
-
-        response = getattr(api_session, op)(config_url, json=new_config, verify=False)
-        if response.status_code != 200:
-            logger.error("config for provider op %s url %s provider %s status %s obj %s response %s",
-                        op, config_url, provider_obj['id'], response.status_code, new_config, response.json())
-        else:
-            logger.debug("config for provider op %s url %s provider %s status %s response %s",
-                        op, config_url, provider_obj['id'], response.status_code, response.json())
-        return response.status_code, response.json()
-
-
     def create_or_update_provider_config(self, api_session: requests.Session, provider_id: str, provider_obj: dict, provider_type: str) -> tuple[int, dict]:
         """
         This function creates or updates the cloud specific settings for a provider
@@ -309,35 +518,6 @@ class APIUtils:
             api_session=api_session,
             provider_id=provider_id, provider_config=provider_obj, provider_url=url)
 
-
-    def create_or_update_provider(self,
-            api_session: requests.Session,
-            provider_id,
-            provider_config,
-            provider_url: str) -> tuple[int, dict]:
-        # check if the aws config is already present
-        response = api_session.get(provider_url)
-        #logger.debug("config for provider %s status %s obj %s",
-        #            provider_url, response.status_code, response.json())
-        resource_id = ""
-        if response.status_code == 200 and response.json():
-            resource_id = response.json()['id']
-            provider_config['id'] = resource_id
-            provider_config['updatedAt'] = response.json()['updatedAt']
-            #logger.debug("existing provider found -  provider config %s", response.json())
-        op = "put" if resource_id else "post"
-        response = getattr(api_session, op)(provider_url, json=provider_config, verify=False)
-        if response.status_code != 200:
-            logger.error("provider op:%s url:%s provider:%s status:%s obj:%s response:%s",
-                        op, provider_url, provider_id, response.status_code, provider_config,
-                        response.json())
-        return response.status_code, response.json()
-
-    def create_or_update_environment(self, api_session: requests.Session, environment_obj: dict) -> (int, dict):
-        logger.debug("creating environment %s", environment_obj['name'])
-        return self.create_or_update_resource(
-            api_session, resource_type=f"environments", resource_name=environment_obj['name'], obj=environment_obj)
-
     def patch_policy_rules(self, patch: dict, policy: dict) -> dict:
         """
         works for following policies
@@ -408,7 +588,6 @@ class APIUtils:
         }
         return ad_provider
 
-
     def get_provider_azure_config_object(self, auth_mode: str, azure_tenant_id: str, application_id: str, sec_acc_key: str) -> dict:
 
         """ Create azure provider config object """
@@ -444,7 +623,6 @@ class APIUtils:
                 logs_config["blobStorage"]["blobStorageConfigs"][0]["authConfig"]["staticCredentials"] = azure_log_cred
         return logs_config
 
-
     def get_provider_aws_config_object(
             self, auth_mode: str, mgmt_account_id: str, role_name: str,
             acc_key_id: str, sec_acc_key: str, trails: list,
@@ -553,70 +731,25 @@ class APIUtils:
 
         return iam_provider
 
-    def create_eligibility(
-            self, api_session: requests.Session,
-            provider_id: str,
-            eligibility_mapping: dict) -> (int, dict):
-        try:
-            url = self.get_resource_url(
-                resoure_type=f"providers/{provider_id}/eligibility")
-            response = api_session.post(url, json=eligibility_mapping, verify=False)
-            status_code, obj = response.status_code, response.json()
-            return status_code, obj
-        except:
-            raise APISessionException("Failed to create eligibility")
+    def get_provider_gcp_config_object(
+            self, auth_mode: str, organization_id: str, service_account_key: str, audit_logs_config: dict = None) -> dict:
+        """ Create gcp provider config object """
+        gcp_provider = {
+            "organizationId": organization_id,
+            "authConfig": {
+                "authMode": auth_mode,
+                "serviceAccount": {
+                    "keyJson": service_account_key
+                }
+            },
+            "auditLogsConfig": audit_logs_config
+        }
+        return gcp_provider
 
-    def accept_delete_identity_risk_inside_account(
-        self,
-        api_session: requests.Session,
-        account_id: str,
-        identity_id: str,
-        request_type: str,
-    ):
+    def create_or_update_gcp_provider_config(
+            self, api_session: requests.Session, provider_id: str, gcp_provider_obj: dict) -> tuple[int, dict]:
         """
-        This function creates a post/delete request to update accepted_risk for an identity inside an account
-        """
-        url = f"{self.api_endpoint}/identities/{identity_id}/accounts/{account_id}/accepted-risk"
-
-        logger.debug(
-            "accept_delete_identity_risk_inside_account: RequestType: %s | URL: %s",
-            request_type,
-            url,
-        )
-
-        response = None
-        if request_type == "POST":
-            response = api_session.post(url)
-        elif request_type == "DELETE":
-            response = api_session.delete(url)
-        else:
-            logger.error("Invalid request_type: %s. Must be 'POST' or 'DELETE'", request_type)
-            return
-
-        logger.debug(
-            "accept_delete_identity_risk_inside_account: ResponseStatus: %s",
-            response.status_code,
-        )
-
-    def get_provider_gcp_config_object(
-            self, auth_mode: str, organization_id: str, service_account_key: str, audit_logs_config: dict = None) -> dict:
-        """ Create gcp provider config object """
-        gcp_provider = {
-            "organizationId": organization_id,
-            "authConfig": {
-                "authMode": auth_mode,
-                "serviceAccount": {
-                    "keyJson": service_account_key
-                }
-            },
-            "auditLogsConfig": audit_logs_config
-        }
-        return gcp_provider
-
-    def create_or_update_gcp_provider_config(
-            self, api_session: requests.Session, provider_id: str, gcp_provider_obj: dict) -> tuple[int, dict]:
-        """
-        This function creates or updates the cloud specific settings for a provider
+        This function creates or updates the cloud specific settings for a provider
         """
         #logger.info("creating gcp config for provider %s", provider_id)
         # check if the aws config is already present
@@ -741,34 +874,6 @@ class APIUtils:
             api_session=api_session, provider_id=provider_id, provider_config=ad_provider_obj,
             provider_url=url)
 
-    def create_default_broker(self, api_session: requests.Session) -> tuple[int, dict]:
-        """
-        This function creates a default broker
-        """
-        logger.info("creating default broker")
-        url = self.get_resource_url(resoure_type=f"brokers")
-        response = api_session.get(url)
-        broker_data = {
-            "name": "test-default-broker"
-        }
-        response_json = response.json()
-        if response.status_code == 200 and response_json and response_json['count'] > 0:
-            logger.debug("default broker already exists with id %s", response_json['results'][0]['id'])
-            return response.status_code, response_json['results'][0]
-        else:
-            logger.debug("default broker does not exist, creating new one")
-            response = getattr(api_session, "post")(url, json=broker_data, verify=False)
-            return response.status_code, response.json()
-
-    def create_broker_secret(self, api_session: requests.Session, broker_id: str) -> tuple[int, dict]:
-        """
-        This function creates or updates the broker secret
-        """
-        logger.info("creating broker secret for broker %s", broker_id)
-        url = self.get_resource_url(resoure_type=f"brokers/{broker_id}/auth-config")
-        response = getattr(api_session, "post")(url)
-        return response.status_code, response.json()
-
     def get_provider_pingone_config_object(
             self, environment_id: str, region: str, client_id: str, client_secret: str) -> dict:
         """ Create PingOne provider config object """
@@ -835,6 +940,612 @@ class APIUtils:
             api_session=api_session, provider_id=provider_id, provider_config=atlas_provider_obj,
             provider_url=url)
 
+    def create_or_update_rds_postgresql_provider_config(
+        self,
+        api_session: requests.Session,
+        provider_id: str,
+        rds_postgresql_provider_obj: dict,
+    ) -> tuple[int, dict]:
+        """
+        This function creates or updates the cloud specific settings for a provider
+        """
+        url = self.get_resource_url(resoure_type=f"providers/{provider_id}/rds-postgresql/config")
+        return self.create_or_update_provider(
+            api_session=api_session,
+            provider_id=provider_id,
+            provider_config=rds_postgresql_provider_obj,
+            provider_url=url,
+        )
+
+
+class APIUtils(APIUtilsBase):
+    def __init__(self, api_endpoint: str = "https://api.staging.andromedasecurity.com", api_session: requests.Session=None,
+                 pool_size: int = DEFAULT_POOL_SIZE, timeout: tuple = DEFAULT_TIMEOUT,
+                 name_index_ttl_s: float = DEFAULT_NAME_INDEX_TTL_S,
+                 cache_ttl_s: Optional[float] = None, coalesce: bool = False) -> None:
+        super().__init__(api_endpoint, api_session, pool_size, timeout, name_index_ttl_s)
+        # opt-in GET response cache of the sessions created here, see ResponseCache
+        self.cache_ttl_s = cache_ttl_s
+        # opt-in GET coalescing of the sessions created here, for the read-only callers
+        self.coalesce = coalesce
+
+    def get_api_session_w_api_token(self, login_token: str) -> requests.Session:
+        """
+        This function returns a requests session object with the correct headers
+        to authenticate with the Andromeda API
+        """
+        try:
+            session = create_api_session(
+                self.pool_size, self.timeout, functools.partial(self._login_w_api_token, login_token),
+                self.cache_ttl_s, self.coalesce)
+            session.login()
+        except Exception as exc:
+            logger.error('Failed to login to API server %s', self.api_endpoint)
+            logger.error('exception %s\n %s', exc, traceback.format_exc())
+            raise exc
+        self.api_session = session
+        return session
+
+    def _login_w_api_token(self, login_token: str, session: requests.Session) -> bool:
+        """ Exchange the access key for the session cookie, the login_fn of the api token sessions """
+        data = {
+            'code': login_token
+        }
+        response = session.post(
+            f"{self.api_endpoint}/login/access-key", json=data,
+            verify=False, headers={'Content-Type': 'application/json'})
+        if response.status_code != 200:
+            logger.error('Failed to login to API server %s', self.api_endpoint)
+            logger.error('API Response: %s', response.text)
+            return False
+        return True
+
+    def get_api_session_w_cookie(self, cookie: str) -> requests.Session:
+        """
+        This function returns a requests session object with the correct headers
+        to authenticate with the Andromeda API
+        """
+        session = create_api_session(self.pool_size, self.timeout, cache_ttl_s=self.cache_ttl_s,
+                                     coalesce=self.coalesce)
+        session.cookies.set('DS', cookie)
+        return session
+
+    def create_or_update_resource(
+            self, api_session: requests.Session, resource_type: str,
+            resource_id: str = "", resource_name: str = "", obj: dict = None) -> tuple[int, dict]:
+        """
+        Create or update a resource. With a resource_name the existing resource is looked up and
+        only written when obj changes one of its fields. With a resource_id obj is always PUT,
+        there is no read of the existing resource to diff against.
+        """
+        try:
+            status_code = 200
+            logger.info("resource_type %s resource_name %s resource_id %s",
+                         resource_type, resource_name, resource_id)
+            if resource_name and not resource_id:
+                status_code, existing_obj = self.get_resource_by_name(
+                    api_session, resource_type, resource_name)
+                if status_code == 200 and existing_obj:
+                    if not changed_fields(existing_obj, obj):
+                        logger.debug("resource %s %s unchanged", resource_type, resource_name)
+                        return UpsertResult(status_code, existing_obj, UPSERT_UNCHANGED)
+                    existing_obj.update(obj)
+                    obj = existing_obj
+                    op = 'put'
+                    url = self.get_resource_url(
+                        resoure_type=resource_type, resource_id=obj['id'])
+                    #logger.debug("found existing resource %s with id %s status_code %s",
+                    #            resource_name, existing_obj, status_code)
+                else:
+                    # did not find the object so create it. Note cannot be subresource here
+                    #logger.debug("creating new resource %s", resource_name)
+                    op = 'post'
+                    url = self.get_resource_url(
+                        resoure_type=resource_type)
+            elif resource_id:
+                op = 'put'
+                url = self.get_resource_url(
+                    resoure_type=resource_type, resource_id=resource_id)
+            else:
+                op = 'post'
+                url = self.get_resource_url(
+                    resoure_type=resource_type, resource_id=resource_id)
+
+            response = getattr(api_session, op)(url, json=obj, verify=False)
+            status_code, obj = response.status_code, response.json()
+            if resource_name and not resource_id and 200 <= status_code < 300:
+                self._update_resource_name_index(resource_type, resource_name, obj)
+            else:
+                self.invalidate_resource_name_index(resource_type)
+            logger.debug("url:%s op:%s status_code:%s obj:%s", url, op, status_code, obj)
+        except Exception as exc:
+            logger.error('Failed to create provider object')
+            logger.error('exception %s\n %s', exc, traceback.format_exc())
+            raise exc
+        return UpsertResult(status_code, obj, write_op(status_code, op))
+
+    def upsert_resources_by_name(self, api_session: requests.Session, resource_type: str,
+                                 objs: list) -> list:
+        """
+        Batch version of create_or_update_resource for resources identified by name. The
+        existing resources are read once with iter_resources, every object is diffed locally
+        and only the created or changed ones are written. Returns an UpsertResult per object,
+        the writes that did not return a 2xx are UPSERT_ERROR.
+        """
+        results = []
+        try:
+            existing = {}
+            for r in self.iter_resources(api_session, resource_type):
+                existing.setdefault(r.get('name'), r)
+            for obj in objs:
+                existing_obj = existing.get(obj['name'])
+                if existing_obj and not changed_fields(existing_obj, obj):
+                    results.append(UpsertResult(200, existing_obj, UPSERT_UNCHANGED))
+                    continue
+                if existing_obj:
+                    op = 'put'
+                    url = self.get_resource_url(resoure_type=resource_type, resource_id=existing_obj['id'])
+                    response = api_session.put(url, json=dict(existing_obj, **obj), verify=False)
+                else:
+                    op = 'post'
+                    url = self.get_resource_url(resoure_type=resource_type)
+                    response = api_session.post(url, json=obj, verify=False)
+                result = UpsertResult(response.status_code, response.json(), write_op(response.status_code, op))
+                if result.op == UPSERT_ERROR:
+                    logger.error("resource %s %s op:%s url:%s status:%s response:%s", resource_type, obj['name'],
+                                 op, url, result.status_code, result.obj)
+                else:
+                    logger.debug("resource %s %s %s status_code:%s", resource_type, obj['name'], result.op,
+                                 result.status_code)
+                results.append(result)
+        except Exception as exc:
+            logger.error('Failed to upsert %s resources', resource_type)
+            logger.error('exception %s\n %s', exc, traceback.format_exc())
+            raise exc
+        finally:
+            if any(r.op != UPSERT_UNCHANGED for r in results):
+                self.invalidate_resource_name_index(resource_type)
+        logger.info("%s created %s updated %s unchanged %s errors %s", resource_type,
+                    sum(r.op == UPSERT_CREATED for r in results), sum(r.op == UPSERT_UPDATED for r in results),
+                    sum(r.op == UPSERT_UNCHANGED for r in results), sum(r.op == UPSERT_ERROR for r in results))
+        return results
+
+    def _resource_name_index(self, api_session: requests.Session, resource_type: str) -> Optional[dict]:
+        """ name -> resource of all the resources of the type, loaded with one list call and kept for the ttl """
+        if self.name_index_ttl_s <= 0:
+            return None
+        with self._name_index_lock:
+            type_lock = self._name_index_locks.setdefault(resource_type, threading.Lock())
+        with type_lock:
+            with self._name_index_lock:
+                loaded_at, index = self._name_indexes.get(resource_type, (0, None))
+                generation = self._name_index_generations.get(resource_type, 0)
+            if index is not None and time.time() - loaded_at < self.name_index_ttl_s:
+                return index
+            index = {}
+            try:
+                for r in self.iter_resources(api_session, resource_type):
+                    # first one wins, same as the filtered lookup
+                    index.setdefault(r.get('name'), r)
+            except Exception as exc:
+                # the index is only a shortcut, the lookups fall back to the filtered get
+                logger.debug("could not list %s to index them: %s", resource_type, exc)
+                return None
+            with self._name_index_lock:
+                if self._name_index_generations.get(resource_type, 0) == generation:
+                    self._name_indexes[resource_type] = (time.time(), index)
+            logger.debug("indexed %s %s by name", len(index), resource_type)
+            return index
+
+    def get_resource_by_name(self, api_session: requests.Session, resource_type: str, resource_name: str) -> (int, dict):
+        """
+        This function returns a resource by name. With a name_index_ttl_s the resources of the
+        type are indexed by name with one list call, repeated lookups are answered from the index
+        until the ttl expires. create_or_update_resource by name updates the index in place,
+        the other writes of the type invalidate it. Names
+        missing from the index, and all the names without a ttl, are looked up with the filtered get.
+        """
+        index = self._resource_name_index(api_session, resource_type)
+        if index and resource_name in index:
+            return 200, copy.deepcopy(index[resource_name])
+        response = api_session.get(self.get_resource_url(
+            resoure_type=resource_type, resource_name=resource_name))
+        resource_obj = None
+        status_code = response.status_code
+        if status_code == 200:
+            if response.json()['results']:
+                # adding a hack to iterate over the results because sometimes the filters don't work
+                r = [r for r in response.json()['results'] if r['name'] == resource_name]
+                if r :
+                    resource_obj = r[0]
+                    logger.debug("found resource %s %s",resource_type, resource_obj['name'])
+                else:
+                    status_code = 404
+            else:
+                status_code = 404
+        return status_code, resource_obj
+
+    def get_resources(self, api_session: requests.Session, resource_type: str) -> tuple[int, dict]:
+        """
+        This function returns all resources of a given type, all the pages of them
+        """
+        try:
+            return 200, list(self.iter_resources(api_session, resource_type))
+        except requests.HTTPError as exc:
+            logger.error("Failed to list %s: %s", resource_type, exc)
+            return exc.response.status_code, []
+
+    @staticmethod
+    def request_with_retry(api_session: requests.Session, method: str, url: str,
+                           retries: int = 3, backoff_s: float = 1, **kwargs) -> requests.Response:
+        """
+        Send the request, retrying with exponential backoff (or the Retry-After of the response,
+        see retry_after_s).
+
+        The idempotent methods are retried on connection errors, timeouts, 429 and 5xx. A POST
+        may have been processed when it fails with a 5xx or a broken connection, so it is only
+        retried on 429 and connect timeouts: the caller looks the resource up before creating
+        it again. The last response is returned, whatever its status.
+        """
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        for attempt in range(retries + 1):
+            try:
+                response = api_session.request(method, url, **kwargs)
+                retry = response.status_code == 429 or (idempotent and response.status_code in RETRY_STATUS_CODES)
+                if not retry or attempt == retries:
+                    return response
+                wait_s = retry_after_s(response, backoff_s * 2 ** attempt)
+                logger.warning("%s %s status %s, retrying in %ss", method, url, response.status_code, wait_s)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if attempt == retries or not (idempotent or isinstance(exc, requests.ConnectTimeout)):
+                    raise
+                wait_s = backoff_s * 2 ** attempt
+                logger.warning("%s %s failed %s, retrying in %ss", method, url, exc, wait_s)
+            time.sleep(wait_s)
+
+    def _resources_page(self, api_session: requests.Session, url: str, params: dict) -> dict:
+        response = api_session.get(url, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def iter_resources(self, api_session: requests.Session, resource_type: str, filter: str = "",
+                       page_size: int = DEFAULT_REST_PAGE_SIZE, max_workers: int = 1,
+                       fields: Optional[list] = None) -> Generator[dict, None, None]:
+        """
+        Iterate over all the resources of the type, page by page.
+
+        The pages are followed with nextPageCursor when the server returns one, else with skip
+        until the count of the first page is reached or a short page is returned. With
+        max_workers > 1 and a count in the first page, up to max_workers pages are prefetched
+        concurrently, the resources are still yielded in order.
+
+        :param filter: REST filter expression, eg. "name = prod"
+        :param fields: only yield these fields of every resource
+        """
+        url = self.get_resource_url(resoure_type=resource_type)
+        params = {"pageSize": page_size}
+        if filter:
+            params["filter"] = filter
+
+        def project(results: list) -> Generator[dict, None, None]:
+            for r in results:
+                yield {f: r.get(f) for f in fields} if fields else r
+
+        page = self._resources_page(api_session, url, dict(params, skip=0))
+        results = page.get('results') or []
+        yield from project(results)
+        count = page.get('count')
+        if len(results) < page_size:
+            return
+        if max_workers > 1 and count:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                skips = iter(range(page_size, int(count), page_size))
+                pending = deque()
+                for skip in skips:
+                    pending.append(executor.submit(self._resources_page, api_session, url, dict(params, skip=skip)))
+                    if len(pending) >= max_workers:
+                        break
+                while pending:
+                    page = pending.popleft().result()
+                    skip = next(skips, None)
+                    if skip is not None:
+                        pending.append(executor.submit(self._resources_page, api_session, url, dict(params, skip=skip)))
+                    yield from project(page.get('results') or [])
+            return
+        skip = 0
+        while page.get('nextPageCursor') or len(results) == page_size:
+            skip += len(results)
+            if count is not None and skip >= int(count):
+                return
+            page_params = dict(params, cursor=page['nextPageCursor']) if page.get('nextPageCursor') \
+                else dict(params, skip=skip)
+            page = self._resources_page(api_session, url, page_params)
+            results = page.get('results') or []
+            if not results:
+                return
+            yield from project(results)
+
+    def _upsert_item(self, api_session: requests.Session, resource_type: str, obj: dict,
+                     singleton: bool) -> UpsertResult:
+        if singleton:
+            return self.create_or_update_provider(
+                api_session, "", obj, self.get_resource_url(resoure_type=resource_type))
+        return self.create_or_update_resource(
+            api_session, resource_type, resource_id=obj.get('id', ""), resource_name=obj.get('name', ""), obj=obj)
+
+    def _upsert_item_w_retry(self, api_session: requests.Session, resource_type: str, obj: dict,
+                             singleton: bool, retries: int, backoff_s: float) -> UpsertResult:
+        """
+        _upsert_item with retries. Every attempt at a singleton or at an item with a name or an id
+        looks the resource up again, a create that failed after it was processed is then updated
+        instead of created twice. Any other item is a plain POST, it is only retried on 429 and
+        connect timeouts, like request_with_retry retries a POST.
+        """
+        looked_up = bool(singleton or obj.get('id') or obj.get('name'))
+        for attempt in range(retries + 1):
+            try:
+                result = self._upsert_item(api_session, resource_type, copy.deepcopy(obj), singleton)
+                retry = result.status_code == 429 or (looked_up and result.status_code in RETRY_STATUS_CODES)
+                if not retry or attempt == retries:
+                    return result
+                logger.warning("upsert %s status %s, retrying", resource_type, result.status_code)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if attempt == retries or not (looked_up or isinstance(exc, requests.ConnectTimeout)):
+                    raise
+                logger.warning("upsert %s failed %s, retrying", resource_type, exc)
+            time.sleep(backoff_s * 2 ** attempt)
+
+    def bulk_upsert(self, api_session: requests.Session, items: list, max_workers: int = 8,
+                    retries: int = 3, backoff_s: float = 1) -> list:
+        """
+        Create or update many resources on a pool of max_workers threads.
+
+        Every item is a dict:
+            resource_type: eg. "providers", or "providers/{parent[id]}/aws/config" where the
+                           placeholders are filled from the result of the depends_on item
+            obj:           the desired resource
+            key:           optional name of the item for depends_on
+            depends_on:    key of the item that has to be upserted first, eg. the base provider
+                           of a provider config
+            singleton:     the only resource at resource_type (a provider config), upserted with
+                           create_or_update_provider instead of create_or_update_resource
+
+        Items are retried with exponential backoff, see _upsert_item_w_retry. The items depending
+        on a failed item are not run. Raises InvalidInputException for a duplicate key, an unknown
+        depends_on or a dependency cycle. Returns one result per item, in order:
+            {"key", "resourceType", "statusCode", "obj", "op", "error"}
+        """
+        keys = {}
+        for i, item in enumerate(items):
+            if item.get('key'):
+                if item['key'] in keys:
+                    raise InvalidInputException(f"Duplicate key {item['key']} of items {keys[item['key']]} and {i}")
+                keys[item['key']] = i
+        parents = {}
+        children = {}
+        for i, item in enumerate(items):
+            if item.get('depends_on'):
+                if item['depends_on'] not in keys:
+                    raise InvalidInputException(f"Unknown depends_on {item['depends_on']} of item {i}")
+                parents[i] = keys[item['depends_on']]
+                children.setdefault(parents[i], []).append(i)
+        acyclic = set()
+        for i in parents:
+            # every item has at most one parent, a chain that comes back to one of its items is a cycle
+            chain = set()
+            node = i
+            while node is not None and node not in acyclic:
+                if node in chain:
+                    raise InvalidInputException(f"Dependency cycle through item {node} ({items[node].get('key')})")
+                chain.add(node)
+                node = parents.get(node)
+            acyclic.update(chain)
+        results = [None] * len(items)
+
+        def skip(i: int, error: str) -> None:
+            results[i] = {"key": items[i].get('key'), "resourceType": items[i]['resource_type'],
+                          "statusCode": None, "obj": None, "op": None, "error": error}
+            for child in children.get(i, []):
+                skip(child, f"dependency {items[i].get('key')} failed")
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            def submit(i: int, parent: Optional[dict]):
+                resource_type = items[i]['resource_type'].format(parent=parent or {})
+                return executor.submit(self._upsert_item_w_retry, api_session, resource_type, items[i]['obj'],
+                                       items[i].get('singleton', False), retries, backoff_s), resource_type
+
+            running = {}
+            for i, item in enumerate(items):
+                if not item.get('depends_on'):
+                    future, resource_type = submit(i, None)
+                    running[future] = (i, resource_type)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i, resource_type = running.pop(future)
+                    try:
+                        status_code, obj = result = future.result()
+                    except Exception as exc:
+                        logger.error("upsert %s failed: %s", resource_type, exc)
+                        skip(i, str(exc))
+                        continue
+                    results[i] = {"key": items[i].get('key'), "resourceType": resource_type,
+                                  "statusCode": status_code, "obj": obj, "op": result.op, "error": None}
+                    if not 200 <= status_code < 300:
+                        results[i]["error"] = f"status {status_code}"
+                        for child in children.get(i, []):
+                            skip(child, f"dependency {items[i].get('key')} failed")
+                        continue
+                    for child in children.get(i, []):
+                        child_future, child_resource_type = submit(child, obj)
+                        running[child_future] = (child, child_resource_type)
+        logger.info("bulk upsert items %s failed %s", len(items), sum(1 for r in results if r["error"]))
+        return results
+
+    def create_or_update_base_provider(self, api_session: requests.Session, provider_obj: dict) -> tuple[int, dict]:
+        return self.create_or_update_resource(
+            api_session, resource_type='providers', resource_id=provider_obj.get('id', ""),
+            resource_name=provider_obj.get('name'),
+            obj=provider_obj)
+
+    def create_or_update_workday_provider_config(self, andromeda_base_url, api_session: requests.Session, provider_obj: dict) -> tuple[int, dict]:
+        """
+        This function creates or updates the cloud specific settings for a provider
+        """
+        config_url = f"{andromeda_base_url}/integrations/{provider_obj['id']}/workday"
+
+        # Base data always includes name
+        data = {
+            "name": provider_obj['name'],
+        }
+
+        # Add workday configuration if present
+        if 'workdayConfiguration' in provider_obj:
+            workday_config = provider_obj['workdayConfiguration']
+            data.update(workday_config)
+
+        # Add fileId only if present (for CSV mode)
+        if 'fileId' in provider_obj:
+            data["fileId"] = provider_obj['fileId']
+
+        response = api_session.get(config_url)
+        resource_id = ""
+        if response.status_code == 200 and response.json():
+            resource_id = response.json()['id']
+            new_config = response.json()
+            # For updates, start fresh with just the existing config and carefully merge
+            # Remove any fields that might cause duplicates
+            if 'api_config' in new_config:
+                del new_config['api_config']
+            if 'apiConfig' in new_config:
+                del new_config['apiConfig']
+            # Update with new data
+            for key, value in data.items():
+                new_config[key] = value
+            # Remove immutable fields for PUT operations (mode)
+            if 'defaultMode' in new_config:
+                del new_config['defaultMode']
+            if 'userDataMappingProfile' in new_config:
+                del new_config['userDataMappingProfile']
+        else:
+            new_config = data
+
+        op = "put" if resource_id else "post"
+
+        response = getattr(api_session, op)(config_url, json=new_config, verify=False)
+        if response.status_code != 200:
+            logger.error("config for provider op %s url %s provider %s status %s obj %s response %s",
+                        op, config_url, provider_obj['id'], response.status_code, new_config, response.json())
+        else:
+            logger.debug("config for provider op %s url %s provider %s status %s response %s",
+                        op, config_url, provider_obj['id'], response.status_code, response.json())
+        return response.status_code, response.json()
+
+    def create_or_update_provider(self,
+            api_session: requests.Session,
+            provider_id,
+            provider_config,
+            provider_url: str) -> tuple[int, dict]:
+        # check if the aws config is already present
+        response = api_session.get(provider_url)
+        #logger.debug("config for provider %s status %s obj %s",
+        #            provider_url, response.status_code, response.json())
+        resource_id = ""
+        if response.status_code == 200 and response.json():
+            existing_config = response.json()
+            if not changed_fields(existing_config, provider_config):
+                logger.debug("provider %s config %s unchanged", provider_id, provider_url)
+                return UpsertResult(response.status_code, existing_config, UPSERT_UNCHANGED)
+            resource_id = existing_config['id']
+            provider_config['id'] = resource_id
+            provider_config['updatedAt'] = existing_config['updatedAt']
+            #logger.debug("existing provider found -  provider config %s", response.json())
+        op = "put" if resource_id else "post"
+        response = getattr(api_session, op)(provider_url, json=provider_config, verify=False)
+        if response.status_code != 200:
+            logger.error("provider op:%s url:%s provider:%s status:%s obj:%s response:%s",
+                        op, provider_url, provider_id, response.status_code, provider_config,
+                        response.json())
+        return UpsertResult(response.status_code, response.json(), write_op(response.status_code, op))
+
+    def create_or_update_environment(self, api_session: requests.Session, environment_obj: dict) -> (int, dict):
+        logger.debug("creating environment %s", environment_obj['name'])
+        return self.create_or_update_resource(
+            api_session, resource_type=f"environments", resource_name=environment_obj['name'], obj=environment_obj)
+
+    def create_eligibility(
+            self, api_session: requests.Session,
+            provider_id: str,
+            eligibility_mapping: dict) -> (int, dict):
+        try:
+            url = self.get_resource_url(
+                resoure_type=f"providers/{provider_id}/eligibility")
+            response = api_session.post(url, json=eligibility_mapping, verify=False)
+            status_code, obj = response.status_code, response.json()
+            return status_code, obj
+        except:
+            raise APISessionException("Failed to create eligibility")
+
+    def accept_delete_identity_risk_inside_account(
+        self,
+        api_session: requests.Session,
+        account_id: str,
+        identity_id: str,
+        request_type: str,
+    ):
+        """
+        This function creates a post/delete request to update accepted_risk for an identity inside an account
+        """
+        url = f"{self.api_endpoint}/identities/{identity_id}/accounts/{account_id}/accepted-risk"
+
+        logger.debug(
+            "accept_delete_identity_risk_inside_account: RequestType: %s | URL: %s",
+            request_type,
+            url,
+        )
+
+        response = None
+        if request_type == "POST":
+            response = api_session.post(url)
+        elif request_type == "DELETE":
+            response = api_session.delete(url)
+        else:
+            logger.error("Invalid request_type: %s. Must be 'POST' or 'DELETE'", request_type)
+            return
+
+        logger.debug(
+            "accept_delete_identity_risk_inside_account: ResponseStatus: %s",
+            response.status_code,
+        )
+
+    def create_default_broker(self, api_session: requests.Session) -> tuple[int, dict]:
+        """
+        This function creates a default broker
+        """
+        logger.info("creating default broker")
+        url = self.get_resource_url(resoure_type=f"brokers")
+        response = api_session.get(url)
+        broker_data = {
+            "name": "test-default-broker"
+        }
+        response_json = response.json()
+        if response.status_code == 200 and response_json and response_json['count'] > 0:
+            logger.debug("default broker already exists with id %s", response_json['results'][0]['id'])
+            return response.status_code, response_json['results'][0]
+        else:
+            logger.debug("default broker does not exist, creating new one")
+            response = getattr(api_session, "post")(url, json=broker_data, verify=False)
+            return response.status_code, response.json()
+
+    def create_broker_secret(self, api_session: requests.Session, broker_id: str) -> tuple[int, dict]:
+        """
+        This function creates or updates the broker secret
+        """
+        logger.info("creating broker secret for broker %s", broker_id)
+        url = self.get_resource_url(resoure_type=f"brokers/{broker_id}/auth-config")
+        response = getattr(api_session, "post")(url)
+        return response.status_code, response.json()
+
     def get_rds_postgresql_provider(self, api_session: requests.Session):
         url = self.get_resource_url(resoure_type=f"providers")
         response = api_session.get(url)
@@ -853,23 +1564,6 @@ class APIUtils:
         response = api_session.get(url)
         return response.json()
 
-    def create_or_update_rds_postgresql_provider_config(
-        self,
-        api_session: requests.Session,
-        provider_id: str,
-        rds_postgresql_provider_obj: dict,
-    ) -> tuple[int, dict]:
-        """
-        This function creates or updates the cloud specific settings for a provider
-        """
-        url = self.get_resource_url(resoure_type=f"providers/{provider_id}/rds-postgresql/config")
-        return self.create_or_update_provider(
-            api_session=api_session,
-            provider_id=provider_id,
-            provider_config=rds_postgresql_provider_obj,
-            provider_url=url,
-        )
-
     def update_access_request_profile(self, api_session: requests.Session, access_request_profile_id: str, access_request_profile_obj: dict) -> tuple[int, dict]:
         url = self.get_resource_url(f"accessrequestprofiles/{access_request_profile_id}")
         response = api_session.put(url=url, json=access_request_profile_obj)
@@ -878,4 +1572,4 @@ class APIUtils:
     def update_account_config(self, api_session: requests.Session, provider_id: str, account_id: str, account_config_obj: dict) -> tuple[int, dict]:
         url = self.get_resource_url(f"providers/{provider_id}/accounts/{account_id}/config")
         response = api_session.put(url=url, json=account_config_obj)
-        return response.status_code, response.json()
\ No newline at end of file
+        return response.status_code, response.json()
@@ -0,0 +1,312 @@
+# Copyright 2025 Andromeda Security, Inc.
+#
+"""
+Access graph of an Andromeda inventory snapshot.
+
+The graph links identity -> group -> role@scope -> scope (account, resource group, folder,
+population) using the group memberships and the active bindings of every provider, and
+group -> eligibility -> account for the eligibilities (access that can be requested). It is
+stored as compact adjacency arrays (CSR: an offsets array and a targets array, forward and
+reverse) so reachability and reverse reachability are plain array walks.
+
+Node keys:
+    identity:<identity id>                          human, joined across providers
+    user:<provider id>:<origin user id>             human not matched to an identity
+    nhi:<service identity id>
+    group:<provider id>:<group id>
+    role:<provider id>:<role id>@<scope node key>   a role granted on a scope
+    eligibility:<provider id>:<eligibility id>      eligible, not active, access to an account
+    account|resourceGroup|folder|population:<provider id>:<scope id>
+
+Gaps: the crawl records only the number of nested groups of a group and of the members of the
+assignable groups, so nested group membership is linked only when the snapshot has the
+members.groups edges, and the assignable groups add nodes without members. The eligibilities
+are linked to their eligible groups only when crawled with eligible_groups.
+
+Example usage:
+    graph = AccessGraph.from_snapshot("/tmp/andromeda-inventory/<tenant_id>/andromeda-inventory.json")
+    for identity, path in graph.who_can_reach("account:<provider id>:<account id>").items():
+        print(identity, " -> ".join(path))
+"""
+import argparse
+import json
+import logging
+from array import array
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+SCOPE_TYPES = {
+    'AccountScopeData': 'account',
+    'ResourceGroupScopeData': 'resourceGroup',
+    'FolderScopeData': 'folder',
+    'PopulationScopeData': 'population',
+}
+IDENTITY_NODE_TYPES = ('identity', 'user', 'nhi')
+
+
+def node_type(node_key: str) -> str:
+    return node_key.split(':', 1)[0]
+
+
+class AccessGraph:
+    """
+    Directed access graph in CSR form. Build it with from_provider_map or from_snapshot.
+    """
+    def __init__(self, node_keys: list, edges: set, node_names: Optional[dict] = None):
+        self.node_keys = node_keys
+        self.node_index = {key: i for i, key in enumerate(node_keys)}
+        self.node_names = node_names or {}
+        self.offsets, self.targets = self._csr(len(node_keys), edges)
+        self.reverse_offsets, self.reverse_targets = self._csr(len(node_keys), {(d, s) for s, d in edges})
+        logger.info("access graph nodes %s edges %s", len(node_keys), len(edges))
+
+    @staticmethod
+    def _csr(num_nodes: int, edges: set) -> tuple:
+        offsets = array('L', [0] * (num_nodes + 1))
+        for src, _ in edges:
+            offsets[src + 1] += 1
+        for i in range(num_nodes):
+            offsets[i + 1] += offsets[i]
+        targets = array('L', [0] * len(edges))
+        fill = array('L', offsets[:-1])
+        for src, dst in sorted(edges):
+            targets[fill[src]] = dst
+            fill[src] += 1
+        return offsets, targets
+
+    @classmethod
+    def from_snapshot(cls, inventory_file: str) -> "AccessGraph":
+        with open(inventory_file, "r", encoding="utf-8") as f:
+            return cls.from_provider_map(json.load(f))
+
+    @classmethod
+    def from_provider_map(cls, provider_map: dict) -> "AccessGraph":
+        builder = _GraphBuilder()
+        for provider_id, provider_data in provider_map.items():
+            builder.add_provider(provider_id, provider_data)
+        return cls(builder.node_keys, builder.edges, builder.node_names)
+
+    def _walk(self, node_key: str, offsets: array, targets: array, max_depth: Optional[int]) -> dict:
+        """ BFS from node_key, returns {node index: parent node index} of the reached nodes """
+        start = self.node_index.get(node_key)
+        if start is None:
+            return {}
+        parents = {start: -1}
+        queue = deque([(start, 0)])
+        while queue:
+            node, depth = queue.popleft()
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for i in range(offsets[node], offsets[node + 1]):
+                target = targets[i]
+                if target not in parents:
+                    parents[target] = node
+                    queue.append((target, depth + 1))
+        return parents
+
+    def _filter(self, nodes, node_types: Optional[tuple]) -> list:
+        keys = [self.node_keys[n] for n in nodes]
+        if node_types:
+            keys = [k for k in keys if node_type(k) in node_types]
+        return sorted(keys)
+
+    def reachable(self, node_key: str, node_types: Optional[tuple] = None, max_depth: Optional[int] = None) -> list:
+        """ Nodes reachable from node_key, eg. the scopes an identity can access """
+        parents = self._walk(node_key, self.offsets, self.targets, max_depth)
+        return self._filter((n for n in parents if self.node_keys[n] != node_key), node_types)
+
+    def reverse_reachable(self, node_key: str, node_types: Optional[tuple] = None, max_depth: Optional[int] = None) -> list:
+        """ Nodes that can reach node_key, eg. the identities with access to an account """
+        parents = self._walk(node_key, self.reverse_offsets, self.reverse_targets, max_depth)
+        return self._filter((n for n in parents if self.node_keys[n] != node_key), node_types)
+
+    def blast_radius(self, identity_key: str) -> list:
+        """ Scopes the identity can reach through its groups, roles and eligibilities """
+        return self.reachable(identity_key, node_types=tuple(SCOPE_TYPES.values()))
+
+    def who_can_reach(self, scope_key: str, node_types: tuple = IDENTITY_NODE_TYPES) -> dict:
+        """
+        Identities that can reach the scope, each with a shortest path
+        identity -> group -> role@scope -> scope explaining how
+        """
+        parents = self._walk(scope_key, self.reverse_offsets, self.reverse_targets, None)
+        paths = {}
+        for node in parents:
+            key = self.node_keys[node]
+            if node_type(key) not in node_types:
+                continue
+            path = []
+            while node != -1:
+                path.append(self.node_keys[node])
+                node = parents[node]
+            paths[key] = path
+        return paths
+
+
+class _GraphBuilder:
+    def __init__(self):
+        self.node_keys = []
+        self.node_ids = {}
+        self.node_names = {}
+        self.edges = set()
+
+    def node(self, key: str, name: Optional[str] = None) -> int:
+        if key not in self.node_ids:
+            self.node_ids[key] = len(self.node_keys)
+            self.node_keys.append(key)
+        if name:
+            self.node_names[key] = name
+        return self.node_ids[key]
+
+    def edge(self, src_key: str, dst_key: str) -> None:
+        self.edges.add((self.node(src_key), self.node(dst_key)))
+
+    def add_provider(self, provider_id: str, provider_data: dict) -> None:
+        # origin user id -> identity id, to join the provider users to the tenant identities
+        origin_map = {}
+        for human in (provider_data.get('humans') or {}).values():
+            for origin in human.get('origins') or []:
+                if isinstance(origin, dict) and origin.get('originUserId'):
+                    origin_map[origin['originUserId']] = human['id']
+            self.node(f"identity:{human['id']}", human.get('username'))
+        for account_id, account in (provider_data.get('accounts') or {}).items():
+            self.node(f"account:{provider_id}:{account_id}", account.get('name'))
+
+        for group in (provider_data.get('groups') or {}).values():
+            group_key = f"group:{provider_id}:{group['id']}"
+            self.node(group_key, group.get('name'))
+            members = group.get('members') or {}
+            for edge in ((members.get('humanUsers') or {}).get('edges') or []):
+                self.edge(self._user_key(provider_id, edge['node'], origin_map), group_key)
+            for edge in ((members.get('serviceIdentities') or {}).get('edges') or []):
+                self.edge(f"nhi:{edge['node']['id']}", group_key)
+            # nested groups, the members of the member group are members of the group
+            for edge in ((members.get('groups') or {}).get('edges') or []):
+                self.edge(self._named_node(f"group:{provider_id}:{edge['node']['id']}", edge['node'].get('name')),
+                          group_key)
+        for assignable_group in (provider_data.get('assignableGroups') or {}).values():
+            group = assignable_group.get('groupDetails') or {}
+            if group.get('id'):
+                self.node(f"group:{provider_id}:{group['id']}", group.get('name'))
+        for eligibility in (provider_data.get('eligibilities') or {}).values():
+            self._add_eligibility(provider_id, eligibility)
+
+        active_bindings = provider_data.get('activeBindings') or {}
+        for binding in active_bindings.get('configured') or []:
+            self._add_binding(provider_id, active_bindings, binding, origin_map)
+        for binding in active_bindings.get('resolved') or []:
+            principal_key = self._principal_key(provider_id, self._resolve(active_bindings, binding, 'principal'), origin_map)
+            grant_key = self._add_binding(provider_id, active_bindings, binding, origin_map)
+            # the configured assignments the resolved binding comes from, eg. through a group
+            for edge in ((binding.get('configuredAssignments') or {}).get('edges') or []):
+                via_key = self._principal_key(
+                    provider_id, self._resolve(active_bindings, edge['node'], 'principal'), origin_map)
+                if principal_key and via_key and via_key != principal_key and grant_key:
+                    self.edge(principal_key, via_key)
+                    self.edge(via_key, grant_key)
+
+    @staticmethod
+    def _resolve(active_bindings: dict, binding: dict, field: str) -> Optional[dict]:
+        """ principal / scope of the binding, inline or from the deduplicated lookup table """
+        if binding.get(field) is not None:
+            return binding[field]
+        return (active_bindings.get(f"{field}s") or {}).get(binding.get(f"{field}Key"))
+
+    def _user_key(self, provider_id: str, origin: dict, origin_map: dict) -> str:
+        identity = origin.get('identity') or {}
+        if identity.get('id'):
+            return self._named_node(f"identity:{identity['id']}", identity.get('username'))
+        if origin.get('originUserId') in origin_map:
+            return f"identity:{origin_map[origin['originUserId']]}"
+        return self._named_node(f"user:{provider_id}:{origin.get('originUserId')}",
+                                       origin.get('originUserUsername'))
+
+    def _named_node(self, key: str, name: Optional[str]) -> str:
+        self.node(key, name)
+        return key
+
+    def _principal_key(self, provider_id: str, principal: Optional[dict], origin_map: dict) -> Optional[str]:
+        if not principal:
+            return None
+        typename = principal.get('__typename')
+        if typename == 'IdentityOriginData':
+            return self._user_key(provider_id, principal, origin_map)
+        if typename == 'ServiceIdentity':
+            return self._named_node(f"nhi:{principal['id']}", principal.get('username'))
+        if typename == 'Group':
+            return self._named_node(f"group:{provider_id}:{principal['id']}", principal.get('name'))
+        return None
+
+    def _scope_key(self, provider_id: str, scope: Optional[dict]) -> Optional[str]:
+        if not scope or scope.get('__typename') not in SCOPE_TYPES:
+            return None
+        return self._named_node(
+            f"{SCOPE_TYPES[scope['__typename']]}:{provider_id}:{scope['id']}", scope.get('name'))
+
+    def _add_eligibility(self, provider_id: str, eligibility: dict) -> None:
+        """ Add eligible group -> eligibility -> account for the eligibility """
+        if not eligibility.get('eligibilityId') or not eligibility.get('accountId'):
+            return
+        eligibility_key = self._named_node(
+            f"eligibility:{provider_id}:{eligibility['eligibilityId']}", eligibility.get('eligibilityName'))
+        self.edge(eligibility_key, self._named_node(
+            f"account:{provider_id}:{eligibility['accountId']}", eligibility.get('accountName')))
+        for edge in ((eligibility.get('eligibleGroups') or {}).get('edges') or []):
+            self.edge(self._named_node(f"group:{provider_id}:{edge['node']['id']}", edge['node'].get('name')),
+                      eligibility_key)
+
+    def _add_binding(self, provider_id: str, active_bindings: dict, binding: dict, origin_map: dict) -> Optional[str]:
+        """ Add principal -> role@scope -> scope for the binding, returns the role@scope node key """
+        scope_key = self._scope_key(provider_id, self._resolve(active_bindings, binding, 'scope'))
+        role = binding.get('roleData') or {}
+        role_id = role.get('policyId') or binding.get('roleId') or binding.get('roleName')
+        if not scope_key or not role_id:
+            return None
+        grant_key = self._named_node(
+            f"role:{provider_id}:{role_id}@{scope_key}", role.get('policyName') or binding.get('roleName'))
+        self.edge(grant_key, scope_key)
+        principal_key = self._principal_key(provider_id, self._resolve(active_bindings, binding, 'principal'), origin_map)
+        if principal_key:
+            self.edge(principal_key, grant_key)
+        return grant_key
+
+
+def main():
+    HELP_STR = """
+    This script answers access questions over an inventory snapshot.
+
+    Example:
+        # who can reach the account, and through which group and role
+        python3 sdk/as_access_graph.py --snapshot=andromeda-inventory.json --who_can_reach=account:<provider id>:<account id>
+        # which scopes can the identity reach
+        python3 sdk/as_access_graph.py --snapshot=andromeda-inventory.json --blast_radius=identity:<identity id>
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=(HELP_STR)
+    )
+    parser.add_argument('--snapshot', required=True,
+                        help='andromeda-inventory.json downloaded by as_inventory.py')
+    parser.add_argument('--who_can_reach',
+                        help='Scope node key, eg. account:<provider id>:<account id>')
+    parser.add_argument('--blast_radius',
+                        help='Identity node key, eg. identity:<identity id>')
+    parser.add_argument('--logLevel', default="INFO",
+                        help='log level for the module when run as a script')
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.logLevel),
+                        format='%(asctime)s:%(levelname)s:%(module)s:%(lineno)s: %(message)s')
+
+    graph = AccessGraph.from_snapshot(args.snapshot)
+    result = {}
+    if args.who_can_reach:
+        result["whoCanReach"] = graph.who_can_reach(args.who_can_reach)
+    if args.blast_radius:
+        result["blastRadius"] = graph.blast_radius(args.blast_radius)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,25 +4,77 @@ import argparse
 import os
 import logging
 from typing import Generator, Optional
+import copy
 import functools
+import hashlib
 import json
+import threading
 import csv
 import time
 import traceback
 import warnings
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 import requests
 from gql import Client, gql
 from gql.dsl import (DSLQuery, dsl_gql, DSLSchema, DSLInlineFragment, DSLMetaField)
+from gql.transport import Transport
 from gql.transport.requests import RequestsHTTPTransport
 from api.graphql import graphql_query_snippets as gql_snippets
 from gql.transport.exceptions import TransportQueryError
+from graphql import ExecutionResult, OperationType, get_operation_ast, print_ast
 from sdk.api_utils import APIUtils
+from sdk.as_inventory_diff import snapshot_paths, write_snapshot_index
+from sdk.rate_limiter import RateLimiter
+from sdk.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
 DEFAULT_PAGE_SIZE = 100
+# upper bound of the events fetched per as_events_follow poll
+MAX_EVENTS_PER_POLL = 100000
+# values per `in` filter of bulk_lookup, keeps every request well under the request size limits
+DEFAULT_BULK_LOOKUP_CHUNK_SIZE = 100
+# entity name of bulk_lookup -> iterator used for the lookup. The provider_* iterators need a provider_id.
+BULK_LOOKUP_ITRS = {
+    'humans': 'as_humans_itr',
+    'nhis': 'as_non_humans_identities_itr',
+    'identities': 'identities_itr',
+    'groups': 'as_groups_itr',
+    'providers': 'as_provider_itr',
+    'provider_humans': 'provider_humans_itr',
+    'provider_nhis': 'provider_nhis_itr',
+}
+
+
+def utc_time(value: str) -> datetime:
+    """ Parse an ISO timestamp, eg. an event time, naive timestamps are local time """
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(timezone.utc)
+
+
+def format_time(value: datetime) -> str:
+    """ Timestamp in the format of the eventTime filters """
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def load_state(state_file: str) -> dict:
+    """ Load the json state of an events follow or export, {} when there is none """
+    if not state_file or not os.path.exists(state_file):
+        return {}
+    with open(state_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state_file: str, state: dict) -> None:
+    """ Write and rename, so a crash does not leave a truncated state behind """
+    if not state_file:
+        return
+    with open(f"{state_file}.tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(f"{state_file}.tmp", state_file)
+
 
 class AndromedaProvider(dict):
     def __init__(self):
@@ -43,6 +95,88 @@ class AndromedaProvider(dict):
         self['eligibilities'] = {}
 
 
+class SessionHTTPTransport(RequestsHTTPTransport):
+    """
+    RequestsHTTPTransport running on the API session. The gql Client connects and closes the
+    transport around every query, which with RequestsHTTPTransport means a new session and
+    connection pool per query. This transport reuses the API session instead, with its
+    connection pool, headers and cookies.
+
+    The identical queries (same document, variables and operation) run concurrently by the
+    workers share one request, the copies of the transport made per thread share the
+    single_flight. Only query operations are coalesced, every mutation is sent. Set it to
+    None to run every query.
+    """
+    def __init__(self, url: str, api_session: requests.Session, **kwargs):
+        super().__init__(url=url, **kwargs)
+        self.api_session = api_session
+        self.single_flight: Optional[SingleFlight] = SingleFlight()
+        self._init_kwargs = kwargs
+
+    def new_transport(self) -> "SessionHTTPTransport":
+        """ A transport with the same settings, API session and single_flight, for another thread """
+        transport = SessionHTTPTransport(self.url, self.api_session, **self._init_kwargs)
+        transport.single_flight = self.single_flight
+        return transport
+
+    def execute(self, document, variable_values=None, operation_name=None, **kwargs) -> ExecutionResult:
+        operation = get_operation_ast(document, operation_name)
+        if self.single_flight is None or operation is None or operation.operation != OperationType.QUERY:
+            return super().execute(document, variable_values, operation_name, **kwargs)
+        key = (print_ast(document), json.dumps(variable_values, sort_keys=True, default=str), operation_name)
+        execute = functools.partial(super().execute, document, variable_values, operation_name, **kwargs)
+        return self.single_flight.do(key, execute, share_fn=copy.deepcopy)
+
+    def connect(self):
+        self.session = self.api_session
+
+    def close(self):
+        # the API session is shared, it is not closed with the transport
+        self.session = None
+
+
+class SerialTransport(Transport):
+    """
+    Shares a transport that cannot be copied per thread between the clients of the threads.
+    The queries run one at a time, each one connects and closes the wrapped transport. The
+    other attributes (eg. the queries recorded by a test transport) are the wrapped ones.
+    """
+    def __init__(self, transport: Transport):
+        self.transport = transport
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    def execute(self, document, *args, **kwargs) -> ExecutionResult:
+        with self._lock:
+            self.transport.connect()
+            try:
+                return self.transport.execute(document, *args, **kwargs)
+            finally:
+                self.transport.close()
+
+
+def clone_transport(transport: Transport) -> Optional[Transport]:
+    """ A transport with the settings of transport for another thread, None when it cannot be copied """
+    if isinstance(transport, SessionHTTPTransport):
+        return transport.new_transport()
+    if type(transport) is RequestsHTTPTransport:
+        return RequestsHTTPTransport(
+            transport.url, headers=transport.headers, cookies=transport.cookies, auth=transport.auth,
+            use_json=transport.use_json, timeout=transport.default_timeout, verify=transport.verify,
+            retries=transport.retries, method=transport.method,
+            retry_backoff_factor=transport.retry_backoff_factor,
+            retry_status_forcelist=transport.retry_status_forcelist, **transport.kwargs)
+    return None
+
+
 class AndromedaInventory(dict):
     """
     AndromedaInventory is a class that fetches the inventory from the Andromeda API.
@@ -50,26 +184,93 @@ class AndromedaInventory(dict):
     """
     def __init__(self, gql_client: Client, api_session: requests.Session, output_dir: str = ".",
                  pacer_duration_s: int = 2, default_page_size: int = DEFAULT_PAGE_SIZE, as_endpoint: str= "http://localhost:8080",
-                 gql_endpoint: str = "http://localhost:8088/graphql"):
+                 gql_endpoint: str = "http://localhost:8088/graphql", gql_schema: Optional[str] = None,
+                 rate_limiter: Optional[RateLimiter] = None, identity_cache: bool = False,
+                 account_bulk_size: int = 0, dedup_bindings: bool = False):
         super().__init__()
+        self._thread_local = threading.local()
         self.gql_client = gql_client
         self.api_session = api_session
-        # check and create the output directory
         self.pacer_duration_s = pacer_duration_s
         self['provider_map'] = {}
         self.default_page_size = default_page_size
         self.as_endpoint = as_endpoint
-        if not self.gql_client:
-            self.gql_client = self.get_gql_client(api_session, gql_endpoint)
-        self.tenant_id = self.get_tenant_id(api_session, as_endpoint)
-        self.output_dir = f"{output_dir}/{self.tenant_id}"
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
+        self.rate_limiter = rate_limiter
+        # tenant-wide identity cache keyed by identity id. When enabled, the provider and account
+        # scoped queries select only their own fields and the shared identity attributes are joined from here.
+        self.use_identity_cache = identity_cache
+        self.identity_cache = {}
+        # ids the Identities query did not return, joined without the identity attributes
+        self.identity_cache_misses = set()
+        # number of accounts whose humans and nhis are fetched per aliased query, 0 queries every account separately
+        self.account_bulk_size = account_bulk_size
+        # store the principals and scopes of the active bindings once, in principals / scopes
+        # tables referenced by principalKey / scopeKey, instead of inline in every binding
+        self.dedup_bindings = dedup_bindings
+        # the gql client, the tenant id and the output directory are resolved on first use,
+        # so the scripts that only need a few calls do not pay for the schema and tenant lookups
+        self.gql_endpoint = gql_endpoint
+        self.gql_schema = gql_schema
+        self.base_output_dir = output_dir
+        self._tenant_id = None
+        self._output_dir = None
+        self._lazy_lock = threading.Lock()
 
     @property
     def provider_map(self):
         return self['provider_map']
 
+    @property
+    def tenant_id(self) -> str:
+        if self._tenant_id is None:
+            with self._lazy_lock:
+                if self._tenant_id is None:
+                    self._tenant_id = self.get_tenant_id(self.api_session, self.as_endpoint)
+        return self._tenant_id
+
+    @property
+    def output_dir(self) -> str:
+        """ <output_dir>/<tenant_id>, created on first use """
+        if self._output_dir is None:
+            output_dir = f"{self.base_output_dir}/{self.tenant_id}"
+            os.makedirs(output_dir, exist_ok=True)
+            self._output_dir = output_dir
+        return self._output_dir
+
+    @property
+    def gql_client(self) -> Client:
+        """
+        The gql Client can only run one query at a time, every other thread gets its
+        own client sharing the schema of the main one, with a copy of its transport (see
+        clone_transport): a new SessionHTTPTransport on the same API session or a
+        RequestsHTTPTransport with the same settings. The other transports cannot be copied,
+        the clients of all the threads share them through a SerialTransport and their
+        queries run one at a time. The main client is created on first use when none was
+        passed in.
+        """
+        client = getattr(self._thread_local, 'gql_client', None)
+        if client is None and self._gql_client is None:
+            with self._lazy_lock:
+                if self._gql_client is None:
+                    self._gql_client = self.get_gql_client(self.api_session, self.gql_endpoint, self.gql_schema)
+                    self._thread_local.gql_client = self._gql_client
+            client = getattr(self._thread_local, 'gql_client', None)
+        if client is None and self._gql_client is not None:
+            transport = self._serial_transport or clone_transport(self._gql_client.transport)
+            client = Client(transport=transport, schema=self._gql_client.schema)
+            self._thread_local.gql_client = client
+        return client
+
+    @gql_client.setter
+    def gql_client(self, gql_client: Client) -> None:
+        self._gql_client = gql_client
+        self._serial_transport = None
+        if gql_client is not None and clone_transport(gql_client.transport) is None:
+            self._serial_transport = SerialTransport(gql_client.transport)
+            gql_client = Client(transport=self._serial_transport, schema=gql_client.schema,
+                                fetch_schema_from_transport=gql_client.fetch_schema_from_transport)
+        self._thread_local.gql_client = gql_client
+
     def get_tenant_id(self, api_session: requests.Session, as_endpoint: str):
         """
         Get the tenant ID from the API session
@@ -87,13 +288,17 @@ class AndromedaInventory(dict):
             tenant_id = response.json()["tenantId"]
             return tenant_id
 
-    def get_gql_client(self, api_session: requests.Session, graphql_url: str):
-        """ Create GraphQL client and schema from the API session """
+    @staticmethod
+    def get_gql_client(api_session: requests.Session, graphql_url: str, schema: Optional[str] = None):
+        """
+        Create GraphQL client and schema from the API session.
+        When the schema SDL is passed in (eg. cached by the orchestrator) it is used as is
+        and the introspection round trip is skipped.
+        """
         logger.debug("Creating GraphQL client %s", graphql_url)
-        transport = RequestsHTTPTransport(url=graphql_url,
-                                    headers=api_session.headers,
-                                    cookies=api_session.cookies,
-                                    timeout=240)
+        transport = SessionHTTPTransport(url=graphql_url, api_session=api_session, timeout=240)
+        if schema:
+            return Client(transport=transport, schema=schema)
         client = Client(transport=transport, fetch_schema_from_transport=True)
         introspection = "{__schema{queryType{name}}}"
         client.execute(gql(introspection))
@@ -120,11 +325,13 @@ class AndromedaInventory(dict):
         max_items = kwargs.get('max_count', 10000)
         skip = 0
         rate_limit = kwargs.get('rate_limit', 1)
-        for pop_arg in ['page_size', 'skip']:
+        for pop_arg in ['page_size', 'skip', 'max_count', 'rate_limit']:
             kwargs.pop(pop_arg, None)
         for skip in range(0, max_items, page_size):
             try:
                 #logger.debug("Fetching items: page_size %s skip %s", page_size, skip)
+                if self.rate_limiter:
+                    self.rate_limiter.wait()
                 items = base_fn(page_size, skip, *args, **kwargs)
             except AssertionError:
                 raise
@@ -725,9 +932,103 @@ class AndromedaInventory(dict):
         for assignment in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size):
             yield assignment
 
+    @staticmethod
+    def _identity_detail_fields(ds: DSLSchema) -> list:
+        """
+        Identity attributes shared by every provider the identity shows up in
+        """
+        return [
+            *gql_snippets.list_trivial_fields_Identity(ds),
+            ds.Identity.origins(
+                pageArgs={"pageSize": 100},
+            ).select(
+                ds.IdentityOriginDataConnection.edges.select(
+                    ds.IdentityOriginDataEdge.node.select(
+                        *gql_snippets.list_trivial_fields_IdentityOriginData(ds),
+                        ds.IdentityOriginData.identity.select(
+                            *gql_snippets.list_trivial_fields_Identity(ds),
+                        )
+                    ),
+                ),
+            ),
+            ds.Identity.orgInfo.select(
+                *gql_snippets.list_trivial_fields_HrIdentityInfo(ds),
+            ),
+            ds.Identity.opsInsights.select(
+                *gql_snippets.list_trivial_fields_IdentityOpsInsightData(ds),
+            ),
+            ds.Identity.riskFactorsData.select(
+                *gql_snippets.list_trivial_fields_RiskFactorData(ds),
+            ),
+        ]
+
+    def identity_cache_base_fn(self, filters: dict, page_size: int = 100, skip: int = 0) -> Generator[list, None, None]:
+        """
+        Fetch the full identity payload used to fill the identity cache
+        """
+        ds = DSLSchema(self.gql_client.schema)
+        query = dsl_gql(DSLQuery(
+            ds.Query.Identities(
+                pageArgs={"pageSize": page_size, "skip": skip},
+                filters=filters
+            ).select(
+                ds.IdentitiesConnection.edges.select(
+                    ds.IdentityEdge.node.select(*self._identity_detail_fields(ds)),
+                ),
+            )
+        ))
+        response = self.gql_client.execute(query, get_execution_result=True).formatted
+        identities = [item['node'] for item in response["data"]['Identities']['edges']]
+        for identity in identities:
+            identity['origins'] = [origin['node'] for origin in identity['origins']['edges']]
+        return identities
+
+    def _cache_identities(self, identity_ids: list, page_size: int = None) -> None:
+        """
+        Fetch the identities that are not in the identity cache yet, one batch query per page of ids
+        """
+        page_size = page_size if page_size else self.default_page_size
+        missing = list(dict.fromkeys(i for i in identity_ids
+                                     if i and i not in self.identity_cache and i not in self.identity_cache_misses))
+        for start in range(0, len(missing), page_size):
+            batch = missing[start:start + page_size]
+            if self.rate_limiter:
+                self.rate_limiter.wait()
+            for identity in self.identity_cache_base_fn({"id": {"in": batch}}, page_size=len(batch), skip=0):
+                self.identity_cache[identity['id']] = identity
+        if missing:
+            logger.debug("identity cache: fetched %s identities, cache size %s", len(missing), len(self.identity_cache))
+
+    def _join_cached_identity(self, item: dict, fields: Optional[list] = None) -> dict:
+        """
+        Return the provider or account scoped item joined with the cached identity attributes.
+        The join is a shallow copy so the nested identity data is shared across providers.
+        """
+        identity_id = item.get('id')
+        cached = self.identity_cache.get(identity_id)
+        if cached is None and identity_id and identity_id not in self.identity_cache_misses:
+            # not returned by the batch query, eg. created since, fetch it on its own once
+            self._cache_identities([identity_id])
+            cached = self.identity_cache.get(identity_id)
+            if cached is None:
+                self.identity_cache_misses.add(identity_id)
+                logger.warning("identity %s not found, returned without the identity attributes", identity_id)
+        if cached is None:
+            return item
+        if fields is None:
+            joined = dict(cached)
+        else:
+            joined = {field: cached[field] for field in fields if field in cached}
+        joined.update(item)
+        return joined
+
     def provider_humans_base_fn(self, provider_id: str, provider_data: dict, filters: dict,
                                 page_size: int = 100, skip: int = 0) ->Generator[list, None, None]:
         ds = DSLSchema(self.gql_client.schema)
+        if self.use_identity_cache:
+            identity_fields = [ds.Identity.id(), ds.Identity.username()]
+        else:
+            identity_fields = self._identity_detail_fields(ds)
         query = dsl_gql(DSLQuery(
             ds.Query.Provider(
                 id=provider_id
@@ -736,30 +1037,7 @@ class AndromedaInventory(dict):
                     pageArgs={"pageSize": page_size, "skip": skip},
                     filters=filters).select(
                     ds.ProviderIdentitiesConnection.edges.select(
-                        ds.ProviderIdentityEdge.node.select(
-                            *gql_snippets.list_trivial_fields_Identity(ds),
-                            ds.Identity.origins(
-                                pageArgs={"pageSize": 100},
-                            ).select(
-                                ds.IdentityOriginDataConnection.edges.select(
-                                    ds.IdentityOriginDataEdge.node.select(
-                                        *gql_snippets.list_trivial_fields_IdentityOriginData(ds),
-                                        ds.IdentityOriginData.identity.select(
-                                            *gql_snippets.list_trivial_fields_Identity(ds),
-                                        )
-                                    ),
-                                ),
-                            ),
-                            ds.Identity.orgInfo.select(
-                                *gql_snippets.list_trivial_fields_HrIdentityInfo(ds),
-                            ),
-                            ds.Identity.opsInsights.select(
-                                *gql_snippets.list_trivial_fields_IdentityOpsInsightData(ds),
-                            ),
-                            ds.Identity.riskFactorsData.select(
-                                *gql_snippets.list_trivial_fields_RiskFactorData(ds),
-                            ),
-                        ),
+                        ds.ProviderIdentityEdge.node.select(*identity_fields),
                         ds.ProviderIdentityEdge.identityProviderData.select(
                             *gql_snippets.list_trivial_fields_IdentityProviderData(ds),
                             # ds.IdentityProviderData.eligiblePolicies.select(
@@ -796,17 +1074,24 @@ class AndromedaInventory(dict):
             human = item['node']
             human['identityProviderData'] = item['identityProviderData']
             humans.append(human)
-        for human in humans:
-            human['origins'] = [origin['node'] for origin in human['origins']['edges']]
+        if self.use_identity_cache:
+            self._cache_identities([human['id'] for human in humans])
+            humans = [self._join_cached_identity(human) for human in humans]
+        else:
+            for human in humans:
+                human['origins'] = [origin['node'] for origin in human['origins']['edges']]
         logger.debug("num identities returned %s", len(identityNodes))
         return humans
 
     def provider_humans_itr(self, provider_id: str, provider_data: dict,
-                            filters=None, page_size: int = None) -> Generator[dict, None, None]:
+                            filters=None, page_size: int = None, **kwargs) -> Generator[dict, None, None]:
+        """
+        kwargs are passed to as_gql_generic_itr, eg. max_count to go past the default 10000 humans
+        """
         page_size = page_size if page_size else self.default_page_size
         partial_fn_itr = functools.partial(
             self.provider_humans_base_fn, provider_id, provider_data, filters)
-        for human in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size):
+        for human in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size, **kwargs):
             yield human
 
     def as_humans_base_fn(self, filters: dict,
@@ -869,13 +1154,13 @@ class AndromedaInventory(dict):
         :param filters: filters to apply to the query
         :param page_size: page size to use for the query
         :param args: additional arguments to pass to the query
-        :param kwargs: additional keyword arguments to pass to the query
+        :param kwargs: additional keyword arguments to pass to as_gql_generic_itr, eg. max_count
         :return: generator of human dictionaries
         """
         page_size = page_size if page_size else self.default_page_size
         partial_fn_itr = functools.partial(
             self.as_humans_base_fn, filters)
-        yield from self.as_gql_generic_itr(partial_fn_itr, page_size=page_size)
+        yield from self.as_gql_generic_itr(partial_fn_itr, page_size=page_size, **kwargs)
 
     def as_non_humans_identities_base_fn(
             self, filters: dict, page_size: int = 100, skip: int = 0) ->Generator[list, None, None]:
@@ -1041,12 +1326,13 @@ class AndromedaInventory(dict):
             return []
 
     def as_provider_groups_itr(self, provider_id: str, provider_data: dict,
-                            filters=None, page_size: int = None) -> Generator[dict, None, None]:
+                            filters=None, page_size: int = None, **kwargs) -> Generator[dict, None, None]:
+        """ kwargs are passed to as_gql_generic_itr, eg. max_count """
         page_size = page_size if page_size else self.default_page_size
         logger.debug("Fetching groups for provider %s filters %s", provider_id, filters)
         partial_fn_itr = functools.partial(
             self.provider_groups_base_fn, provider_id, provider_data, filters)
-        for item in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size):
+        for item in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size, **kwargs):
             yield item
 
 
@@ -1293,11 +1579,11 @@ class AndromedaInventory(dict):
             return []
 
     def provider_assignable_policies_itr(self, provider_id: str, provider_data: dict,
-                                        filters=None, page_size: int = None) -> Generator[dict, None, None]:
+                                        filters=None, page_size: int = None, **kwargs) -> Generator[dict, None, None]:
         page_size = page_size if page_size else self.default_page_size
         partial_fn_itr = functools.partial(
             self.provider_assignable_policies_base_fn, provider_id, provider_data, filters)
-        for item in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size):
+        for item in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size, **kwargs):
             yield item
 
     def provider_assignable_groups_base_fn(self, provider_id: str, provider_data: dict, filters: dict,
@@ -1420,11 +1706,12 @@ class AndromedaInventory(dict):
                      response["data"]['Provider']['name'],len(nodes))
         return items
     def provider_assignable_groups_itr(self, provider_id: str, provider_data: dict,
-                                        filters=None, page_size: int = None) -> Generator[dict, None, None]:
+                                        filters=None, page_size: int = None, **kwargs) -> Generator[dict, None, None]:
+        """ kwargs are passed to as_gql_generic_itr, eg. max_count """
         page_size = page_size if page_size else self.default_page_size
         partial_fn_itr = functools.partial(
             self.provider_assignable_groups_base_fn, provider_id, provider_data, filters)
-        for item in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size):
+        for item in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size, **kwargs):
             yield item
 
     def provider_assignable_groups_with_members_itr(self, provider_id: str, provider_data: dict,
@@ -1435,6 +1722,37 @@ class AndromedaInventory(dict):
         for item in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size):
             yield item
 
+    def _account_humans_edges(self, ds: DSLSchema):
+        if self.use_identity_cache:
+            identity_fields = [ds.Identity.id(), ds.Identity.username()]
+        else:
+            identity_fields = gql_snippets.list_trivial_fields_Identity(ds)
+        return ds.AccountIdentitiesConnection.edges.select(
+            ds.AccountIdentityEdge.node.select(*identity_fields),
+            ds.AccountIdentityEdge.identityAccountData.select(
+                *gql_snippets.list_trivial_fields_IdentityAccountData(ds),
+
+                ds.IdentityAccountData.opsInsights.select(
+                    *gql_snippets.list_trivial_fields_IdentityOpsInsightData(ds),
+                ),
+                ds.IdentityAccountData.riskFactorsData.select(
+                    *gql_snippets.list_trivial_fields_RiskFactorData(ds),
+                ),
+            ),
+        )
+
+    def _account_humans_from_edges(self, ds: DSLSchema, identityNodes: list) -> list:
+        humans = []
+        for node in identityNodes:
+            human = node['node']
+            human['identityAccountData'] = node['identityAccountData']
+            humans.append(human)
+        if self.use_identity_cache:
+            self._cache_identities([human['id'] for human in humans])
+            trivial_fields = [field.name for field in gql_snippets.list_trivial_fields_Identity(ds)]
+            humans = [self._join_cached_identity(human, trivial_fields) for human in humans]
+        return humans
+
     def account_humans_base_fn(self, provider_id: str, account_id: str, account_data: dict, filters: dict,
                                 page_size: int = 100, skip: int = 0) ->Generator[list, None, None]:
         ds = DSLSchema(self.gql_client.schema)
@@ -1446,21 +1764,7 @@ class AndromedaInventory(dict):
                 ds.Account.identities(
                     pageArgs={"pageSize": page_size, "skip": skip},
                     filters=filters).select(
-                    ds.AccountIdentitiesConnection.edges.select(
-                        ds.AccountIdentityEdge.node.select(
-                            *gql_snippets.list_trivial_fields_Identity(ds),
-                        ),
-                        ds.AccountIdentityEdge.identityAccountData.select(
-                            *gql_snippets.list_trivial_fields_IdentityAccountData(ds),
-
-                            ds.IdentityAccountData.opsInsights.select(
-                                *gql_snippets.list_trivial_fields_IdentityOpsInsightData(ds),
-                            ),
-                            ds.IdentityAccountData.riskFactorsData.select(
-                                *gql_snippets.list_trivial_fields_RiskFactorData(ds),
-                            ),
-                        ),
-                    ),
+                    self._account_humans_edges(ds),
                     ds.AccountIdentitiesConnection.pageInfo.select(
                         *gql_snippets.list_trivial_fields_PageInfo(ds),
                     )
@@ -1470,7 +1774,7 @@ class AndromedaInventory(dict):
         try:
             response = self.gql_client.execute(query, get_execution_result=True).formatted
             identityNodes = response["data"]['Account']['identities']['edges']
-            humans = [node['node'] for node in identityNodes]
+            humans = self._account_humans_from_edges(ds, identityNodes)
             logger.debug("num identities returned %s", len(identityNodes))
             return humans
         except TransportQueryError as e:
@@ -1495,6 +1799,26 @@ class AndromedaInventory(dict):
             logger.error("Error fetching account humans for provider %s account %s with error %s",
                          provider_id, account_data['name'], e)
 
+    def _account_nhis_edges(self, ds: DSLSchema):
+        return ds.AccountServiceIdentitiesConnection.edges.select(
+            ds.AccountServiceIdentityEdge.node.select(
+                *gql_snippets.list_trivial_fields_ServiceIdentity(ds),
+            ),
+            ds.AccountServiceIdentityEdge.serviceIdentityAccountData.select(
+                *gql_snippets.list_trivial_fields_ServiceIdentityAccountData(ds),
+
+                ds.ServiceIdentityAccountData.opsInsights.select(
+                    *gql_snippets.list_trivial_fields_ServiceIdentityOpsInsightData(ds),
+                ),
+                ds.ServiceIdentityAccountData.riskFactorsData.select(
+                    *gql_snippets.list_trivial_fields_ServiceIdentityRiskFactorData(ds),
+                ),
+            ),
+        )
+
+    def _account_nhis_from_edges(self, ds: DSLSchema, identityNodes: list) -> list:
+        return [node['node'] for node in identityNodes]
+
     def account_nhis_base_fn(self, provider_id: str, account_id: str, account_data: dict, filters: dict,
                                 page_size: int = 100, skip: int = 0) ->Generator[list, None, None]:
         ds = DSLSchema(self.gql_client.schema)
@@ -1506,21 +1830,7 @@ class AndromedaInventory(dict):
                 ds.Account.serviceIdentities(
                     pageArgs={"pageSize": page_size, "skip": skip},
                     filters=filters).select(
-                    ds.AccountServiceIdentitiesConnection.edges.select(
-                        ds.AccountServiceIdentityEdge.node.select(
-                            *gql_snippets.list_trivial_fields_ServiceIdentity(ds),
-                        ),
-                        ds.AccountServiceIdentityEdge.serviceIdentityAccountData.select(
-                            *gql_snippets.list_trivial_fields_ServiceIdentityAccountData(ds),
-
-                            ds.ServiceIdentityAccountData.opsInsights.select(
-                                *gql_snippets.list_trivial_fields_ServiceIdentityOpsInsightData(ds),
-                            ),
-                            ds.ServiceIdentityAccountData.riskFactorsData.select(
-                                *gql_snippets.list_trivial_fields_ServiceIdentityRiskFactorData(ds),
-                            ),
-                        ),
-                    ),
+                    self._account_nhis_edges(ds),
                     ds.AccountServiceIdentitiesConnection.pageInfo.select(
                         *gql_snippets.list_trivial_fields_PageInfo(ds),
                     )
@@ -1530,7 +1840,7 @@ class AndromedaInventory(dict):
         try:
             response = self.gql_client.execute(query, get_execution_result=True).formatted
             identityNodes = response["data"]['Account']['serviceIdentities']['edges']
-            nhis = [node['node'] for node in identityNodes]
+            nhis = self._account_nhis_from_edges(ds, identityNodes)
             logger.debug("num identities returned %s", len(identityNodes))
             return nhis
         except TransportQueryError as e:
@@ -1555,6 +1865,38 @@ class AndromedaInventory(dict):
             logger.error("Error fetching account humans for provider %s account %s with error %s",
                          provider_id, account_data['name'], e)
 
+    def accounts_identities_bulk_base_fn(self, provider_id: str, connection: str, account_pages: list,
+                                         filters: dict, page_size: int = 100) -> dict:
+        """
+        Fetch a page of humans (connection 'identities') or nhis (connection 'serviceIdentities')
+        of many accounts in one query, one aliased Account field per (account_id, skip) in account_pages.
+        Returns a dict of account_id to the list of humans or nhis.
+        """
+        ds = DSLSchema(self.gql_client.schema)
+        if connection == 'identities':
+            edges_fn, from_edges_fn = self._account_humans_edges, self._account_humans_from_edges
+        else:
+            edges_fn, from_edges_fn = self._account_nhis_edges, self._account_nhis_from_edges
+        account_fields = []
+        for n, (account_id, skip) in enumerate(account_pages):
+            account_fields.append(
+                ds.Query.Account(
+                    providerId=provider_id,
+                    id=account_id
+                ).alias(f"account{n}").select(
+                    getattr(ds.Account, connection)(
+                        pageArgs={"pageSize": page_size, "skip": skip},
+                        filters=filters).select(edges_fn(ds))
+                )
+            )
+        query = dsl_gql(DSLQuery(*account_fields))
+        response = self.gql_client.execute(query, get_execution_result=True).formatted
+        results = {}
+        for n, (account_id, skip) in enumerate(account_pages):
+            account = response["data"].get(f"account{n}")
+            results[account_id] = from_edges_fn(ds, account[connection]['edges']) if account else []
+        return results
+
     def provider_nhis_base_fn(self, provider_id: str, provider_data: dict, filters: dict,
                                 page_size: int = 100, skip: int = 0) ->Generator[list, None, None]:
         ds = DSLSchema(self.gql_client.schema)
@@ -1685,8 +2027,19 @@ class AndromedaInventory(dict):
             yield item
 
     def provider_eligibilities_base_fn(self, provider_id: str, provider_data: dict, filters: dict,
-                                page_size: int = 100, skip: int = 0) ->Generator[list, None, None]:
+                                page_size: int = 100, skip: int = 0,
+                                eligible_groups: bool = False) ->Generator[list, None, None]:
+        """
+        with eligible_groups the id and name of the eligible groups are selected as well
+        """
         ds = DSLSchema(self.gql_client.schema)
+        extra_fields = []
+        if eligible_groups:
+            extra_fields.append(ds.PolicyEligibilityMapping.eligibleGroups.select(
+                ds.GroupsConnection.edges.select(
+                    ds.GroupDataEdge.node.select(ds.Group.id, ds.Group.name),
+                ),
+            ))
         query = dsl_gql(DSLQuery(
             ds.Query.Provider(
                 id=provider_id
@@ -1700,6 +2053,7 @@ class AndromedaInventory(dict):
                             ds.PolicyEligibilityMapping.provisioningGroupConfiguration.select(
                                 *gql_snippets.list_trivial_fields_ProvisioningGroupConfiguration(ds),
                             ),
+                            *extra_fields,
                         ),
                     ),
                     ds.PolicyEligibilityMappingsConnection.pageInfo.select(
@@ -1715,27 +2069,93 @@ class AndromedaInventory(dict):
         return eligibilities
 
     def provider_eligibilities_itr(self, provider_id: str, provider_data: dict,
-                            filters=None, page_size: int = None) -> Generator[dict, None, None]:
+                            filters=None, page_size: int = None, eligible_groups: bool = False,
+                            **kwargs) -> Generator[dict, None, None]:
         page_size = page_size if page_size else self.default_page_size
         partial_fn_itr = functools.partial(
-            self.provider_eligibilities_base_fn, provider_id, provider_data, filters)
-        for eligibility in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size):
+            self.provider_eligibilities_base_fn, provider_id, provider_data, filters,
+            eligible_groups=eligible_groups)
+        for eligibility in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size, **kwargs):
             yield eligibility
 
-    def download_inventory(self, provider_id: str = "", use_cached: bool = False) -> str:
+    def _crawl_params(self, provider_id: str) -> dict:
+        """ The options that change the content of the snapshot """
+        return {
+            "tenantId": self.tenant_id,
+            "providerId": provider_id,
+            "pageSize": self.default_page_size,
+            "identityCache": self.use_identity_cache,
+            "accountBulkSize": self.account_bulk_size,
+            "dedupBindings": self.dedup_bindings,
+        }
+
+    def _load_cached_inventory(self, crawl_params: dict, max_age_s: Optional[int]) -> bool:
+        """
+        Load the inventory snapshot into provider_map if it was crawled with the same
+        parameters and is not older than max_age_s. Returns True on a cache hit. The snapshot
+        is loaded whole, provider_map holds all of it anyway.
+        """
+        meta_file = f"{self.inventory_data_file[:-len('.json')]}.meta.json"
+        if not os.path.exists(self.inventory_data_file) or not os.path.exists(meta_file):
+            logger.info("No cached inventory %s", self.inventory_data_file)
+            return False
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+        age_s = time.time() - meta.get("crawledAt", 0)
+        if meta.get("crawlParams") != crawl_params:
+            logger.info("Cached inventory %s crawled with %s, not %s",
+                        self.inventory_data_file, meta.get("crawlParams"), crawl_params)
+            return False
+        if max_age_s is not None and age_s > max_age_s:
+            logger.info("Cached inventory %s is %ds old, max age %ds", self.inventory_data_file, age_s, max_age_s)
+            return False
+        with open(self.inventory_data_file, "rb") as f:
+            self['provider_map'] = json.load(f)
+        logger.info("Using cached inventory %s crawled %ds ago providers %s",
+                    self.inventory_data_file, age_s, len(self.provider_map))
+        return True
+
+    def _snapshot_index_is_current(self) -> bool:
+        """ True when the index files of the snapshot exist and were written after it """
+        snapshot_mtime = os.path.getmtime(self.inventory_data_file)
+        return all(os.path.exists(path) and os.path.getmtime(path) >= snapshot_mtime
+                   for path in snapshot_paths(self.inventory_data_file))
+
+    def download_inventory(self, provider_id: str = "", use_cached: bool = False, write_index: bool = False,
+                           max_age_s: Optional[int] = None) -> str:
+        """
+        Download the inventory to <output_dir>/andromeda-inventory.json. With write_index the
+        content hash index used by as_inventory_diff is written next to it.
+
+        With use_cached an existing snapshot is loaded into provider_map instead of crawling when
+        it was crawled for the same tenant, provider_id and crawl options and is not older
+        than max_age_s. The crawl parameters are recorded in andromeda-inventory.meta.json.
+        The index of a cached snapshot is written when it is missing or older than the snapshot.
+        """
         inventory_dir = f"{self.output_dir}"
         if not os.path.exists(inventory_dir):
             os.makedirs(inventory_dir)
         self.inventory_data_file = f"{inventory_dir}/andromeda-inventory.json"
-        if not use_cached or not os.path.exists(self.inventory_data_file):
-            logger.info("Fetching inventory file %s for provider %s as use_cache %s file_exists %s",
-                        self.inventory_data_file, provider_id, use_cached, os.path.exists(self.inventory_data_file))
-            self._fetch_ai_inventory(provider_id)
-        with open(self.inventory_data_file, "w") as f:
+        crawl_params = self._crawl_params(provider_id)
+        if use_cached and self._load_cached_inventory(crawl_params, max_age_s):
+            if write_index and not self._snapshot_index_is_current():
+                write_snapshot_index(self.provider_map, self.inventory_data_file)
+            return self.inventory_data_file
+        logger.info("Fetching inventory file %s for provider %s as use_cache %s",
+                    self.inventory_data_file, provider_id, use_cached)
+        crawled_at = time.time()
+        self._fetch_ai_inventory(provider_id)
+        # write and rename so a failed write does not leave a truncated snapshot behind
+        tmp_file = f"{self.inventory_data_file}.tmp"
+        with open(tmp_file, "w") as f:
             json.dump(self.provider_map, f, indent=2)
+        os.replace(tmp_file, self.inventory_data_file)
+        with open(f"{self.inventory_data_file[:-len('.json')]}.meta.json", "w") as f:
+            json.dump({"crawledAt": crawled_at, "crawlParams": crawl_params}, f, indent=2)
+        if write_index:
+            write_snapshot_index(self.provider_map, self.inventory_data_file)
         return self.inventory_data_file
 
-
     def as_cloud_provider_base_fn(
             self, filters: dict,
             page_size: int, skip: int) -> Generator[list, None, None]:
@@ -3475,17 +3895,20 @@ class AndromedaInventory(dict):
         self._fetch_nhis(provider_id, provider_data)
         self._fetch_groups(provider_id, provider_data)
         self._fetch_provider_policies(provider_id, provider_data)
-        self._fetch_ai_provider_active_bindings(provider_id, provider_data, False)
-        self._fetch_ai_provider_active_bindings(provider_id, provider_data, True)
+        self._fetch_active_bindings(provider_id, provider_data)
         self._fetch_assignable_users(provider_id, provider_data)
         self._fetch_assignable_groups(provider_id, provider_data)
         self._fetch_assignable_policies(provider_id, provider_data)
         self._fetch_provider_eligibilities(provider_id, provider_data)
 
+        if self.account_bulk_size:
+            self._fetch_accounts_identities_bulk(provider_id, provider_data, 'identities')
+            self._fetch_accounts_identities_bulk(provider_id, provider_data, 'serviceIdentities')
         for account_id, account_data in provider_data['accounts'].items():
             self._fetch_account_policies(provider_id, account_id, account_data)
-            self._fetch_account_humans(provider_id, account_id, account_data)
-            self._fetch_account_nhis(provider_id, account_id, account_data)
+            if not self.account_bulk_size:
+                self._fetch_account_humans(provider_id, account_id, account_data)
+                self._fetch_account_nhis(provider_id, account_id, account_data)
 
         logger.info("provider %s:%s humans:%s nhis%s accounts %s active bindings%s",
                     provider_data['name'], provider_id, len(provider_data['humans']), len(provider_data['nhis']),
@@ -3509,21 +3932,61 @@ class AndromedaInventory(dict):
             self._fetch_idp_application_details(provider_data["id"], provider_data)
         return self.provider_map
 
+    def _fetch_active_bindings(self, provider_id: str, provider_data: dict) -> dict:
+        """
+        Fetch the configured and the resolved bindings of the provider concurrently
+        """
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(self._fetch_ai_provider_active_bindings, provider_id, provider_data, resolved_view)
+                       for resolved_view in (False, True)]
+            for future in futures:
+                future.result()
+        return provider_data['activeBindings']
+
+    @staticmethod
+    def _content_key(obj: dict) -> str:
+        return hashlib.sha1(json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()).hexdigest()[:16]
+
+    def _dedup_binding(self, active_bindings: dict, binding: dict) -> dict:
+        """
+        Move the principal and scope of the binding, and of its configured assignments, to the
+        principals and scopes lookup tables and reference them by principalKey and scopeKey
+        """
+        for field, table in (('principal', 'principals'), ('scope', 'scopes')):
+            if binding.get(field) is None:
+                continue
+            obj = binding.pop(field)
+            key = self._content_key(obj)
+            # setdefault keeps the first copy, the configured and resolved views add concurrently
+            active_bindings[table].setdefault(key, obj)
+            binding[f"{field}Key"] = key
+        for edge in (binding.get('configuredAssignments') or {}).get('edges', []):
+            self._dedup_binding(active_bindings, edge['node'])
+        return binding
+
     def _fetch_ai_provider_active_bindings(self, provider_name: str, provider_data: dict, resolved_view: bool = False) -> dict:
         if 'activeBindings' not in provider_data:
             provider_data['activeBindings'] = {
                 'configured': [],
                 'resolved': []
             }
+        active_bindings = provider_data['activeBindings']
+        if self.dedup_bindings:
+            active_bindings.setdefault('principals', {})
+            active_bindings.setdefault('scopes', {})
         view_type = 'resolved' if resolved_view else 'configured'
         if resolved_view:
-            for binding in self.as_provider_user_resolved_assignments_itr(provider_data["id"]):
-                provider_data['activeBindings'][view_type].append(binding)
+            bindings = self.as_provider_user_resolved_assignments_itr(provider_data["id"])
         else:
-            for binding in self.as_provider_configured_assignments_itr(provider_data["id"]):
-                provider_data['activeBindings'][view_type].append(binding)
-
-        logger.info("num active bindings view_type %s: %s", view_type, len(provider_data['activeBindings'][view_type]))
+            bindings = self.as_provider_configured_assignments_itr(provider_data["id"])
+        for binding in bindings:
+            if self.dedup_bindings:
+                binding = self._dedup_binding(active_bindings, binding)
+            active_bindings[view_type].append(binding)
+
+        logger.info("num active bindings view_type %s: %s principals %s scopes %s", view_type,
+                    len(active_bindings[view_type]), len(active_bindings.get('principals', {})),
+                    len(active_bindings.get('scopes', {})))
         return provider_data['activeBindings']
 
     def _fetch_humans(self, provider_id: str, provider_data: dict) -> dict:
@@ -3537,21 +4000,68 @@ class AndromedaInventory(dict):
         logger.info("groups %d", len(self.provider_map[provider_id]["groups"]))
 
     def _fetch_account_humans(self, provider_id: str, account_id: str, account_data: dict) -> dict:
+        """
+        Store the humans of the account under provider_map[provider_id]['accounts'][account_id]['humans'],
+        keyed by username, the shape of the bulk account fetch. Before, they were written at the top
+        level of the account, next to its own fields.
+        """
         acc_inventory_data = self.provider_map[provider_id]["accounts"][account_id]
         if 'humans' not in acc_inventory_data:
             acc_inventory_data['humans'] = {}
         for human in self.account_humans_itr(provider_id, account_id, account_data):
-            acc_inventory_data[human["username"]] = human
+            acc_inventory_data['humans'][human["username"]] = human
         logger.info("humans %d", len(acc_inventory_data.get("humans", {})))
 
     def _fetch_account_nhis(self, provider_id: str, account_id: str, account_data: dict) -> dict:
+        """ Store the nhis of the account under ['nhis'] keyed by username, like _fetch_account_humans """
         acc_inventory_data = self.provider_map[provider_id]["accounts"][account_id]
         if 'nhis' not in acc_inventory_data:
             acc_inventory_data['nhis'] = {}
         for nhi in self.account_nhis_itr(provider_id, account_id, account_data):
-            acc_inventory_data[nhi["username"]] = nhi
+            acc_inventory_data['nhis'][nhi["username"]] = nhi
         logger.info("nhis %d", len(acc_inventory_data.get("nhis", {})))
 
+    def _fetch_accounts_identities_bulk(self, provider_id: str, provider_data: dict, connection: str) -> None:
+        """
+        Fetch the humans ('identities') or nhis ('serviceIdentities') of all the accounts of the provider
+        with account_bulk_size accounts per query and group them by account. The identity counts returned
+        with the accounts are used to skip the empty accounts and to stop paging the full ones.
+        """
+        key = 'humans' if connection == 'identities' else 'nhis'
+        page_size = self.default_page_size
+        pending = []
+        for account_id, account_data in provider_data['accounts'].items():
+            account_data.setdefault(key, {})
+            count = ((account_data.get(connection) or {}).get('pageInfo') or {}).get('count')
+            if count != 0:
+                pending.append((account_id, 0, count))
+        num_queries = 0
+        while pending:
+            batch, pending = pending[:self.account_bulk_size], pending[self.account_bulk_size:]
+            if self.rate_limiter:
+                self.rate_limiter.wait()
+            try:
+                results = self.accounts_identities_bulk_base_fn(
+                    provider_id, connection, [(account_id, skip) for account_id, skip, _ in batch], None, page_size)
+                num_queries += 1
+            except TransportQueryError as e:
+                # one bad account fails the whole aliased query, fall back to the per account queries
+                logger.error("provider %s bulk %s query failed, fetching the accounts one by one: %s",
+                             provider_id, key, e)
+                fetch_fn = self._fetch_account_humans if key == 'humans' else self._fetch_account_nhis
+                for account_id, _, _ in batch:
+                    fetch_fn(provider_id, account_id, provider_data['accounts'][account_id])
+                continue
+            for account_id, skip, count in batch:
+                items = results[account_id]
+                account_items = provider_data['accounts'][account_id][key]
+                for item in items:
+                    account_items[item["username"]] = item
+                if len(items) == page_size and (count is None or skip + page_size < count):
+                    pending.append((account_id, skip + page_size, count))
+        logger.info("provider %s accounts %s %s bulk queries %s",
+                    provider_id, len(provider_data['accounts']), key, num_queries)
+
     def _fetch_nhis(self, provider_id: str, provider_data: dict) -> dict:
         for nhi in self.provider_nhis_itr(provider_id, provider_data):
             self.provider_map[provider_id]["nhis"][nhi["username"]] = nhi
@@ -3596,6 +4106,49 @@ class AndromedaInventory(dict):
         for identity in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size):
             yield identity
 
+    def bulk_lookup(self, entity: str, field: str, values, chunk_size: int = DEFAULT_BULK_LOOKUP_CHUNK_SIZE,
+                    max_workers: int = 4, match_field: Optional[str] = None, provider_id: str = "",
+                    filters: Optional[dict] = None) -> dict:
+        """
+        Look up many values of a field, eg. bulk_lookup('humans', 'email', emails).
+        The values are split into chunks of chunk_size `in` filters that are fetched
+        concurrently with max_workers threads.
+        :param entity: one of BULK_LOOKUP_ITRS
+        :param field: filter field of the entity
+        :param values: values to look up, duplicates are ignored
+        :param match_field: field of the returned entities matched to the values. Default is field
+        :param provider_id: provider of the provider_humans and provider_nhis entities
+        :param filters: additional filters applied to every chunk
+        :return: map of value to the entity for the values that were found
+        """
+        if entity not in BULK_LOOKUP_ITRS:
+            raise ValueError(f"Unsupported entity {entity}, expected one of {list(BULK_LOOKUP_ITRS)}")
+        if entity.startswith('provider_') and not provider_id:
+            raise ValueError(f"provider_id is required for {entity}")
+        match_field = match_field or field
+        itr_fn = getattr(self, BULK_LOOKUP_ITRS[entity])
+        values = list(dict.fromkeys(v for v in values if v is not None))
+        chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+
+        def lookup_chunk(chunk: list) -> list:
+            chunk_filters = dict(filters) if filters else {}
+            chunk_filters[field] = {"in": chunk}
+            if entity.startswith('provider_'):
+                return list(itr_fn(provider_id, {}, filters=chunk_filters, page_size=chunk_size))
+            return list(itr_fn(filters=chunk_filters, page_size=chunk_size))
+
+        wanted = set(values)
+        found = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for items in executor.map(lookup_chunk, chunks):
+                for item in items:
+                    value = item.get(match_field)
+                    if value in wanted and value not in found:
+                        found[value] = item
+        logger.info("bulk lookup %s %s: %s values %s chunks found %s",
+                    entity, field, len(values), len(chunks), len(found))
+        return found
+
     def as_events_base_fn(self, filters: dict, page_size: int, skip: int) -> Generator[list, None, None]:
         """Fetch events with username, id, and name."""
         logger.debug("Fetching events with filters %s page_size %s skip %s",
@@ -3631,14 +4184,86 @@ class AndromedaInventory(dict):
         logger.debug("num events returned %s", len(events))
         return events
 
-    def as_events_itr(self, filters: dict = None, page_size: int = None) -> Generator[dict, None, None]:
-        """Iterate through events."""
+    def as_events_itr(self, filters: dict = None, page_size: int = None, **kwargs) -> Generator[dict, None, None]:
+        """Iterate through events. kwargs are passed to as_gql_generic_itr, eg. max_count"""
         page_size = page_size if page_size else self.default_page_size
         partial_fn_itr = functools.partial(
             self.as_events_base_fn, filters)
-        for event in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size):
+        for event in self.as_gql_generic_itr(partial_fn_itr, page_size=page_size, **kwargs):
             yield event
 
+    def as_events_follow(self, callback, filters: dict = None, state_file: str = "",
+                         start_time: str = "", lookback_s: int = 300,
+                         min_interval_s: float = 5, max_interval_s: float = 300,
+                         max_polls: Optional[int] = None,
+                         stop_event: Optional[threading.Event] = None) -> dict:
+        """
+        Follow the events: poll for the events since the watermark and call callback(events)
+        with the new ones, in eventTime order.
+
+        Delivery is at least once: the watermark and the ids of the delivered events are only
+        saved to state_file after the callback returns, so a crash re-delivers the last batch.
+        Every poll re-reads lookback_s before the watermark to catch late events, the ids seen
+        in that trailing window are kept in the state to drop the duplicates. The state is
+        only resumed for the same filters. The poll interval starts at min_interval_s, doubles
+        on every empty or failed poll up to max_interval_s and goes back to min_interval_s as
+        soon as events arrive.
+
+        :param callback: called with the list of new events
+        :param filters: AndromedaEvents filters, eventTime is set by the poll
+        :param state_file: json file for the watermark and the dedupe set, kept in memory if empty
+        :param start_time: where to start when there is no saved watermark, defaults to now
+        :param max_polls: stop after max_polls polls, forever if None
+        :param stop_event: stop when the event is set
+        :return: the last state
+        """
+        # the watermark is only valid for the same filters
+        filters_key = json.dumps(filters or {}, sort_keys=True)
+        state = load_state(state_file)
+        if state.get("filters") != filters_key or not state.get("watermark"):
+            if state:
+                logger.info("follow state %s is for the filters %s, starting over", state_file, state.get("filters"))
+            start = utc_time(start_time) if start_time else datetime.now(timezone.utc)
+            state = {"filters": filters_key, "watermark": start.isoformat(), "seen": {}}
+        interval = min_interval_s
+        polls = 0
+        while not (stop_event and stop_event.is_set()):
+            watermark = utc_time(state["watermark"])
+            since = watermark - timedelta(seconds=lookback_s)
+            poll_filters = dict(filters or {}, eventTime={"greaterThanOrEquals": format_time(since)})
+            polls += 1
+            try:
+                events = list(self.as_events_itr(filters=poll_filters, max_count=MAX_EVENTS_PER_POLL))
+            except Exception as e:
+                # a failed poll is retried with the backoff of the empty polls
+                logger.error("events poll failed, retrying in %ss: %s", min(interval * 2, max_interval_s), e)
+                events = None
+            timed_events = [(utc_time(event["time"]) if event.get("time") else watermark, event)
+                            for event in events or [] if event.get("id") not in state["seen"]]
+            timed_events.sort(key=lambda timed_event: timed_event[0])
+            if timed_events:
+                callback([event for _, event in timed_events])
+                for event_time, event in timed_events:
+                    watermark = max(watermark, event_time)
+                    state["seen"][event.get("id")] = event_time.isoformat()
+                # only the ids in the lookback window can be returned again
+                since = watermark - timedelta(seconds=lookback_s)
+                state = {"filters": filters_key, "watermark": watermark.isoformat(),
+                         "seen": {i: t for i, t in state["seen"].items() if utc_time(t) >= since}}
+                save_state(state_file, state)
+                interval = min_interval_s
+                logger.info("followed events %s watermark %s", len(timed_events), state["watermark"])
+            else:
+                interval = min(interval * 2, max_interval_s)
+            if max_polls is not None and polls >= max_polls:
+                break
+            logger.debug("next events poll in %ss", interval)
+            if stop_event:
+                stop_event.wait(interval)
+            else:
+                time.sleep(interval)
+        return state
+
     def as_recommendations_base_fn(self, filters: dict, page_size: int, skip: int) -> Generator[list, None, None]:
         """Fetch events with username, id, and name."""
         logger.debug("Fetching events with filters %s page_size %s skip %s",
@@ -3763,13 +4388,38 @@ def main():
                         default=DEFAULT_PAGE_SIZE, type=int,
                         help='Page size for fetching data. Default is 100')
 
+    parser.add_argument('--identity_cache',
+                        action='store_true',
+                        help='Fetch every identity once per tenant and join it into the provider and account humans')
+
+    parser.add_argument('--account_bulk_size',
+                        default=0, type=int,
+                        help='Fetch the account humans and nhis of this many accounts per query. Default 0 is one account per query')
+
+    parser.add_argument('--dedup_bindings',
+                        action='store_true',
+                        help='Store the principals and scopes of the active bindings once, referenced by principalKey and scopeKey')
+
+    parser.add_argument('--write_index',
+                        action='store_true',
+                        help='Also write the snapshot index and entities file used by as_inventory_diff.py')
+
+    parser.add_argument('--use_cached',
+                        action='store_true',
+                        help='Use the existing inventory file if it was crawled with the same parameters')
+
+    parser.add_argument('--cache_max_age_s',
+                        default=None, type=int,
+                        help='Max age of the cached inventory file. Default is no limit')
+
     parser.add_argument('--development',
                         action='store_true',
                         help='for use during development')
 
     args = parser.parse_args()
 
-    au = APIUtils(api_endpoint=args.http_endpoint)
+    # the crawl only reads, its concurrent identical GETs share one request
+    au = APIUtils(api_endpoint=args.http_endpoint, coalesce=True)
     logger.setLevel(getattr(logging, args.logLevel))
     ch = logging.StreamHandler()
     # create formatter and add it to the handlers
@@ -3791,10 +4441,13 @@ def main():
     if not api_session:
         raise Exception("No API session created")
     ai = AndromedaInventory(None, api_session, output_dir=args.output_dir, default_page_size=int(args.page_size),
-                            as_endpoint=args.http_endpoint, gql_endpoint=args.gql_endpoint)
+                            as_endpoint=args.http_endpoint, gql_endpoint=args.gql_endpoint,
+                            identity_cache=args.identity_cache, account_bulk_size=args.account_bulk_size,
+                            dedup_bindings=args.dedup_bindings)
 
     if not args.development:
-        ai.download_inventory(provider_id=args.provider_id)
+        ai.download_inventory(provider_id=args.provider_id, use_cached=args.use_cached,
+                              write_index=args.write_index, max_age_s=args.cache_max_age_s)
     else:
         logger.info(json.dumps(ai.fetch_providers_summary(), indent=2))
         #dev_download_resolved_resolved_bindings(ai)
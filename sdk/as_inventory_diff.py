@@ -0,0 +1,289 @@
+# Copyright 2025 Andromeda Security, Inc.
+#
+"""
+Content-hash based diff of two Andromeda inventory snapshots.
+
+When the inventory is downloaded with write_index (as_inventory.py --write_index) every entity
+of the snapshot (a human, nhi, group, account, binding, ...) is written as one line of
+<snapshot>.entities.ndjson and its stable content hash and line offset are recorded in
+<snapshot>.index.json:
+
+    {"<provider_id>": {"<entity_type>": {"<entity_key>": ["<content hash>", <offset>]}}}
+
+Two snapshots are diffed from their indexes alone. Only the entities whose hash changed are
+read back from the entities files, by offset, to produce the field level diffs. The bindings
+and application assignments are keyed by their principal, role and scope, so an updated
+binding is reported as changed instead of removed and added.
+
+Example usage:
+    python3 sdk/as_inventory_diff.py --old_snapshot=/tmp/yesterday/andromeda-inventory.json \\
+        --new_snapshot=/tmp/andromeda-inventory/<tenant_id>/andromeda-inventory.json --field_diffs
+"""
+import argparse
+import hashlib
+import json
+import logging
+import sys
+from typing import Generator, Optional
+
+logger = logging.getLogger(__name__)
+
+# provider level entity maps, keyed by the entity key used in the inventory
+ENTITY_MAPS = ('humans', 'nhis', 'groups', 'roles', 'accounts', 'assignableGroups',
+               'assignableUsers', 'assignablePolicies', 'eligibilities')
+# provider level entity lists, keyed by the natural key of the entity
+ENTITY_LISTS = ('applicationAssignments',)
+# entity type of the provider's own fields (name, type, ...)
+PROVIDER_ENTITY_TYPE = 'provider'
+# provider fields holding the crawled entities
+NESTED_FIELDS = frozenset(ENTITY_MAPS) | frozenset(ENTITY_LISTS) | {'activeBindings'}
+
+# natural key of the list entities, the first non null field of each group
+BINDING_KEY_FIELDS = (
+    ('principalId', 'userId', 'identityId', 'principal.id', 'principal.originUserId',
+     'principalName', 'principalUsername'),
+    ('roleId', 'policyId', 'roleData.policyId', 'roleName'),
+    ('accountId',),
+    ('scope.id',),
+)
+APPLICATION_ASSIGNMENT_KEY_FIELDS = (
+    ('principal.id', 'principal.originUserId', 'principal.username', 'principal.name'),
+    ('policy.id', 'policy.name'),
+    ('assignmentData.assignmentType',),
+)
+
+
+def content_hash(entity) -> str:
+    """ Stable hash of the entity, independent of the dict key order """
+    return hashlib.sha1(json.dumps(entity, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def resolve_field(entity: dict, field: str, resolvers: Optional[dict] = None):
+    """
+    Value of the field for the entity. Resolvers map field names to functions and dotted
+    names (eg. "orgInfo.department") walk nested dicts.
+    """
+    if resolvers and field in resolvers:
+        return resolvers[field](entity)
+    value = entity
+    for part in field.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def as_values(value) -> list:
+    """ The values of a list field, or the single value of a scalar field, as a list """
+    return value if isinstance(value, list) else [value]
+
+
+def provider_fields(provider_data: dict) -> dict:
+    """ The provider's own fields, without the crawled entities """
+    return {k: v for k, v in provider_data.items() if k not in NESTED_FIELDS}
+
+
+def natural_key(entity: dict, key_fields: tuple) -> Optional[str]:
+    """ The key_fields values of the entity joined with "|", None when none is set """
+    parts = []
+    for fields in key_fields:
+        value = next((v for v in (resolve_field(entity, f) for f in fields) if v not in (None, "")), None)
+        parts.append("" if value is None else str(value))
+    return "|".join(parts) if any(parts) else None
+
+
+def _keyed_items(entities: list, key_fields: tuple, resolve_fn=None) -> Generator[tuple, None, None]:
+    """
+    Yield (key, entity) with the natural key of the entities. The entities without one, or
+    with the key of another entity, fall back to (or are suffixed with) their content hash.
+    """
+    seen = set()
+    for entity in entities:
+        key = natural_key(resolve_fn(entity) if resolve_fn else entity, key_fields)
+        if key is None:
+            key = content_hash(entity)
+        elif key in seen:
+            key = f"{key}#{content_hash(entity)}"
+        seen.add(key)
+        yield key, entity
+
+
+def snapshot_paths(inventory_file: str) -> tuple:
+    """ Return the (index file, entities file) of the inventory snapshot """
+    base = inventory_file[:-len(".json")] if inventory_file.endswith(".json") else inventory_file
+    return f"{base}.index.json", f"{base}.entities.ndjson"
+
+
+def entity_items(provider_data: dict) -> Generator[tuple, None, None]:
+    """
+    Yield (entity_type, entity_key, entity) for all the entities of the provider. The list
+    entities are keyed by their natural key (see BINDING_KEY_FIELDS)
+    """
+    yield PROVIDER_ENTITY_TYPE, PROVIDER_ENTITY_TYPE, provider_fields(provider_data)
+    for entity_type in ENTITY_MAPS:
+        for key, entity in (provider_data.get(entity_type) or {}).items():
+            yield entity_type, key, entity
+    for key, entity in _keyed_items(provider_data.get('applicationAssignments') or [],
+                                    APPLICATION_ASSIGNMENT_KEY_FIELDS):
+        yield 'applicationAssignments', key, entity
+    active_bindings = provider_data.get('activeBindings') or {}
+
+    def resolve_refs(binding: dict) -> dict:
+        # the deduped bindings reference their principal and scope by content key
+        if 'principalKey' not in binding and 'scopeKey' not in binding:
+            return binding
+        return dict(binding, principal=(active_bindings.get('principals') or {}).get(binding.get('principalKey')),
+                    scope=(active_bindings.get('scopes') or {}).get(binding.get('scopeKey')))
+
+    for view_type, bindings in active_bindings.items():
+        entity_type = f"activeBindings.{view_type}"
+        if isinstance(bindings, dict):
+            # principals and scopes lookup tables
+            for key, entity in bindings.items():
+                yield entity_type, key, entity
+        else:
+            for key, entity in _keyed_items(bindings, BINDING_KEY_FIELDS, resolve_refs):
+                yield entity_type, key, entity
+
+
+def write_snapshot_index(provider_map: dict, inventory_file: str) -> dict:
+    """
+    Write the entities file and the hash index of the snapshot next to the inventory file
+    and return the index
+    """
+    index_file, entities_file = snapshot_paths(inventory_file)
+    index = {}
+    with open(entities_file, "wb") as f:
+        for provider_id, provider_data in provider_map.items():
+            provider_index = index.setdefault(provider_id, {})
+            for entity_type, key, entity in entity_items(provider_data):
+                line = json.dumps(entity, sort_keys=True, separators=(',', ':')).encode()
+                provider_index.setdefault(entity_type, {})[key] = [
+                    hashlib.sha1(line).hexdigest(), f.tell()]
+                f.write(line + b"\n")
+    with open(index_file, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    logger.info("snapshot index %s entities %s", index_file, entities_file)
+    return index
+
+
+def load_index(inventory_file: str) -> dict:
+    index_file, _ = snapshot_paths(inventory_file)
+    with open(index_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def diff_indexes(old_index: dict, new_index: dict) -> dict:
+    """
+    Compare two snapshot indexes. Returns
+        {provider_id: {entity_type: {"added": [keys], "removed": [keys], "changed": [keys]}}}
+    with only the providers and entity types that have differences.
+    """
+    diff = {}
+    for provider_id in sorted(set(old_index) | set(new_index)):
+        old_provider = old_index.get(provider_id, {})
+        new_provider = new_index.get(provider_id, {})
+        for entity_type in sorted(set(old_provider) | set(new_provider)):
+            old_entities = old_provider.get(entity_type, {})
+            new_entities = new_provider.get(entity_type, {})
+            added = sorted(new_entities.keys() - old_entities.keys())
+            removed = sorted(old_entities.keys() - new_entities.keys())
+            changed = sorted(k for k in old_entities.keys() & new_entities.keys()
+                             if old_entities[k][0] != new_entities[k][0])
+            if added or removed or changed:
+                diff.setdefault(provider_id, {})[entity_type] = {
+                    "added": added, "removed": removed, "changed": changed}
+    return diff
+
+
+def diff_entity(old, new, path: str = "") -> list:
+    """ Field level diff of two entities, a list of {"path", "old", "new"} """
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = []
+        for key in sorted(set(old) | set(new), key=str):
+            sub_path = f"{path}.{key}" if path else str(key)
+            if key not in old:
+                changes.append({"path": sub_path, "old": None, "new": new[key]})
+            elif key not in new:
+                changes.append({"path": sub_path, "old": old[key], "new": None})
+            else:
+                changes.extend(diff_entity(old[key], new[key], sub_path))
+        return changes
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        changes = []
+        for i, (old_item, new_item) in enumerate(zip(old, new)):
+            changes.extend(diff_entity(old_item, new_item, f"{path}[{i}]"))
+        return changes
+    if old != new:
+        return [{"path": path, "old": old, "new": new}]
+    return []
+
+
+def _read_entity(f, offset: int):
+    f.seek(offset)
+    return json.loads(f.readline())
+
+
+def field_diffs_itr(old_snapshot: str, new_snapshot: str, diff: Optional[dict] = None,
+                    old_index: Optional[dict] = None, new_index: Optional[dict] = None) -> Generator[dict, None, None]:
+    """
+    Yield the field level diff of every changed entity, reading only the changed
+    entities from the entities files of the two snapshots
+    """
+    old_index = old_index if old_index is not None else load_index(old_snapshot)
+    new_index = new_index if new_index is not None else load_index(new_snapshot)
+    diff = diff if diff is not None else diff_indexes(old_index, new_index)
+    _, old_entities_file = snapshot_paths(old_snapshot)
+    _, new_entities_file = snapshot_paths(new_snapshot)
+    with open(old_entities_file, "rb") as old_f, open(new_entities_file, "rb") as new_f:
+        for provider_id, entity_types in diff.items():
+            for entity_type, entity_diff in entity_types.items():
+                for key in entity_diff["changed"]:
+                    old_entity = _read_entity(old_f, old_index[provider_id][entity_type][key][1])
+                    new_entity = _read_entity(new_f, new_index[provider_id][entity_type][key][1])
+                    yield {"providerId": provider_id, "entityType": entity_type, "key": key,
+                           "changes": diff_entity(old_entity, new_entity)}
+
+
+def main():
+    HELP_STR = """
+    This script diffs two inventory snapshots downloaded by as_inventory.py.
+
+    Prints the added, removed and changed entities per provider and entity type, and with
+    --field_diffs one line of field level changes per changed entity.
+
+    Example:
+        python3 sdk/as_inventory_diff.py --old_snapshot=old/andromeda-inventory.json --new_snapshot=new/andromeda-inventory.json
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=(HELP_STR)
+    )
+    parser.add_argument('--old_snapshot', required=True,
+                        help='Previous andromeda-inventory.json')
+    parser.add_argument('--new_snapshot', required=True,
+                        help='Current andromeda-inventory.json')
+    parser.add_argument('--field_diffs', action='store_true',
+                        help='Print the field level diffs of the changed entities as json lines')
+    parser.add_argument('--logLevel', default="INFO",
+                        help='log level for the module when run as a script')
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.logLevel),
+                        format='%(asctime)s:%(levelname)s:%(module)s:%(lineno)s: %(message)s')
+
+    old_index = load_index(args.old_snapshot)
+    new_index = load_index(args.new_snapshot)
+    diff = diff_indexes(old_index, new_index)
+    for provider_id, entity_types in diff.items():
+        for entity_type, entity_diff in entity_types.items():
+            logger.info("provider %s %s added %s removed %s changed %s", provider_id, entity_type,
+                        len(entity_diff["added"]), len(entity_diff["removed"]), len(entity_diff["changed"]))
+    if args.field_diffs:
+        for entity_diff in field_diffs_itr(args.old_snapshot, args.new_snapshot, diff, old_index, new_index):
+            sys.stdout.write(json.dumps(entity_diff) + "\n")
+    else:
+        json.dump(diff, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+# Copyright 2025 Andromeda Security, Inc.
+#
+"""
+Multi-tenant inventory crawl orchestrator.
+
+Crawls the Andromeda inventory of many tenants concurrently, one AndromedaInventory per
+worker process. The GraphQL schema is fetched once and shared with every worker, each
+tenant crawl is paced by its own rate limit and all workers share a global rate limit.
+A single summary of all the crawls is written to <output_dir>/orchestrator-summary.json.
+
+The tenants file is a yaml file of format:
+
+    tenants:
+      - name: acme
+        api_endpoint: https://api.live.andromedasecurity.com
+        gql_endpoint: https://api.live.andromedasecurity.com/graphql
+        api_token_env: ACME_AS_API_TOKEN     # or api_token, session_cookie, session_cookie_env
+        provider_id: ""                      # optional, crawl a single provider
+        page_size: 100                       # optional
+        rate_limit: 5                        # optional, requests per second for this tenant
+        identity_cache: true                 # optional, fetch every identity once per tenant
+        account_bulk_size: 25                # optional, accounts per humans/nhis query
+        dedup_bindings: true                 # optional, principals / scopes tables in the active bindings
+        pool_size: 16                        # optional, pooled http connections of the tenant session
+
+Example usage:
+    python3 sdk/as_inventory_orchestrator.py --tenants_file=tenants.yaml --max_workers=8 --global_rate_limit=40
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+
+import requests
+import yaml
+from graphql import print_schema
+
+from sdk.api_utils import DEFAULT_POOL_SIZE, APIUtils, InvalidInputException
+from sdk.as_inventory import AndromedaInventory, DEFAULT_PAGE_SIZE
+from sdk.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FILE_NAME = "orchestrator-summary.json"
+SCHEMA_FILE_NAME = "schema.graphql"
+DEFAULT_SCHEMA_MAX_AGE_S = 24 * 60 * 60
+
+# set in every worker process by _init_worker
+_global_rate_limiter: Optional[RateLimiter] = None
+
+
+def load_tenants(tenants_file: str) -> list:
+    """ Load the list of tenants to crawl from the yaml file """
+    with open(tenants_file, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    tenants = data.get("tenants", []) if data else []
+    names = set()
+    for tenant in tenants:
+        if not tenant.get("name"):
+            raise InvalidInputException(f"Tenant without a name in {tenants_file}")
+        if tenant["name"] in names:
+            raise InvalidInputException(f"Duplicate tenant {tenant['name']} in {tenants_file}")
+        names.add(tenant["name"])
+    return tenants
+
+
+def get_tenant_api_session(tenant: dict) -> requests.Session:
+    """ Create the API session for a tenant from its token or session cookie """
+    # the inventory crawls only read, their concurrent identical GETs share one request
+    au = APIUtils(api_endpoint=tenant["api_endpoint"], pool_size=tenant.get("pool_size", DEFAULT_POOL_SIZE),
+                  coalesce=True)
+    session_cookie = tenant.get("session_cookie") or os.getenv(tenant.get("session_cookie_env", ""), "")
+    if session_cookie:
+        return au.get_api_session_w_cookie(session_cookie)
+    api_token = tenant.get("api_token") or os.getenv(tenant.get("api_token_env", ""), "")
+    if api_token:
+        return au.get_api_session_w_api_token(api_token)
+    raise InvalidInputException(
+        f"Tenant {tenant['name']}: either api_token or session_cookie must be provided")
+
+
+def load_or_fetch_schema(schema_file: str, tenant: dict, max_age_s: int = DEFAULT_SCHEMA_MAX_AGE_S) -> str:
+    """
+    Return the GraphQL schema SDL from the schema cache file. The schema is fetched
+    using the given tenant when the cache is missing or older than max_age_s.
+    """
+    if os.path.exists(schema_file) and time.time() - os.path.getmtime(schema_file) < max_age_s:
+        logger.info("Using cached schema %s", schema_file)
+        with open(schema_file, "r", encoding="utf-8") as f:
+            return f.read()
+    logger.info("Fetching schema using tenant %s", tenant["name"])
+    api_session = get_tenant_api_session(tenant)
+    gql_client = AndromedaInventory.get_gql_client(api_session, tenant["gql_endpoint"])
+    schema = print_schema(gql_client.schema)
+    os.makedirs(os.path.dirname(schema_file) or ".", exist_ok=True)
+    with open(schema_file, "w", encoding="utf-8") as f:
+        f.write(schema)
+    return schema
+
+
+def _init_worker(global_rate_limit: float, lock, next_slot) -> None:
+    global _global_rate_limiter
+    _global_rate_limiter = RateLimiter(global_rate_limit, lock=lock, next_slot=next_slot)
+
+
+def crawl_tenant(tenant: dict, output_dir: str, schema: str) -> dict:
+    """ Crawl the inventory of a single tenant. Runs inside a worker process. """
+    start = time.time()
+    summary = {
+        "name": tenant["name"],
+        "tenantId": None,
+        "status": "ok",
+        "error": None,
+        "inventoryFile": None,
+        "providers": 0,
+        "accounts": 0,
+        "humans": 0,
+        "nhis": 0,
+    }
+    try:
+        api_session = get_tenant_api_session(tenant)
+        rate_limiter = RateLimiter(tenant.get("rate_limit"), parent=_global_rate_limiter)
+        ai = AndromedaInventory(
+            None, api_session, output_dir=output_dir,
+            default_page_size=int(tenant.get("page_size", DEFAULT_PAGE_SIZE)),
+            as_endpoint=tenant["api_endpoint"], gql_endpoint=tenant["gql_endpoint"],
+            gql_schema=schema, rate_limiter=rate_limiter,
+            identity_cache=bool(tenant.get("identity_cache", False)),
+            account_bulk_size=int(tenant.get("account_bulk_size", 0)),
+            dedup_bindings=bool(tenant.get("dedup_bindings", False)))
+        summary["tenantId"] = ai.tenant_id
+        summary["inventoryFile"] = ai.download_inventory(provider_id=tenant.get("provider_id", ""))
+        for provider_data in ai.provider_map.values():
+            summary["providers"] += 1
+            summary["accounts"] += len(provider_data.get("accounts", {}))
+            summary["humans"] += len(provider_data.get("humans", {}))
+            summary["nhis"] += len(provider_data.get("nhis", {}))
+    except Exception as e:
+        logger.error("Tenant %s crawl failed: %s\n%s", tenant["name"], e, traceback.format_exc())
+        summary["status"] = "failed"
+        summary["error"] = str(e)
+    summary["durationS"] = round(time.time() - start, 1)
+    return summary
+
+
+def _order_by_previous_duration(tenants: list, summary_file: str) -> list:
+    """
+    Schedule the tenants that took the longest in the previous run first so that the
+    slowest crawl does not start last and stretch the overall window.
+    """
+    if not os.path.exists(summary_file):
+        return tenants
+    try:
+        with open(summary_file, "r", encoding="utf-8") as f:
+            previous = {t["name"]: t.get("durationS", 0) for t in json.load(f).get("tenants", [])}
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning("Ignoring previous summary %s: %s", summary_file, e)
+        return tenants
+    return sorted(tenants, key=lambda t: previous.get(t["name"], 0), reverse=True)
+
+
+def crawl_tenants(tenants: list, output_dir: str, max_workers: int = 4,
+                  global_rate_limit: float = 0, schema_file: str = "",
+                  schema_max_age_s: int = DEFAULT_SCHEMA_MAX_AGE_S) -> dict:
+    """
+    Crawl all the tenants across a process pool and return the combined summary.
+    """
+    start = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+    summary_file = os.path.join(output_dir, SUMMARY_FILE_NAME)
+    schema_file = schema_file or os.path.join(output_dir, SCHEMA_FILE_NAME)
+    summary = {"startedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(start)), "tenants": []}
+    if not tenants:
+        return summary
+    schema = load_or_fetch_schema(schema_file, tenants[0], schema_max_age_s)
+    tenants = _order_by_previous_duration(tenants, summary_file)
+
+    lock = multiprocessing.Lock()
+    next_slot = multiprocessing.Value('d', 0.0, lock=False)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(global_rate_limit, lock, next_slot)) as executor:
+        futures = {executor.submit(crawl_tenant, tenant, output_dir, schema): tenant for tenant in tenants}
+        for future in as_completed(futures):
+            tenant_summary = future.result()
+            logger.info("tenant %s status %s duration %ss humans %s nhis %s",
+                        tenant_summary["name"], tenant_summary["status"], tenant_summary["durationS"],
+                        tenant_summary["humans"], tenant_summary["nhis"])
+            summary["tenants"].append(tenant_summary)
+
+    summary["tenants"].sort(key=lambda t: t["name"])
+    summary["durationS"] = round(time.time() - start, 1)
+    summary["ok"] = sum(1 for t in summary["tenants"] if t["status"] == "ok")
+    summary["failed"] = len(summary["tenants"]) - summary["ok"]
+    with open(summary_file, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    logger.info("Crawled %s tenants ok %s failed %s in %ss summary %s",
+                len(summary["tenants"]), summary["ok"], summary["failed"], summary["durationS"], summary_file)
+    return summary
+
+
+def main():
+    HELP_STR = """
+    This script crawls the Andromeda inventory of many tenants concurrently.
+
+    The output of every tenant is created at <output_dir>/<tenant_id>/andromeda-inventory.json and
+    the combined summary at <output_dir>/orchestrator-summary.json
+
+    Example:
+        python3 sdk/as_inventory_orchestrator.py --tenants_file=tenants.yaml --max_workers=8 --global_rate_limit=40
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=(HELP_STR)
+    )
+    parser.add_argument('--tenants_file', required=True,
+                        help='YAML file with the list of tenants')
+    parser.add_argument('--output_dir', '-o', default="/tmp/andromeda-inventory",
+                        help='Output directory for the inventories and the summary')
+    parser.add_argument('--max_workers', default=4, type=int,
+                        help='Number of tenants crawled in parallel')
+    parser.add_argument('--global_rate_limit', default=0, type=float,
+                        help='Max requests per second across all tenants. Default is no limit')
+    parser.add_argument('--schema_file', default="",
+                        help='GraphQL schema cache file. Default is <output_dir>/schema.graphql')
+    parser.add_argument('--schema_max_age_s', default=DEFAULT_SCHEMA_MAX_AGE_S, type=int,
+                        help='Refetch the cached schema when it is older than this')
+    parser.add_argument('--logLevel', default="INFO",
+                        help='log level for the module when run as a script')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.logLevel),
+                        format='%(asctime)s:%(levelname)s:%(processName)s:%(module)s:%(lineno)s: %(message)s')
+    crawl_tenants(load_tenants(args.tenants_file), args.output_dir, args.max_workers,
+                  args.global_rate_limit, args.schema_file, args.schema_max_age_s)
+
+
+if __name__ == '__main__':
+    main()
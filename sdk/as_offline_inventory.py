@@ -0,0 +1,362 @@
+# Copyright 2025 Andromeda Security, Inc.
+#
+"""
+Offline AndromedaInventory backed by a local inventory snapshot.
+
+OfflineAndromedaInventory loads an andromeda-inventory.json downloaded by
+AndromedaInventory.download_inventory and implements the same *_itr signatures and
+filter semantics (equals, notEquals, in, notIn, all, contains, icontains, greaterThan,
+greaterThanOrEquals, lessThan, lessThanOrEquals, boolean filters and the "or" filter)
+locally. Hash indexes on the fields used in equals/in filters are built lazily, the
+first time a field is filtered on.
+
+Example usage:
+    ai = OfflineAndromedaInventory("/tmp/andromeda-inventory/<tenant_id>/andromeda-inventory.json")
+    for human in ai.as_humans_itr(filters={"email": {"in": ["alice@acme.com"]}}):
+        print(human["id"])
+"""
+import json
+import logging
+from typing import Callable, Generator, Optional
+
+from sdk.api_utils import InvalidInputException
+from sdk.as_inventory import BULK_LOOKUP_ITRS
+from sdk.as_inventory_diff import as_values, provider_fields, resolve_field
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+
+
+def _org_info_field(field: str) -> Callable:
+    return lambda entity: (entity.get('orgInfo') or {}).get(field)
+
+
+# filter names of the GraphQL filters that do not map to a top level field of the entity
+IDENTITY_FIELD_RESOLVERS = {
+    'significance': lambda entity: [i['type'] for i in entity.get('opsInsights') or []],
+    'riskFactor': lambda entity: [r['type'] for r in entity.get('riskFactorsData') or []],
+    'hrType': _org_info_field('hrType'),
+    'department': _org_info_field('department'),
+    'businessTitle': _org_info_field('businessTitle'),
+    'positionTitle': _org_info_field('positionTitle'),
+    'managerId': _org_info_field('managerId'),
+}
+
+INDEXED_OPS = ('equals', 'in')
+
+
+def value_index(items) -> dict:
+    """
+    Hash index {value: [item]} of the (value, item) pairs, the list values are indexed
+    value by value. Unhashable values (dicts) can not be looked up by equals/in and are skipped.
+    """
+    index = {}
+    for value, item in items:
+        for v in as_values(value):
+            try:
+                index.setdefault(v, []).append(item)
+            except TypeError:
+                pass
+    return index
+
+
+def is_hashable(value) -> bool:
+    """ False for the operands that can not be looked up in a hash index (eg. a list or a dict) """
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def match_filter(value, field_filter) -> bool:
+    """ Evaluate one GraphQL Filter (eg. {"in": [...]}) against a value or a list of values """
+    if not isinstance(field_filter, dict):
+        # boolean filters like active: true
+        return value == field_filter
+    values = as_values(value)
+    for op, operand in field_filter.items():
+        if op == 'equals':
+            ok = operand in values
+        elif op == 'notEquals':
+            ok = operand not in values
+        elif op == 'in':
+            ok = any(v in operand for v in values)
+        elif op == 'notIn':
+            ok = not any(v in operand for v in values)
+        elif op == 'all':
+            ok = all(o in values for o in operand)
+        elif op == 'contains':
+            ok = any(isinstance(v, str) and operand in v for v in values)
+        elif op == 'icontains':
+            ok = any(isinstance(v, str) and operand.lower() in v.lower() for v in values)
+        elif op in ('greaterThan', 'greaterThanOrEquals', 'lessThan', 'lessThanOrEquals'):
+            ok = any(v is not None and _compare(op, v, operand) for v in values)
+        else:
+            raise InvalidInputException(f"Unsupported filter operation {op}")
+        if not ok:
+            return False
+    return True
+
+
+def value_kind(value) -> Optional[str]:
+    """ "number" or "str", the kinds of values the range filters compare, None for the others """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return "number"
+    if isinstance(value, str):
+        return "str"
+    return None
+
+
+def comparable_operand(kind: Optional[str], operand):
+    """
+    The range filter operand to compare with the values of the kind, None when they do not
+    compare. The GraphQL range filters take string operands, they are compared as numbers
+    to the numeric values.
+    """
+    if kind == "number":
+        if value_kind(operand) == "number":
+            return operand
+        try:
+            return float(operand) if isinstance(operand, str) else None
+        except ValueError:
+            return None
+    if kind == "str" and isinstance(operand, str):
+        return operand
+    return None
+
+
+def _compare(op: str, value, operand) -> bool:
+    operand = comparable_operand(value_kind(value), operand)
+    if operand is None:
+        # values of another type (eg. a string in a numeric column) do not match
+        return False
+    if op == 'greaterThan':
+        return value > operand
+    if op == 'greaterThanOrEquals':
+        return value >= operand
+    if op == 'lessThan':
+        return value < operand
+    return value <= operand
+
+
+def match_filters(entity: dict, filters: Optional[dict], resolvers: Optional[dict] = None) -> bool:
+    """
+    Evaluate GraphQL style filters against the entity. All the field filters must match,
+    the "or" filter is OR'ed with them (DNF, as in the GraphQL API).
+    """
+    if not filters:
+        return True
+    matched = all(match_filter(resolve_field(entity, field, resolvers), field_filter)
+                  for field, field_filter in filters.items() if field != 'or')
+    if not matched and filters.get('or'):
+        return match_filters(entity, filters['or'], resolvers)
+    return matched
+
+
+class OfflineAndromedaInventory(dict):
+    """
+    OfflineAndromedaInventory answers the AndromedaInventory iterators from a local snapshot.
+    It is a subclass of dict and can be used as a dictionary, like AndromedaInventory.
+    """
+    def __init__(self, inventory_file: Optional[str] = None, provider_map: Optional[dict] = None,
+                 default_page_size: int = DEFAULT_PAGE_SIZE):
+        super().__init__()
+        if provider_map is None:
+            if not inventory_file:
+                raise InvalidInputException("Either inventory_file or provider_map must be provided")
+            with open(inventory_file, "r", encoding="utf-8") as f:
+                provider_map = json.load(f)
+        self['provider_map'] = provider_map
+        self.default_page_size = default_page_size
+        # (collection, field) -> {value: [entities]}, built on first use
+        self._indexes = {}
+        self._collections = {}
+
+    @property
+    def provider_map(self):
+        return self['provider_map']
+
+    def _collection(self, name: tuple, build_fn: Callable) -> list:
+        if name not in self._collections:
+            self._collections[name] = build_fn()
+        return self._collections[name]
+
+    def _index(self, name: tuple, entities: list, field: str, resolvers: Optional[dict]) -> dict:
+        key = (name, field)
+        if key not in self._indexes:
+            index = value_index((resolve_field(entity, field, resolvers), entity) for entity in entities)
+            logger.debug("built index %s on %s values %s", name, field, len(index))
+            self._indexes[key] = index
+        return self._indexes[key]
+
+    def _candidates(self, name: tuple, entities: list, filters: Optional[dict], resolvers: Optional[dict]) -> list:
+        """ Narrow the entities down with the index of the first equals/in filter """
+        if not filters or filters.get('or'):
+            return entities
+        for field, field_filter in filters.items():
+            if not isinstance(field_filter, dict) or not field_filter.keys() & set(INDEXED_OPS):
+                continue
+            values = [field_filter['equals']] if 'equals' in field_filter else list(field_filter['in'])
+            if not all(is_hashable(v) for v in values):
+                # match_filters evaluates it on the candidates of another field, or on all the entities
+                continue
+            index = self._index(name, entities, field, resolvers)
+            candidates, seen = [], set()
+            for value in values:
+                for entity in index.get(value, []):
+                    if id(entity) not in seen:
+                        seen.add(id(entity))
+                        candidates.append(entity)
+            return candidates
+        return entities
+
+    def _filter_itr(self, name: tuple, entities: list, filters: Optional[dict],
+                    resolvers: Optional[dict] = None) -> Generator[dict, None, None]:
+        for entity in self._candidates(name, entities, filters, resolvers):
+            if match_filters(entity, filters, resolvers):
+                yield entity
+
+    def _provider_data(self, provider_id: str) -> dict:
+        if provider_id not in self.provider_map:
+            raise InvalidInputException(f"Provider {provider_id} is not in the inventory snapshot")
+        return self.provider_map[provider_id]
+
+    def _provider_collection(self, provider_id: str, entity_type: str) -> list:
+        return self._collection(
+            (provider_id, entity_type),
+            lambda: list((self._provider_data(provider_id).get(entity_type) or {}).values()))
+
+    def _providers(self) -> list:
+        """ The provider fields of the snapshot without the crawled entities """
+        return self._collection(('providers',), lambda: [
+            provider_fields(p) for p in self.provider_map.values()])
+
+    def _tenant_entities(self, entity_type: str) -> list:
+        """ humans, nhis or groups of all the providers, one entry per id """
+        def build():
+            entities = {}
+            for provider_id, provider_data in self.provider_map.items():
+                for entity in (provider_data.get(entity_type) or {}).values():
+                    if entity.get('id') not in entities:
+                        entities[entity.get('id')] = {
+                            k: v for k, v in entity.items() if k != 'identityProviderData'}
+                        entities[entity.get('id')]['providerId'] = []
+                    entities[entity.get('id')]['providerId'].append(provider_id)
+            return list(entities.values())
+        return self._collection((entity_type,), build)
+
+    def as_humans_itr(self, filters=None, page_size: int = None, *args, **kwargs) -> Generator[dict, None, None]:
+        """
+        Get all humans from the snapshot. The providerId field lists the providers the human is in.
+        """
+        yield from self._filter_itr(('humans',), self._tenant_entities('humans'), filters, IDENTITY_FIELD_RESOLVERS)
+
+    def as_non_humans_identities_itr(self, filters=None, page_size: int = None, *args, **kwargs) -> Generator[dict, None, None]:
+        """ Get all non humans from the snapshot, with the providerId list like as_humans_itr """
+        yield from self._filter_itr(('nhis',), self._tenant_entities('nhis'), filters, IDENTITY_FIELD_RESOLVERS)
+
+    def identities_itr(self, filters: dict = None, page_size: int = None) -> Generator[dict, None, None]:
+        """ The humans and the non humans of the snapshot """
+        identities = self._collection(
+            ('identities',), lambda: self._tenant_entities('humans') + self._tenant_entities('nhis'))
+        yield from self._filter_itr(('identities',), identities, filters, IDENTITY_FIELD_RESOLVERS)
+
+    def as_groups_itr(self, filters=None, page_size: int = None) -> Generator[dict, None, None]:
+        """ Get the groups of all the providers, with the providerId list like as_humans_itr """
+        yield from self._filter_itr(('groups',), self._tenant_entities('groups'), filters)
+
+    def provider_humans_itr(self, provider_id: str, provider_data: dict,
+                            filters=None, page_size: int = None, **kwargs) -> Generator[dict, None, None]:
+        yield from self._filter_itr((provider_id, 'humans'), self._provider_collection(provider_id, 'humans'),
+                                    filters, IDENTITY_FIELD_RESOLVERS)
+
+    def provider_nhis_itr(
+            self, provider_id: str, provider_data: dict, filters=None, page_size: int = None) -> Generator[dict, None, None]:
+        yield from self._filter_itr((provider_id, 'nhis'), self._provider_collection(provider_id, 'nhis'), filters)
+
+    def as_provider_groups_itr(self, provider_id: str, provider_data: dict,
+                               filters=None, page_size: int = None, **kwargs) -> Generator[dict, None, None]:
+        yield from self._filter_itr((provider_id, 'groups'), self._provider_collection(provider_id, 'groups'), filters)
+
+    def provider_accounts_itr(self, provider_id: str, filters: dict = None, page_size: int = None) -> Generator[dict, None, None]:
+        yield from self._filter_itr((provider_id, 'accounts'), self._provider_collection(provider_id, 'accounts'), filters)
+
+    def account_humans_itr(self, provider_id: str, account_id: str, account_data: dict,
+                           filters=None, page_size: int = None) -> Generator[dict, None, None]:
+        name = (provider_id, account_id, 'humans')
+        humans = self._collection(name, lambda: list(
+            (self._provider_data(provider_id)['accounts'].get(account_id, {}).get('humans') or {}).values()))
+        yield from self._filter_itr(name, humans, filters, IDENTITY_FIELD_RESOLVERS)
+
+    def account_nhis_itr(self, provider_id: str, account_id: str, account_data: dict,
+                         filters=None, page_size: int = None) -> Generator[dict, None, None]:
+        name = (provider_id, account_id, 'nhis')
+        nhis = self._collection(name, lambda: list(
+            (self._provider_data(provider_id)['accounts'].get(account_id, {}).get('nhis') or {}).values()))
+        yield from self._filter_itr(name, nhis, filters)
+
+    def provider_assignable_users_itr(self, provider_id: str, provider_data: dict,
+                                      filters=None, page_size: int = None) -> Generator[dict, None, None]:
+        yield from self._filter_itr((provider_id, 'assignableUsers'),
+                                    self._provider_collection(provider_id, 'assignableUsers'), filters)
+
+    def provider_assignable_groups_itr(self, provider_id: str, provider_data: dict,
+                                       filters=None, page_size: int = None, **kwargs) -> Generator[dict, None, None]:
+        yield from self._filter_itr((provider_id, 'assignableGroups'),
+                                    self._provider_collection(provider_id, 'assignableGroups'), filters)
+
+    def provider_assignable_policies_itr(self, provider_id: str, provider_data: dict,
+                                         filters=None, page_size: int = None) -> Generator[dict, None, None]:
+        yield from self._filter_itr((provider_id, 'assignablePolicies'),
+                                    self._provider_collection(provider_id, 'assignablePolicies'), filters)
+
+    def provider_eligibilities_itr(self, provider_id: str, provider_data: dict,
+                                   filters=None, page_size: int = None, **kwargs) -> Generator[dict, None, None]:
+        yield from self._filter_itr((provider_id, 'eligibilities'),
+                                    self._provider_collection(provider_id, 'eligibilities'), filters)
+
+    def provider_itr(self, filters: dict = None, page_size: int = None) -> Generator[dict, None, None]:
+        yield from self._filter_itr(('providers',), self._providers(), filters)
+
+    def as_provider_itr(self, filters: dict = None, page_size: int = None) -> Generator[dict, None, None]:
+        yield from self.provider_itr(filters, page_size)
+
+    def cloud_provider_itr(self, filters: dict = None, page_size: int = None) -> Generator[dict, None, None]:
+        updated_filters = dict(filters) if filters else {}
+        updated_filters['category'] = {'in': ['CLOUD']}
+        yield from self.provider_itr(updated_filters, page_size)
+
+    def app_provider_itr(self, filters: dict = None, page_size: int = None) -> Generator[dict, None, None]:
+        updated_filters = {"category": {"equals": "APPLICATION"}}
+        if filters:
+            updated_filters.update(filters)
+        yield from self.provider_itr(updated_filters, page_size)
+
+    def bulk_lookup(self, entity: str, field: str, values, chunk_size: Optional[int] = None,
+                    max_workers: Optional[int] = None, match_field: Optional[str] = None,
+                    provider_id: str = "", filters: Optional[dict] = None) -> dict:
+        """
+        AndromedaInventory.bulk_lookup over the snapshot, one index lookup of all the values.
+        chunk_size and max_workers are accepted for compatibility and ignored.
+        """
+        if entity not in BULK_LOOKUP_ITRS:
+            raise ValueError(f"Unsupported entity {entity}, expected one of {list(BULK_LOOKUP_ITRS)}")
+        if entity.startswith('provider_') and not provider_id:
+            raise ValueError(f"provider_id is required for {entity}")
+        match_field = match_field or field
+        itr_fn = getattr(self, BULK_LOOKUP_ITRS[entity])
+        values = list(dict.fromkeys(v for v in values if v is not None))
+        lookup_filters = dict(filters) if filters else {}
+        lookup_filters[field] = {"in": values}
+        items = itr_fn(provider_id, {}, filters=lookup_filters) if entity.startswith('provider_') \
+            else itr_fn(filters=lookup_filters)
+        wanted = set(values)
+        found = {}
+        for item in items:
+            value = item.get(match_field)
+            if value in wanted and value not in found:
+                found[value] = item
+        logger.info("bulk lookup %s %s: %s values found %s", entity, field, len(values), len(found))
+        return found
@@ -0,0 +1,238 @@
+# Copyright 2025 Andromeda Security, Inc.
+#
+"""
+Local query engine over the entities of an inventory snapshot.
+
+The where clause uses the GraphQL filter syntax of the *_itr iterators (see
+as_offline_inventory.match_filter) on dotted field paths. Paths starting with "provider."
+refer to the provider the entity belongs to. Every table is columnar: a field is resolved
+into a column once, and hash indexes (equals/in) and sorted indexes (greaterThan,
+lessThan, ...) are built lazily on the fields that get queried, so repeated queries are
+index lookups and set intersections instead of dict walks.
+
+Example usage:
+    engine = SnapshotQuery.from_snapshot("/tmp/andromeda-inventory/<tenant_id>/andromeda-inventory.json")
+    # humans with riskFactor STALE in providers of tier X not active for 90 days
+    engine.query("humans", where={"riskFactor": {"equals": "STALE"},
+                                  "provider.tierId": {"equals": "X"},
+                                  "lastActivityAt": {"lessThan": days_ago(90)}},
+                 select=["id", "username", "provider.name"])
+    engine.query("humans", group_by="riskLevel")
+"""
+import argparse
+import json
+import logging
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sdk.api_utils import InvalidInputException
+from sdk.as_inventory_diff import ENTITY_MAPS, as_values, provider_fields, resolve_field
+from sdk.as_offline_inventory import (IDENTITY_FIELD_RESOLVERS, comparable_operand, is_hashable,
+                                       match_filter, value_index, value_kind)
+
+logger = logging.getLogger(__name__)
+
+HASH_OPS = {'equals', 'in'}
+RANGE_OPS = {'greaterThan', 'greaterThanOrEquals', 'lessThan', 'lessThanOrEquals'}
+IDENTITY_ENTITY_TYPES = ('humans',)
+
+
+def days_ago(days: int) -> str:
+    """ ISO timestamp of now - days, to compare with the timestamps of the snapshot """
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class _Table:
+    """ The entities of one type across all providers, with lazily built columns and indexes """
+    def __init__(self, rows: list, row_providers: list, resolvers: Optional[dict]):
+        self.rows = rows
+        self.row_providers = row_providers
+        self.resolvers = resolvers
+        self._columns = {}
+        self._hash_indexes = {}
+        self._sorted_indexes = {}
+
+    def column(self, field: str) -> list:
+        if field not in self._columns:
+            if field.startswith("provider."):
+                sub_field = field[len("provider."):]
+                self._columns[field] = [resolve_field(p, sub_field) for p in self.row_providers]
+            else:
+                self._columns[field] = [resolve_field(row, field, self.resolvers) for row in self.rows]
+        return self._columns[field]
+
+    def hash_index(self, field: str) -> dict:
+        if field not in self._hash_indexes:
+            index = value_index((value, row_id) for row_id, value in enumerate(self.column(field)))
+            logger.debug("built hash index on %s values %s", field, len(index))
+            self._hash_indexes[field] = index
+        return self._hash_indexes[field]
+
+    def sorted_index(self, field: str) -> dict:
+        """
+        {value kind: (sorted values, row ids)} of the numeric and string values, so a column
+        mixing numbers and strings is range queried per kind instead of failing to sort
+        """
+        if field not in self._sorted_indexes:
+            pairs = {}
+            for row_id, value in enumerate(self.column(field)):
+                for v in as_values(value):
+                    kind = value_kind(v)
+                    if kind:
+                        pairs.setdefault(kind, []).append((v, row_id))
+            index = {}
+            for kind, kind_pairs in pairs.items():
+                kind_pairs.sort(key=lambda pair: pair[0])
+                index[kind] = ([v for v, _ in kind_pairs], [r for _, r in kind_pairs])
+            logger.debug("built sorted index on %s values %s", field,
+                         {kind: len(kind_pairs) for kind, kind_pairs in pairs.items()})
+            self._sorted_indexes[field] = index
+        return self._sorted_indexes[field]
+
+    def _range_rows(self, field: str, field_filter: dict) -> set:
+        rows = set()
+        for kind, (values, row_ids) in self.sorted_index(field).items():
+            lo, hi = 0, len(values)
+            for op, operand in field_filter.items():
+                operand = comparable_operand(kind, operand)
+                if operand is None:
+                    lo, hi = 0, 0
+                    break
+                if op == 'greaterThan':
+                    lo = max(lo, bisect_right(values, operand))
+                elif op == 'greaterThanOrEquals':
+                    lo = max(lo, bisect_left(values, operand))
+                elif op == 'lessThan':
+                    hi = min(hi, bisect_left(values, operand))
+                else:
+                    hi = min(hi, bisect_right(values, operand))
+            rows.update(row_ids[lo:hi])
+        return rows
+
+    def _field_rows(self, field: str, field_filter) -> set:
+        if isinstance(field_filter, dict) and field_filter and field_filter.keys() <= HASH_OPS:
+            op_values = [[operand] if op == 'equals' else list(operand) for op, operand in field_filter.items()]
+            # unhashable operands (eg. a list for a column of lists) are matched by the column scan
+            if all(is_hashable(v) for values in op_values for v in values):
+                index = self.hash_index(field)
+                rows = None
+                for values in op_values:
+                    op_rows = {row_id for v in values for row_id in index.get(v, [])}
+                    rows = op_rows if rows is None else rows & op_rows
+                return rows
+        if isinstance(field_filter, dict) and field_filter and field_filter.keys() <= RANGE_OPS:
+            return self._range_rows(field, field_filter)
+        # column scan for the other operations
+        return {row_id for row_id, value in enumerate(self.column(field)) if match_filter(value, field_filter)}
+
+    def evaluate(self, where: Optional[dict]) -> list:
+        """ Row ids matching the where clause, in snapshot order """
+        if not where:
+            return list(range(len(self.rows)))
+        rows = None
+        for field, field_filter in where.items():
+            if field == 'or':
+                continue
+            field_rows = self._field_rows(field, field_filter)
+            rows = field_rows if rows is None else rows & field_rows
+            if not rows:
+                break
+        if rows is None:
+            rows = set()
+        if where.get('or'):
+            rows |= set(self.evaluate(where['or']))
+        return sorted(rows)
+
+
+class SnapshotQuery:
+    """
+    Query engine over the entity maps of a snapshot (humans, nhis, groups, accounts, ...).
+    """
+    def __init__(self, provider_map: dict):
+        self.provider_map = provider_map
+        self._tables = {}
+
+    @classmethod
+    def from_snapshot(cls, inventory_file: str) -> "SnapshotQuery":
+        with open(inventory_file, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def table(self, entity_type: str) -> _Table:
+        if entity_type not in ENTITY_MAPS:
+            raise InvalidInputException(f"Unknown entity type {entity_type}, expected one of {ENTITY_MAPS}")
+        if entity_type not in self._tables:
+            rows, row_providers = [], []
+            for provider_data in self.provider_map.values():
+                provider = provider_fields(provider_data)
+                for entity in (provider_data.get(entity_type) or {}).values():
+                    rows.append(entity)
+                    row_providers.append(provider)
+            resolvers = IDENTITY_FIELD_RESOLVERS if entity_type in IDENTITY_ENTITY_TYPES else None
+            self._tables[entity_type] = _Table(rows, row_providers, resolvers)
+        return self._tables[entity_type]
+
+    def query(self, entity_type: str, where: Optional[dict] = None, select: Optional[list] = None,
+              group_by: Optional[str] = None, limit: Optional[int] = None):
+        """
+        Run the query. Returns the count per value of the group_by field, or else the
+        matching entities (projected to the select fields when given).
+        """
+        table = self.table(entity_type)
+        row_ids = table.evaluate(where)
+        if group_by:
+            column = table.column(group_by)
+            counts = Counter()
+            for row_id in row_ids:
+                for value in as_values(column[row_id]):
+                    counts[json.dumps(value) if isinstance(value, (dict, list)) else value] += 1
+            return dict(counts.most_common())
+        if limit is not None:
+            row_ids = row_ids[:limit]
+        if not select:
+            return [table.rows[row_id] for row_id in row_ids]
+        columns = [(field, table.column(field)) for field in select]
+        return [{field: column[row_id] for field, column in columns} for row_id in row_ids]
+
+
+def main():
+    HELP_STR = """
+    This script runs a query over an inventory snapshot.
+
+    Example:
+        python3 sdk/as_query.py --snapshot=andromeda-inventory.json --entity_type=humans \\
+            --where='{"riskFactor": {"equals": "STALE"}}' --select=id,username,provider.name
+        python3 sdk/as_query.py --snapshot=andromeda-inventory.json --entity_type=humans --group_by=riskLevel
+    """
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=(HELP_STR)
+    )
+    parser.add_argument('--snapshot', required=True,
+                        help='andromeda-inventory.json downloaded by as_inventory.py')
+    parser.add_argument('--entity_type', default="humans", choices=ENTITY_MAPS,
+                        help='Entity type to query')
+    parser.add_argument('--where', default="",
+                        help='Filters as json, eg. {"riskLevel": {"in": ["HIGH", "CRITICAL"]}}')
+    parser.add_argument('--select', default="",
+                        help='Comma separated fields to output')
+    parser.add_argument('--group_by', default="",
+                        help='Field to count the matching entities by')
+    parser.add_argument('--limit', default=None, type=int,
+                        help='Max number of entities to output')
+    parser.add_argument('--logLevel', default="INFO",
+                        help='log level for the module when run as a script')
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.logLevel),
+                        format='%(asctime)s:%(levelname)s:%(module)s:%(lineno)s: %(message)s')
+
+    engine = SnapshotQuery.from_snapshot(args.snapshot)
+    result = engine.query(args.entity_type, where=json.loads(args.where) if args.where else None,
+                          select=args.select.split(',') if args.select else None,
+                          group_by=args.group_by or None, limit=args.limit)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+# Copyright 2025 Andromeda Security, Inc.
+#
+"""
+Asyncio variant of the APIUtils create / update helpers.
+
+AsyncAPIUtils has the create / update surface of APIUtils (create_or_update_resource,
+get_resource_by_name, create_or_update_base_provider, create_or_update_environment, the
+create_or_update_*_provider_config helpers, create_eligibility, update_account_config) but
+the calls are coroutines on an aiohttp session, so hundreds of provider configs can be pushed from one thread with asyncio.gather. The session pools pool_size connections, a
+RateLimiter spaces the requests and the session logs in again when it expires, like
+ReauthSession does for the requests sessions.
+
+The url building, the get_*_config_object builders and the create_or_update_*_provider_config
+helpers, which return the coroutine of create_or_update_provider, come from APIUtilsBase. The
+other request methods of APIUtils (iter_resources, bulk_upsert, ...) have no async variant,
+use an APIUtils with a requests session for them.
+
+Example usage:
+    async with AsyncAPIUtils(api_endpoint="https://api.andromedasecurity.com", rate_per_s=20) as api_utils:
+        session = await api_utils.get_api_session_w_api_token(login_token)
+        results = await asyncio.gather(*(
+            api_utils.create_or_update_aws_provider_config(session, p['id'], p['config']) for p in providers))
+"""
+import asyncio
+import copy
+import json
+import logging
+import time
+import traceback
+from typing import Optional
+
+import aiohttp
+
+from sdk.api_utils import (
+    APIUtilsBase, APISessionException, DEFAULT_NAME_INDEX_TTL_S,
+    DEFAULT_POOL_SIZE, DEFAULT_REST_PAGE_SIZE, DEFAULT_TIMEOUT, MIN_REAUTH_INTERVAL_S,
+    UPSERT_UNCHANGED, UpsertResult, changed_fields, is_auth_expired, write_op)
+from sdk.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def create_async_api_session(pool_size: int = DEFAULT_POOL_SIZE,
+                             timeout: tuple = DEFAULT_TIMEOUT) -> aiohttp.ClientSession:
+    """
+    aiohttp session with a pool of pool_size keep-alive connections and the (connect, read)
+    timeout of create_api_session. Has to be created inside the running event loop.
+    """
+    connector = aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size, ssl=False)
+    # unsafe keeps the DS cookie of endpoints addressed by ip
+    return aiohttp.ClientSession(
+        connector=connector, cookie_jar=aiohttp.CookieJar(unsafe=True),
+        timeout=aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1]),
+        headers={'Accept-Encoding': 'gzip, deflate'})
+
+
+class AsyncAPIUtils(APIUtilsBase):
+    def __init__(self, api_endpoint: str = "https://api.staging.andromedasecurity.com",
+                 api_session: Optional[aiohttp.ClientSession] = None,
+                 pool_size: int = DEFAULT_POOL_SIZE, timeout: tuple = DEFAULT_TIMEOUT,
+                 name_index_ttl_s: float = DEFAULT_NAME_INDEX_TTL_S,
+                 rate_per_s: Optional[float] = None, rate_limiter: Optional[RateLimiter] = None,
+                 min_reauth_interval_s: float = MIN_REAUTH_INTERVAL_S) -> None:
+        super().__init__(api_endpoint, api_session, pool_size, timeout, name_index_ttl_s)
+        # a shared rate_limiter also caps the requests of the sync crawlers using it
+        self.rate_limiter = rate_limiter or RateLimiter(rate_per_s)
+        self.min_reauth_interval_s = min_reauth_interval_s
+        self.auth_generation = 0
+        self.last_login_at = 0.0
+        self._login_token = None
+        self._auth_lock = asyncio.Lock()
+        # resource_type -> asyncio.Lock, the listing of a type does not block the other types
+        self._name_index_locks = {}
+
+    async def __aenter__(self) -> "AsyncAPIUtils":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self.api_session is not None:
+            await self.api_session.close()
+            self.api_session = None
+
+    async def get_api_session_w_api_token(self, login_token: str) -> aiohttp.ClientSession:
+        """
+        This function returns an aiohttp session logged in with the access key, the session
+        logs in again with it when it expires
+        """
+        session = create_async_api_session(self.pool_size, self.timeout)
+        try:
+            if not await self._login_w_api_token(login_token, session):
+                raise APISessionException(f"Failed to login to API server {self.api_endpoint}")
+        except Exception as exc:
+            await session.close()
+            logger.error('Failed to login to API server %s', self.api_endpoint)
+            logger.error('exception %s\n %s', exc, traceback.format_exc())
+            raise exc
+        self._login_token = login_token
+        self.auth_generation += 1
+        self.last_login_at = time.time()
+        self.api_session = session
+        return session
+
+    async def _login_w_api_token(self, login_token: str, session: aiohttp.ClientSession) -> bool:
+        await self.rate_limiter.async_wait()
+        async with session.post(f"{self.api_endpoint}/login/access-key", json={'code': login_token}) as response:
+            if response.status != 200:
+                logger.error('Failed to login to API server %s', self.api_endpoint)
+                logger.error('API Response: %s', await response.text())
+                return False
+        return True
+
+    def get_api_session_w_cookie(self, cookie: str) -> aiohttp.ClientSession:
+        """
+        This function returns an aiohttp session with the DS cookie, call it from the event loop
+        """
+        session = create_async_api_session(self.pool_size, self.timeout)
+        session.cookie_jar.update_cookies({'DS': cookie})
+        self.api_session = session
+        return session
+
+    async def _reauthenticate(self, api_session: aiohttp.ClientSession, generation: int) -> bool:
+        """ Log in again unless another task already did since generation. Returns True to replay """
+        async with self._auth_lock:
+            if self.auth_generation != generation:
+                return True
+            if time.time() - self.last_login_at < self.min_reauth_interval_s:
+                return False
+            logger.info("API session expired, logging in again")
+            if not await self._login_w_api_token(self._login_token, api_session):
+                return False
+            self.auth_generation += 1
+            self.last_login_at = time.time()
+            return True
+
+    async def _request(self, api_session: aiohttp.ClientSession, op: str, url: str,
+                       obj: Optional[dict] = None, params: Optional[dict] = None) -> tuple[int, Optional[dict]]:
+        """ Send the request and return (status_code, json body), None for an empty body """
+        for attempt in range(2):
+            generation = self.auth_generation
+            await self.rate_limiter.async_wait()
+            async with api_session.request(op.upper(), url, json=obj, params=params) as response:
+                status_code = response.status
+                body = await response.read()
+            if (attempt == 0 and is_auth_expired(status_code, body) and self._login_token
+                    and await self._reauthenticate(api_session, generation)):
+                continue
+            break
+        return status_code, json.loads(body) if body else None
+
+    async def create_or_update_resource(
+            self, api_session: aiohttp.ClientSession, resource_type: str,
+            resource_id: str = "", resource_name: str = "", obj: dict = None) -> tuple[int, dict]:
+        """ As APIUtils.create_or_update_resource, with a resource_id obj is always PUT """
+        try:
+            logger.info("resource_type %s resource_name %s resource_id %s",
+                         resource_type, resource_name, resource_id)
+            if resource_name and not resource_id:
+                status_code, existing_obj = await self.get_resource_by_name(
+                    api_session, resource_type, resource_name)
+                if status_code == 200 and existing_obj:
+                    if not changed_fields(existing_obj, obj):
+                        logger.debug("resource %s %s unchanged", resource_type, resource_name)
+                        return UpsertResult(status_code, existing_obj, UPSERT_UNCHANGED)
+                    existing_obj.update(obj)
+                    obj = existing_obj
+                    op = 'put'
+                    url = self.get_resource_url(resoure_type=resource_type, resource_id=obj['id'])
+                else:
+                    op = 'post'
+                    url = self.get_resource_url(resoure_type=resource_type)
+            else:
+                op = 'put' if resource_id else 'post'
+                url = self.get_resource_url(resoure_type=resource_type, resource_id=resource_id)
+
+            status_code, obj = await self._request(api_session, op, url, obj)
+            if resource_name and not resource_id and 200 <= status_code < 300:
+                self._update_resource_name_index(resource_type, resource_name, obj)
+            else:
+                self.invalidate_resource_name_index(resource_type)
+            logger.debug("url:%s op:%s status_code:%s obj:%s", url, op, status_code, obj)
+        except Exception as exc:
+            logger.error('Failed to create provider object')
+            logger.error('exception %s\n %s', exc, traceback.format_exc())
+            raise exc
+        return UpsertResult(status_code, obj, write_op(status_code, op))
+
+    async def create_or_update_base_provider(self, api_session: aiohttp.ClientSession,
+                                             provider_obj: dict) -> tuple[int, dict]:
+        return await self.create_or_update_resource(
+            api_session, resource_type='providers', resource_id=provider_obj.get('id', ""),
+            resource_name=provider_obj.get('name'), obj=provider_obj)
+
+    async def create_or_update_environment(self, api_session: aiohttp.ClientSession,
+                                           environment_obj: dict) -> tuple[int, dict]:
+        logger.debug("creating environment %s", environment_obj['name'])
+        return await self.create_or_update_resource(
+            api_session, resource_type="environments", resource_name=environment_obj['name'], obj=environment_obj)
+
+    async def _list_resources(self, api_session: aiohttp.ClientSession, resource_type: str,
+                              page_size: int = DEFAULT_REST_PAGE_SIZE) -> list:
+        """ All the resources of the type, the pages followed like APIUtils.iter_resources """
+        url = self.get_resource_url(resoure_type=resource_type)
+        resources, page, skip = [], {}, 0
+        while True:
+            params = {"pageSize": page_size}
+            if page.get('nextPageCursor'):
+                params["cursor"] = page['nextPageCursor']
+            else:
+                params["skip"] = skip
+            status_code, page = await self._request(api_session, 'get', url, params=params)
+            if status_code != 200:
+                raise APISessionException(f"Failed to list {resource_type} status {status_code}")
+            page = page or {}
+            results = page.get('results') or []
+            resources.extend(results)
+            skip += len(results)
+            count = page.get('count')
+            if (not results or (count is not None and skip >= int(count))
+                    or not (page.get('nextPageCursor') or len(results) == page_size)):
+                return resources
+
+    async def _resource_name_index(self, api_session: aiohttp.ClientSession, resource_type: str) -> Optional[dict]:
+        """ name -> resource of all the resources of the type, one listing per ttl for all the tasks """
+        if self.name_index_ttl_s <= 0:
+            return None
+        async with self._name_index_locks.setdefault(resource_type, asyncio.Lock()):
+            with self._name_index_lock:
+                loaded_at, index = self._name_indexes.get(resource_type, (0, None))
+                generation = self._name_index_generations.get(resource_type, 0)
+            if index is not None and time.time() - loaded_at < self.name_index_ttl_s:
+                return index
+            index = {}
+            try:
+                for r in await self._list_resources(api_session, resource_type):
+                    index.setdefault(r.get('name'), r)
+            except Exception as exc:
+                logger.debug("could not list %s to index them: %s", resource_type, exc)
+                return None
+            with self._name_index_lock:
+                if self._name_index_generations.get(resource_type, 0) == generation:
+                    self._name_indexes[resource_type] = (time.time(), index)
+            logger.debug("indexed %s %s by name", len(index), resource_type)
+            return index
+
+    async def get_resource_by_name(self, api_session: aiohttp.ClientSession, resource_type: str,
+                                   resource_name: str) -> (int, dict):
+        """
+        This function returns a resource by name, from the name index like APIUtils.get_resource_by_name
+        """
+        index = await self._resource_name_index(api_session, resource_type)
+        if index and resource_name in index:
+            return 200, copy.deepcopy(index[resource_name])
+        status_code, response_obj = await self._request(api_session, 'get', self.get_resource_url(
+            resoure_type=resource_type, resource_name=resource_name))
+        resource_obj = None
+        if status_code == 200:
+            r = [r for r in (response_obj or {}).get('results') or [] if r['name'] == resource_name]
+            if r:
+                resource_obj = r[0]
+                logger.debug("found resource %s %s", resource_type, resource_obj['name'])
+            else:
+                status_code = 404
+        return status_code, resource_obj
+
+    async def create_or_update_workday_provider_config(self, andromeda_base_url, api_session: aiohttp.ClientSession,
+                                                       provider_obj: dict) -> tuple[int, dict]:
+        """
+        This function creates or updates the cloud specific settings for a provider
+        """
+        config_url = f"{andromeda_base_url}/integrations/{provider_obj['id']}/workday"
+        data = {
+            "name": provider_obj['name'],
+        }
+        if 'workdayConfiguration' in provider_obj:
+            data.update(provider_obj['workdayConfiguration'])
+        if 'fileId' in provider_obj:
+            data["fileId"] = provider_obj['fileId']
+
+        status_code, existing_config = await self._request(api_session, 'get', config_url)
+        resource_id = ""
+        if status_code == 200 and existing_config:
+            resource_id = existing_config['id']
+            new_config = existing_config
+            # same merge as APIUtils, the api config and the immutable fields are not sent back
+            for key in ('api_config', 'apiConfig', 'defaultMode', 'userDataMappingProfile'):
+                new_config.pop(key, None)
+            new_config.update(data)
+        else:
+            new_config = data
+
+        op = "put" if resource_id else "post"
+        status_code, response_obj = await self._request(api_session, op, config_url, new_config)
+        if status_code != 200:
+            logger.error("config for provider op %s url %s provider %s status %s obj %s response %s",
+                        op, config_url, provider_obj['id'], status_code, new_config, response_obj)
+        return status_code, response_obj
+
+    async def create_or_update_provider(self,
+            api_session: aiohttp.ClientSession,
+            provider_id,
+            provider_config,
+            provider_url: str) -> tuple[int, dict]:
+        status_code, existing_config = await self._request(api_session, 'get', provider_url)
+        resource_id = ""
+        if status_code == 200 and existing_config:
+            if not changed_fields(existing_config, provider_config):
+                logger.debug("provider %s config %s unchanged", provider_id, provider_url)
+                return UpsertResult(status_code, existing_config, UPSERT_UNCHANGED)
+            resource_id = existing_config['id']
+            provider_config['id'] = resource_id
+            provider_config['updatedAt'] = existing_config['updatedAt']
+        op = "put" if resource_id else "post"
+        status_code, response_obj = await self._request(api_session, op, provider_url, provider_config)
+        if status_code != 200:
+            logger.error("provider op:%s url:%s provider:%s status:%s obj:%s response:%s",
+                        op, provider_url, provider_id, status_code, provider_config, response_obj)
+        return UpsertResult(status_code, response_obj, write_op(status_code, op))
+
+    async def create_eligibility(
+            self, api_session: aiohttp.ClientSession,
+            provider_id: str,
+            eligibility_mapping: dict) -> (int, dict):
+        try:
+            url = self.get_resource_url(
+                resoure_type=f"providers/{provider_id}/eligibility")
+            return await self._request(api_session, 'post', url, eligibility_mapping)
+        except Exception:
+            raise APISessionException("Failed to create eligibility")
+
+    async def update_account_config(self, api_session: aiohttp.ClientSession, provider_id: str, account_id: str,
+                                    account_config_obj: dict) -> tuple[int, dict]:
+        url = self.get_resource_url(f"providers/{provider_id}/accounts/{account_id}/config")
+        return await self._request(api_session, 'put', url, account_config_obj)
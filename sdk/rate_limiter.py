@@ -0,0 +1,67 @@
+# Copyright 2025 Andromeda Security, Inc.
+#
+"""
+Request pacing shared by the inventory crawlers.
+
+A RateLimiter hands out evenly spaced request slots. The slot bookkeeping can
+live in shared memory (multiprocessing.Value + Lock) so that a single limiter
+caps the request rate of several worker processes, and limiters can be chained
+so a request has to clear both a per-tenant and a global limit.
+
+Example usage:
+    global_limiter = RateLimiter(20, lock=multiprocessing.Lock(),
+                                 next_slot=multiprocessing.Value('d', 0.0))
+    tenant_limiter = RateLimiter(5, parent=global_limiter)
+    tenant_limiter.wait()
+    # or from asyncio code, without blocking the event loop
+    await tenant_limiter.async_wait()
+"""
+import asyncio
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Spaces calls to wait() at least 1/rate_per_s seconds apart.
+    A rate of 0 (or None) disables the limiter.
+    """
+    def __init__(self, rate_per_s: Optional[float], lock=None, next_slot=None,
+                 parent: Optional["RateLimiter"] = None) -> None:
+        self.rate_per_s = rate_per_s
+        self.interval_s = 1.0 / rate_per_s if rate_per_s else 0.0
+        self.parent = parent
+        self._lock = lock if lock is not None else threading.Lock()
+        # next_slot is a multiprocessing.Value('d') when shared across processes
+        self._next_slot = next_slot
+        self._local_next_slot = 0.0
+
+    def _reserve_slot(self) -> float:
+        with self._lock:
+            now = time.time()
+            next_slot = self._next_slot.value if self._next_slot is not None else self._local_next_slot
+            slot = max(now, next_slot)
+            if self._next_slot is not None:
+                self._next_slot.value = slot + self.interval_s
+            else:
+                self._local_next_slot = slot + self.interval_s
+        return slot - now
+
+    def wait(self) -> None:
+        """ Block until the caller is allowed to issue the next request """
+        if self.interval_s:
+            delay_s = self._reserve_slot()
+            if delay_s > 0:
+                time.sleep(delay_s)
+        if self.parent:
+            self.parent.wait()
+
+    async def async_wait(self) -> None:
+        """ wait() for asyncio callers, the slot is awaited instead of slept """
+        if self.interval_s:
+            delay_s = self._reserve_slot()
+            if delay_s > 0:
+                await asyncio.sleep(delay_s)
+        if self.parent:
+            await self.parent.async_wait()
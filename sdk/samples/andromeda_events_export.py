@@ -4,16 +4,25 @@
 This script get list of identities matching a significance / insight
 """
 import argparse
+import gzip
 import logging
 import json
 import os
-from datetime import datetime, timedelta
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from sdk.api_utils import APIUtils, InvalidInputException
-from sdk.as_inventory import AndromedaInventory
+from sdk.as_inventory import AndromedaInventory, format_time, load_state, save_state, utc_time
 import requests
 
 logger = logging.getLogger(__name__)
 
+EVENTS_EXPORT_STATE_FILE = "andromeda_events_export.state.json"
+EVENTS_FOLLOW_STATE_FILE = "andromeda_events_follow.state.json"
+# upper bound of the events fetched per time window, the iterators stop at 10000 by default
+MAX_EVENTS_PER_WINDOW = 1000000
+
 
 def _setup_args() -> argparse.Namespace:
     help_str = """
@@ -29,6 +38,10 @@ def _setup_args() -> argparse.Namespace:
         python3 sdk/samples/andromeda_events_export.py --as_event_subtype=ACCESS_REQUEST
         # export user events for last 7 days
         python3 sdk/samples/andromeda_events_export.py --as_event_type=USER_EVENT
+        # export the events since the previous run, 4 windows in parallel, gzipped
+        python3 sdk/samples/andromeda_events_export.py --incremental --num_windows=4 --gzip
+        # follow the events as they happen
+        python3 sdk/samples/andromeda_events_export.py --follow --rotate_max_age_s=600
     """
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawTextHelpFormatter,
@@ -55,6 +68,27 @@ def _setup_args() -> argparse.Namespace:
                         help='Start time for the events, datetime.now() - timedelta(days=7)',
                         default=(datetime.now() - timedelta(days=7)).isoformat())
 
+    parser.add_argument('--end_time',
+                        help='End time for the events, defaults to now')
+
+    parser.add_argument('--num_windows', type=int, default=1,
+                        help='Split the time range in windows that are fetched in parallel')
+
+    parser.add_argument('--gzip', action='store_true',
+                        help='Compress the ndjson output')
+
+    parser.add_argument('--incremental', action='store_true',
+                        help=f'Start from the watermark saved in {EVENTS_EXPORT_STATE_FILE} by the previous run')
+
+    parser.add_argument('--follow', action='store_true',
+                        help='Keep polling for new events and write them to rotating ndjson files')
+
+    parser.add_argument('--rotate_max_bytes', type=int, default=100 * 1024 * 1024,
+                        help='With --follow, start a new file when the current one reaches this size')
+
+    parser.add_argument('--rotate_max_age_s', type=int, default=3600,
+                        help='With --follow, start a new file when the current one is older than this')
+
     parser.add_argument('--as_output_dir',
                         help='Output directory for the inventory',
                         default="/tmp/andromeda-inventory/andromeda_inventory_sample")
@@ -99,30 +133,173 @@ def _get_api_session(api_endpoint: str, as_session_token: str, as_api_token: str
     raise InvalidInputException(
         "Either as_api_token or as_session_token must be provided")
 
+def _time_windows(start_time: str, end_time: str, num_windows: int) -> list:
+    """ Split [start_time, end_time] into num_windows contiguous (start, end) windows """
+    start, end = utc_time(start_time), utc_time(end_time)
+    num_windows = max(1, num_windows)
+    step = (end - start) / num_windows
+    bounds = [start + step * i for i in range(num_windows)] + [end]
+    return [(format_time(bounds[i]), format_time(bounds[i + 1])) for i in range(num_windows)]
+
+
+def _open_output(path: str, compress: bool):
+    return gzip.open(path, 'wt', encoding='utf-8') if compress else open(path, 'w', encoding='utf-8')
+
+
+def _export_window(
+        as_inventory: AndromedaInventory, filters: dict, window: tuple, part_f: str,
+        compress: bool, skip_start: bool, skip_ids: set) -> dict:
+    """
+    Stream the events of the window to the part file as ndjson. The window bounds are
+    inclusive: with skip_start the events at the start bound are left to the previous window,
+    and the events already exported by the previous run (skip_ids) are skipped.
+    Returns the number of events and the high watermark of the window.
+    """
+    window_filters = dict(filters, eventTime={"greaterThanOrEquals": window[0], "lessThanOrEquals": window[1]})
+    window_start = utc_time(window[0])
+    count, watermark, watermark_ids = 0, None, set()
+    with _open_output(part_f, compress) as f:
+        for event in as_inventory.as_events_itr(filters=window_filters, max_count=MAX_EVENTS_PER_WINDOW):
+            event_time = utc_time(event["time"]) if event.get("time") else None
+            if event.get("id") in skip_ids or (skip_start and event_time == window_start):
+                continue
+            f.write(json.dumps(event) + "\n")
+            count += 1
+            if event_time and (watermark is None or event_time > watermark):
+                watermark, watermark_ids = event_time, {event.get("id")}
+            elif event_time and event_time == watermark:
+                watermark_ids.add(event.get("id"))
+    logger.info("window %s - %s events %s", window[0], window[1], count)
+    return {"count": count, "watermark": watermark, "watermarkIds": watermark_ids}
+
+
 def _export_events(
         as_inventory: AndromedaInventory, output_dir: str,
-        event_type: str, event_subtype: str, start_time: str, event_name: str) -> None:
+        event_type: str, event_subtype: str, start_time: str, event_name: str,
+        end_time: str = None, num_windows: int = 1, compress: bool = False,
+        incremental: bool = False) -> str:
+    """
+    Export the events as ndjson, one event per line, streamed to the file as the pages arrive.
+
+    The time range is split in num_windows windows fetched in parallel, each into its own part
+    file, and the parts are concatenated in time order. The high watermark eventTime is saved
+    in the state file so an incremental run only fetches the events since the previous run.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    state_f = f"{output_dir}/{EVENTS_EXPORT_STATE_FILE}"
+    end_time = end_time or format_time(datetime.now(timezone.utc))
+
+    filters = {}
+    if event_type:
+        filters["eventType"] = {"equals": event_type.strip()}
+    if event_subtype:
+        filters['eventSubtype'] = {"equals": event_subtype.strip()}
+    if event_name:
+        filters["name"] = {"equals": event_name.strip()}
+
+    # the watermark is only valid for the same filters
+    filters_key = json.dumps(filters, sort_keys=True)
+    state = load_state(state_f) if incremental else {}
+    skip_ids = set()
+    if state.get("filters") == filters_key and state.get("watermark"):
+        start_time = state["watermark"]
+        skip_ids = set(state.get("watermarkIds", []))
+        logger.info("incremental export from watermark %s", start_time)
+
+    windows = _time_windows(start_time, end_time, num_windows)
+    run_id = utc_time(end_time).strftime("%Y%m%dT%H%M%S")
+    suffix = ".ndjson.gz" if compress else ".ndjson"
+    output_f = f"{output_dir}/andromeda_events_export_{run_id}{suffix}"
+    part_fs = [f"{output_f}.part{i}" for i in range(len(windows))]
+    with ThreadPoolExecutor(max_workers=len(windows)) as executor:
+        results = list(executor.map(
+            lambda i: _export_window(as_inventory, filters, windows[i], part_fs[i], compress,
+                                     skip_start=i > 0, skip_ids=skip_ids if i == 0 else set()),
+            range(len(windows))))
+
+    # the parts are in time order, gzip members can be concatenated as is
+    with open(output_f, 'wb') as out:
+        for part_f in part_fs:
+            with open(part_f, 'rb') as part:
+                shutil.copyfileobj(part, out)
+            os.remove(part_f)
+
+    count = sum(r["count"] for r in results)
+    watermark, watermark_ids = utc_time(start_time), skip_ids
+    for result in results:
+        if result["watermark"] is None:
+            continue
+        if result["watermark"] > watermark:
+            watermark, watermark_ids = result["watermark"], result["watermarkIds"]
+        elif result["watermark"] == watermark:
+            watermark_ids = watermark_ids | result["watermarkIds"]
+    save_state(state_f, {"filters": filters_key, "watermark": format_time(watermark),
+                                 "watermarkIds": sorted(i for i in watermark_ids if i)})
+    logger.info("Events exported %s to \n ndjson: %s watermark %s", count, output_f, format_time(watermark))
+    return output_f
+
+
+class RotatingNdjsonSink:
     """
-    Export identities with ops insights to a file
+    Callback for AndromedaInventory.as_events_follow, appends the events to
+    <output_dir>/andromeda_events_<start>.ndjson and starts a new file when the current one
+    reaches max_bytes or max_age_s. The events are flushed and fsynced before returning so
+    the follow watermark never gets ahead of the data on disk.
     """
-    json_output_f = f"{output_dir}/andromeda_events_export.json"
+    def __init__(self, output_dir: str, max_bytes: int, max_age_s: int):
+        self.output_dir = output_dir
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.f = None
+        self.opened_at = 0
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _rotate(self) -> None:
+        if self.f:
+            self.f.close()
+        file_name = f"andromeda_events_{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}.ndjson"
+        self.f = open(f"{self.output_dir}/{file_name}", 'a', encoding='utf-8')
+        self.opened_at = time.time()
+        logger.info("writing events to %s", self.f.name)
+
+    def __call__(self, events: list) -> None:
+        if not self.f or self.f.tell() >= self.max_bytes or time.time() - self.opened_at >= self.max_age_s:
+            self._rotate()
+        for event in events:
+            self.f.write(json.dumps(event) + "\n")
+        self.f.flush()
+        os.fsync(self.f.fileno())
 
+    def close(self) -> None:
+        if self.f:
+            self.f.close()
+            self.f = None
+
+
+def _follow_events(
+        as_inventory: AndromedaInventory, output_dir: str,
+        event_type: str, event_subtype: str, start_time: str, event_name: str,
+        rotate_max_bytes: int, rotate_max_age_s: int) -> None:
+    """
+    Follow the events into rotating ndjson files until interrupted. The watermark is kept in
+    the follow state file, a restart resumes from it.
+    """
     filters = {}
     if event_type:
         filters["eventType"] = {"equals": event_type.strip()}
     if event_subtype:
         filters['eventSubtype'] = {"equals": event_subtype.strip()}
-    if start_time:
-        filters["eventTime"] = {"greaterThanOrEquals": start_time}
     if event_name:
         filters["name"] = {"equals": event_name.strip()}
+    sink = RotatingNdjsonSink(output_dir, rotate_max_bytes, rotate_max_age_s)
+    try:
+        as_inventory.as_events_follow(
+            sink, filters=filters, state_file=f"{output_dir}/{EVENTS_FOLLOW_STATE_FILE}", start_time=start_time)
+    except KeyboardInterrupt:
+        logger.info("stopped following events")
+    finally:
+        sink.close()
 
-    events = []
-    with open(f"{json_output_f}", 'w', encoding='utf-8') as f:
-        for event in as_inventory.as_events_itr(filters=filters):
-            events.append(event)
-        json.dump(events, f, indent=2)
-    logger.info("Events exported to \n json: %s", json_output_f)
 
 if __name__ == '__main__':
     args = _setup_args()
@@ -136,5 +313,11 @@ if __name__ == '__main__':
         output_dir="/tmp/andromeda-inventory",
         as_endpoint=as_api_endpoint, gql_endpoint=args.as_gql_endpoint)
 
-    _export_events(
-        ai, args.as_output_dir, args.as_event_type, args.as_event_subtype, args.start_time, args.as_event_name)
+    if args.follow:
+        _follow_events(
+            ai, args.as_output_dir, args.as_event_type, args.as_event_subtype, args.start_time, args.as_event_name,
+            args.rotate_max_bytes, args.rotate_max_age_s)
+    else:
+        _export_events(
+            ai, args.as_output_dir, args.as_event_type, args.as_event_subtype, args.start_time, args.as_event_name,
+            end_time=args.end_time, num_windows=args.num_windows, compress=args.gzip, incremental=args.incremental)
@@ -9,6 +9,7 @@ import json
 import os
 from sdk.api_utils import APIUtils
 from sdk.as_inventory import AndromedaInventory
+from sdk.as_offline_inventory import OfflineAndromedaInventory
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +26,8 @@ def _setup_args() -> argparse.Namespace:
     Example:
         python3 sdk/samples/andromeda_inventory_sample.py --as_ops_insights=ADMIN_ACCOUNT --as_risk_factors=RISK_FACTOR_STALE
         python3 sdk/samples/andromeda_inventory_sample.py --operation_type=dashboard_summary
+        python3 sdk/samples/andromeda_inventory_sample.py --as_risk_factors=RISK_FACTOR_STALE \
+            --snapshot=/tmp/andromeda-inventory/<tenant_id>/andromeda-inventory.json
     """
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawTextHelpFormatter,
@@ -58,7 +61,14 @@ def _setup_args() -> argparse.Namespace:
                         default="identity_insights",
                         choices=["identity_insights", "dashboard_summary"])
 
-    return parser.parse_args()
+    parser.add_argument('--snapshot',
+                        help='Inventory snapshot downloaded by as_inventory.py, the identities are '
+                             'read from it instead of the API. Not supported for dashboard_summary')
+
+    args = parser.parse_args()
+    if args.snapshot and args.operation_type == "dashboard_summary":
+        parser.error("the dashboard summaries are not in the snapshot, --snapshot requires identity_insights")
+    return args
 
 def _setup_logging():
     logger.setLevel(logging.DEBUG)
@@ -77,7 +87,7 @@ def _get_api_session(as_api_endpoint: str, as_session_token: str, as_api_token:
     Returns:
         APIUtils
     """
-    au = APIUtils(api_endpoint=as_api_endpoint)
+    au = APIUtils(api_endpoint=as_api_endpoint, coalesce=True)
     as_session_token = as_session_token or os.getenv("AS_SESSION_COOKIE")
     if as_session_token:
         return au.get_api_session_w_cookie(as_session_token)
@@ -146,11 +156,14 @@ if __name__ == '__main__':
     args = _setup_args()
     _setup_logging()
     as_api_endpoint = args.as_api_endpoint
-    api_session = _get_api_session(args.as_api_endpoint, args.as_session_token, args.as_api_token)
-    ai = AndromedaInventory(
-        None, api_session=api_session,
-        output_dir="/tmp/andromeda-inventory",
-        as_endpoint=as_api_endpoint, gql_endpoint=args.as_gql_endpoint)
+    if args.snapshot:
+        ai = OfflineAndromedaInventory(args.snapshot)
+    else:
+        api_session = _get_api_session(args.as_api_endpoint, args.as_session_token, args.as_api_token)
+        ai = AndromedaInventory(
+            None, api_session=api_session,
+            output_dir="/tmp/andromeda-inventory",
+            as_endpoint=as_api_endpoint, gql_endpoint=args.as_gql_endpoint)
 
     if args.operation_type == "identity_insights":
         _export_identities_with_ops_insights(
@@ -10,9 +10,14 @@ import os
 import csv
 from sdk.api_utils import APIUtils
 from sdk.as_inventory import AndromedaInventory
+from sdk.as_offline_inventory import OfflineAndromedaInventory
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PROVIDER_ID = "84f8ee5e-b1c1-4351-91c4-c7387aea10d8"
+# upper bound of the humans streamed into the index, the iterators stop at 10000 by default
+MAX_INDEXED_HUMANS = 1000000
+
 
 def _setup_args() -> argparse.Namespace:
     help_str = """
@@ -53,6 +58,21 @@ def _setup_args() -> argparse.Namespace:
                         help='Workday file to validate',
                         required=True)
 
+    parser.add_argument('--provider_id', '-p',
+                        help='Provider whose humans are validated against the workday file',
+                        default=DEFAULT_PROVIDER_ID)
+
+    parser.add_argument('--mode',
+                        help='batch (default): query the humans of every batch of 50 workday users\n'
+                             'index: load all the tenant and provider humans once and validate locally, '
+                             'faster for large workday files but downloads all the humans of the tenant',
+                        choices=["batch", "index"],
+                        default="batch")
+
+    parser.add_argument('--snapshot',
+                        help='Inventory snapshot downloaded by as_inventory.py, the humans are '
+                             'read from it instead of the API')
+
     return parser.parse_args()
 
 def _setup_logging():
@@ -72,7 +92,7 @@ def _get_api_session(as_api_endpoint: str, as_session_token: str, as_api_token:
     Returns:
         APIUtils
     """
-    au = APIUtils(api_endpoint=as_api_endpoint)
+    au = APIUtils(api_endpoint=as_api_endpoint, coalesce=True)
     as_session_token = as_session_token or os.getenv("AS_SESSION_COOKIE")
     if as_session_token:
         return au.get_api_session_w_cookie(as_session_token)
@@ -83,56 +103,30 @@ def _get_api_session(as_api_endpoint: str, as_session_token: str, as_api_token:
         "Either as_api_token or as_session_token must be provided")
 
 
-def _validate_workday_file(
-        as_inventory: AndromedaInventory, workday_file: str, as_output_dir: str) -> None:
+def _read_workday_users(workday_file: str) -> dict:
     """
-    Validate the workday file
+    Read the workday file into a map of email to the workday row, fails on duplicate emails
     """
-    missing_users = []
-    missing_users_in_provider = []
-    processed_users = set()
-    num_users = 0
-    provider_data = next(as_inventory.app_provider_itr( filters={"id": {"equals": "84f8ee5e-b1c1-4351-91c4-c7387aea10d8"}}))
-    workday_users_map = {}
     with open(workday_file, 'r', encoding='utf-8') as f:
         csv_reader = csv.DictReader(f)
-        workday_users_map = {row['email']: row for row in csv_reader}
-        workday_users = sorted(workday_users_map.keys())
-        logger.info("Workday users: %s, unique: %s", len(workday_users), len(set(workday_users)))
+        workday_rows = list(csv_reader)
+    workday_users_map = {row['email']: row for row in workday_rows}
+    logger.info("Workday users: %s, unique: %s", len(workday_rows), len(workday_users_map))
+    if len(workday_users_map) != len(workday_rows):
         check_users = set()
         duplicate_users = []
-        for user in workday_users:
-            if user in check_users:
-                logger.error("Duplicate user found in the workday file: %s", user)
-                duplicate_users.append(user)
-            check_users.add(user)
-        if duplicate_users:
-            logger.info("Duplicate users: %s", duplicate_users)
-            assert False, "Duplicate users found in the workday file"
-        # in batches of 50 check if the user is present
-        batch_size = 50
-        for i in range(0, len(workday_users), batch_size):
-            batch = set(workday_users[i: i+ batch_size])
-            logger.info("Checking batch: %s", sorted(batch))
-            processed_users = set()
-            #check using as_inventory if the user is present
-            for hi in as_inventory.as_humans_itr(filters={"username": {"in": batch}}):
-                if hi['email'] in batch:
-                    #logger.debug("User %s found status %s", hi['email'], hi['state'])
-                    batch.remove(hi['email'])
-            missing_users.extend(list(batch))
-            # find missing users in the provider
-            batch = set(workday_users[i: i+ batch_size])
-            # check if the set matches
-            processed_users = set()
-            for hi in as_inventory.provider_humans_itr(
-                provider_id="84f8ee5e-b1c1-4351-91c4-c7387aea10d8",
-                provider_data=provider_data, filters={"username": {"in": batch}}):
-                if hi['email'] in batch:
-                    batch.remove(hi['email'])
-            missing_users_in_provider.extend(list(batch))
-        logger.info("Missing users in the provider: %s", missing_users_in_provider)
-        logger.info("Missing users: %s %s processed: %s", missing_users, num_users, len(processed_users))
+        for row in workday_rows:
+            if row['email'] in check_users:
+                logger.error("Duplicate user found in the workday file: %s", row['email'])
+                duplicate_users.append(row['email'])
+            check_users.add(row['email'])
+        logger.info("Duplicate users: %s", duplicate_users)
+        assert False, "Duplicate users found in the workday file"
+    return workday_users_map
+
+
+def _write_missing_users(as_output_dir: str, workday_users_map: dict,
+                         missing_users: list, missing_users_in_provider: list) -> None:
     missing_users_map = {user: workday_users_map[user] for user in missing_users}
     logger.info("Missing users found in the inventory %s: %s", missing_users, missing_users_map)
     missing_users_map = {user: workday_users_map[user] for user in missing_users_in_provider}
@@ -140,13 +134,100 @@ def _validate_workday_file(
     with open(f"{as_output_dir}/missing_users.txt", 'w', encoding='utf-8') as f:
         f.write(json.dumps(missing_users_map, indent=2) + '\n')
 
+
+def _normalise(value: str) -> str:
+    return value.strip().lower() if value else ""
+
+
+def _build_identity_index(humans_itr) -> dict:
+    """
+    Index the humans by their normalised email and username
+    """
+    index = {}
+    for human in humans_itr:
+        for key in (human.get('email'), human.get('username')):
+            if key:
+                index.setdefault(_normalise(key), human)
+    return index
+
+
+def _validate_workday_file_indexed(
+        as_inventory: AndromedaInventory, workday_file: str, as_output_dir: str, provider_id: str) -> dict:
+    """
+    Validate the workday file against indexes of all the tenant humans and of the provider humans,
+    every check is a local set operation
+    """
+    workday_users_map = _read_workday_users(workday_file)
+    provider_data = next(as_inventory.app_provider_itr(filters={"id": {"equals": provider_id}}))
+    tenant_index = _build_identity_index(as_inventory.as_humans_itr(max_count=MAX_INDEXED_HUMANS))
+    provider_index = _build_identity_index(as_inventory.provider_humans_itr(
+        provider_id=provider_id, provider_data=provider_data, max_count=MAX_INDEXED_HUMANS))
+    logger.info("Indexed tenant humans keys %s provider %s humans keys %s",
+                len(tenant_index), provider_id, len(provider_index))
+
+    workday_keys = {_normalise(email): email for email in workday_users_map}
+    missing_users = sorted(workday_keys[k] for k in workday_keys.keys() - tenant_index.keys())
+    missing_users_in_provider = sorted(workday_keys[k] for k in workday_keys.keys() - provider_index.keys())
+    _write_missing_users(as_output_dir, workday_users_map, missing_users, missing_users_in_provider)
+
+    summary = {
+        "workdayUsers": len(workday_users_map),
+        "providerId": provider_id,
+        "missingUsers": len(missing_users),
+        "missingUsersInProvider": len(missing_users_in_provider),
+        "foundUsers": len(workday_users_map) - len(missing_users),
+        "foundUsersInProvider": len(workday_users_map) - len(missing_users_in_provider),
+    }
+    with open(f"{as_output_dir}/validation_summary.json", 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    logger.info("Validation summary: %s", summary)
+    return summary
+
+
+def _validate_workday_file(
+        as_inventory: AndromedaInventory, workday_file: str, as_output_dir: str, provider_id: str) -> None:
+    """
+    Validate the workday file
+    """
+    missing_users = []
+    missing_users_in_provider = []
+    provider_data = next(as_inventory.app_provider_itr(filters={"id": {"equals": provider_id}}))
+    workday_users_map = _read_workday_users(workday_file)
+    workday_users = sorted(workday_users_map.keys())
+    # in batches of 50 check if the user is present
+    batch_size = 50
+    for i in range(0, len(workday_users), batch_size):
+        batch_users = workday_users[i: i + batch_size]
+        logger.info("Checking batch: %s", batch_users)
+        #check using as_inventory if the user is present
+        batch = set(batch_users)
+        for hi in as_inventory.as_humans_itr(filters={"username": {"in": batch_users}}):
+            batch.discard(hi['email'])
+        missing_users.extend(list(batch))
+        # find missing users in the provider
+        batch = set(batch_users)
+        for hi in as_inventory.provider_humans_itr(
+            provider_id=provider_id,
+            provider_data=provider_data, filters={"username": {"in": batch_users}}):
+            batch.discard(hi['email'])
+        missing_users_in_provider.extend(list(batch))
+    logger.info("Missing users in the provider: %s", missing_users_in_provider)
+    logger.info("Missing users: %s", missing_users)
+    _write_missing_users(as_output_dir, workday_users_map, missing_users, missing_users_in_provider)
+
 if __name__ == '__main__':
     args = _setup_args()
     _setup_logging()
     as_api_endpoint = args.as_api_endpoint
-    api_session = _get_api_session(args.as_api_endpoint, args.as_session_token, args.as_api_token)
-    ai = AndromedaInventory(
-        None, api_session=api_session,
-        output_dir="/tmp/andromeda-inventory",
-        as_endpoint=as_api_endpoint, gql_endpoint=args.as_gql_endpoint)
-    _validate_workday_file(ai, args.workday_file, args.as_output_dir)
+    if args.snapshot:
+        ai = OfflineAndromedaInventory(args.snapshot)
+    else:
+        api_session = _get_api_session(args.as_api_endpoint, args.as_session_token, args.as_api_token)
+        ai = AndromedaInventory(
+            None, api_session=api_session,
+            output_dir="/tmp/andromeda-inventory",
+            as_endpoint=as_api_endpoint, gql_endpoint=args.as_gql_endpoint)
+    if args.mode == "index":
+        _validate_workday_file_indexed(ai, args.workday_file, args.as_output_dir, args.provider_id)
+    else:
+        _validate_workday_file(ai, args.workday_file, args.as_output_dir, args.provider_id)
@@ -20,6 +20,7 @@ from gql.transport.requests import RequestsHTTPTransport
 
 from sdk.api_utils import APIUtils, InvalidInputException
 from sdk.as_inventory import AndromedaInventory
+from sdk.as_offline_inventory import OfflineAndromedaInventory
 
 
 logger = logging.getLogger(__name__)
@@ -41,6 +42,9 @@ def _setup_args() -> argparse.Namespace:
         description=(help_str)
     )
     parser.add_argument('--workday_file', help='workday validation file', required=True)
+    parser.add_argument('--snapshot',
+                        help='Inventory snapshot downloaded by as_inventory.py, the humans are looked up '
+                             'in it instead of the API. The configured domains are still read from the API')
     return parser.parse_args()
 
 def _setup_logging():
@@ -103,6 +107,8 @@ if __name__ == '__main__':
         output_dir="/tmp/andromeda-inventory",
         as_endpoint=as_api_endpoint, gql_endpoint=as_gql_endpoint)
     g_api_utils = APIUtils(api_endpoint=as_api_endpoint)
+    # the humans lookups below are answered by the snapshot when one is given
+    g_humans_inventory = OfflineAndromedaInventory(g_args.snapshot) if g_args.snapshot else g_as_inventory
 
     # Read the workday csv file and load the users into dictionary keyed by the email which
     #
@@ -124,17 +130,14 @@ if __name__ == '__main__':
     # filter only the users who are present in the inventory
     not_found_users = set(unmatched_domains_users.keys())
     logger.info("Not found users: %s", not_found_users)
-    for user in g_as_inventory.as_humans_itr(filters={"email": {"in": not_found_users}}):
-        logger.info("User %s found in the inventory", user['email'])
-        not_found_users.remove(user['email'])
+    for email in g_humans_inventory.bulk_lookup('humans', 'email', not_found_users):
+        logger.info("User %s found in the inventory", email)
+        not_found_users.remove(email)
 
     logger.info("Not found users: %s", not_found_users)
 
     # check if all the active users are found in the inventory
-    found_users = set()
-    for user in g_as_inventory.as_humans_itr(filters={"email": {"in": active_users.keys()}}):
-        logger.info("User %s found in the inventory", user['email'])
-        found_users.add(user['email'])
+    found_users = set(g_humans_inventory.bulk_lookup('humans', 'email', active_users.keys()))
 
     logger.info("Found users: %s", found_users)
     logger.info("Not found users: %s", not_found_users)
@@ -22,10 +22,13 @@ Example:
     python3 sdk/samples/as_create_eligibilities.py --eligibility_file=/tmp/eligibilities.csv
     # dry run the script
     python3 sdk/samples/as_create_eligibilities.py --eligibility_file=/tmp/eligibilities.csv --dry_run
+    # bulk mode for large files: prefetch the applications once, plan locally, apply concurrently
+    python3 sdk/samples/as_create_eligibilities.py --eligibility_file=/tmp/eligibilities.csv --bulk --max_workers=8
 
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from enum import StrEnum
 import logging
 import time
@@ -38,6 +41,11 @@ import requests
 
 logger = logging.getLogger(__name__)
 
+# upper bound of the groups / eligibilities prefetched per application
+MAX_PREFETCH_COUNT = 1000000
+# wait for the deletes to settle before creating the replacement eligibilities
+DELETE_SETTLE_S = 2
+
 
 def _setup_args() -> argparse.Namespace:
     help_str = """
@@ -75,6 +83,13 @@ def _setup_args() -> argparse.Namespace:
     parser.add_argument('--cleanup',
                         action='store_true',
                         help='Cleanup mismatched eligibilities')
+    parser.add_argument('--bulk',
+                        action='store_true',
+                        help='Prefetch the applications, groups and eligibilities once and apply the changes concurrently')
+    parser.add_argument('--max_workers', type=int, default=8,
+                        help='Concurrent requests in bulk mode')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='Retries of a failed request in bulk mode')
 
     return parser.parse_args()
 
@@ -214,12 +229,13 @@ def check_n_update_app_enforcement_mode(
         api_session: requests.Session,
         as_api_endpoint: str,
         application: str,
-        dry_run: bool = False) -> None:
+        dry_run: bool = False,
+        application_obj: Optional[dict] = None) -> None:
     """
     Check if the application is in enforcement mode and if not then change it to enforcement mode
     """
     try:
-        application_obj = next(as_inventory.app_provider_itr(
+        application_obj = application_obj or next(as_inventory.app_provider_itr(
             page_size=25,
             filters={"name": {"equals": application}}))
     except StopIteration as e:
@@ -247,25 +263,9 @@ def check_n_update_app_enforcement_mode(
     resp.raise_for_status()
     logger.info("Application:%s is now in enforcement mode", application)
 
-def create_eligibilities(
-        as_api_endpoint: str,
-        as_inventory: AndromedaInventory,
-        api_session: requests.Session,
-        eligibility_file: str,
-        dry_run: bool = False, cleanup: bool = False) -> None:
+def read_eligibilities_file(eligibility_file: str) -> Dict[str, list]:
     """
-    Create eligibilities based on a csv file of format:
-    Application, Eligibility Group,	provisioning_group_name
-
-    Validations:
-    - It will check if the application, eligibility group and provisioning group name are valid
-    - Check if application is in enforcement mode and if not then change it to enforcement mode
-
-    Args:
-        as_inventory: AndromedaInventory
-        api_session: requests.Session
-        as_api_endpoint: str
-        eligibility_file: str
+    Read the csv eligibility file into {application: [{eligibility_group, provisioning_group, role_name}]}
     """
     with open(eligibility_file, 'r', encoding='utf-8') as file:
         reader = csv.DictReader(file)
@@ -289,25 +289,216 @@ def create_eligibilities(
                 "provisioning_group": provisioning_group,
                 "role_name": role_name
             })
-        for application, eligibility in eligibilities_map.items():
-            # check if the application is in enforcement mode
+    return eligibilities_map
+
+
+def create_eligibilities(
+        as_api_endpoint: str,
+        as_inventory: AndromedaInventory,
+        api_session: requests.Session,
+        eligibility_file: str,
+        dry_run: bool = False, cleanup: bool = False) -> None:
+    """
+    Create eligibilities based on a csv file of format:
+    Application, Eligibility Group,	provisioning_group_name
+
+    Validations:
+    - It will check if the application, eligibility group and provisioning group name are valid
+    - Check if application is in enforcement mode and if not then change it to enforcement mode
+
+    Args:
+        as_inventory: AndromedaInventory
+        api_session: requests.Session
+        as_api_endpoint: str
+        eligibility_file: str
+    """
+    eligibilities_map = read_eligibilities_file(eligibility_file)
+    for application, eligibility in eligibilities_map.items():
+        # check if the application is in enforcement mode
+        try:
+            check_n_update_app_enforcement_mode(
+                as_inventory, api_session, as_api_endpoint, application, dry_run)
+        except InvalidInputException as e:
+            logger.error("Invalid application: %s, error: %s", application, e)
+            continue
+        for e in eligibility:
             try:
-                check_n_update_app_enforcement_mode(
-                    as_inventory, api_session, as_api_endpoint, application, dry_run)
+                eligibility_group = e["eligibility_group"]
+                provisioning_group = e["provisioning_group"]
+                role_name = e["role_name"]
+                create_app_eligibility(
+                    as_inventory, api_session, as_api_endpoint,
+                    application, eligibility_group, provisioning_group, role_name, dry_run, cleanup)
             except InvalidInputException as e:
-                logger.error("Invalid application: %s, error: %s", application, e)
+                logger.error("Invalid input: %s", e)
                 continue
-            for e in eligibility:
-                try:
-                    eligibility_group = e["eligibility_group"]
-                    provisioning_group = e["provisioning_group"]
-                    role_name = e["role_name"]
-                    create_app_eligibility(
-                        as_inventory, api_session, as_api_endpoint,
-                        application, eligibility_group, provisioning_group, role_name, dry_run, cleanup)
-                except InvalidInputException as e:
-                    logger.error("Invalid input: %s", e)
+
+
+def load_app_indexes(as_inventory: AndromedaInventory, applications: list) -> Dict[str, dict]:
+    """
+    Prefetch the providers of the applications, and for each one its assignable groups, groups
+    and existing eligibilities, into name indexes:
+        {application: {"provider": {...}, "assignableGroups": {name: id}, "groups": {name: id},
+                       "eligibilities": {(eligible group name, eligibility type): eligibility}}}
+    Applications that are not found are left out.
+    """
+    app_indexes = {}
+    for provider_obj in as_inventory.app_provider_itr(filters={"name": {"in": applications}}):
+        provider_id = provider_obj['id']
+        eligibilities = {}
+        for eligibility in as_inventory.provider_eligibilities_itr(
+                provider_id, provider_obj, eligible_groups=True, max_count=MAX_PREFETCH_COUNT):
+            for edge in ((eligibility.get('eligibleGroups') or {}).get('edges') or []):
+                eligibilities[(edge['node']['name'], eligibility['eligibilityType'])] = eligibility
+        app_indexes[provider_obj['name']] = {
+            "provider": provider_obj,
+            "assignableGroups": {
+                group['groupDetails']['name']: group['groupDetails']['id']
+                for group in as_inventory.provider_assignable_groups_itr(
+                    provider_id, provider_obj, max_count=MAX_PREFETCH_COUNT)
+                if group.get('groupDetails')},
+            "groups": {
+                group['name']: group['id']
+                for group in as_inventory.as_provider_groups_itr(
+                    provider_id, provider_obj, max_count=MAX_PREFETCH_COUNT)},
+            "eligibilities": eligibilities,
+        }
+        logger.info("application %s assignable groups %s groups %s eligibilities %s",
+                    provider_obj['name'], len(app_indexes[provider_obj['name']]['assignableGroups']),
+                    len(app_indexes[provider_obj['name']]['groups']), len(eligibilities))
+    return app_indexes
+
+
+def plan_eligibilities(app_indexes: Dict[str, dict], eligibilities_map: Dict[str, list],
+                       cleanup: bool = False) -> Dict[str, list]:
+    """
+    Compute the eligibilities to create and delete from the prefetched indexes, without any request.
+    Same rules as create_app_eligibility: an existing eligibility is kept, or with cleanup deleted
+    and created again when its provisioning group does not match.
+    """
+    plan = {"create": [], "delete": [], "existing": [], "errors": []}
+    planned = set()
+    for application, eligibility in eligibilities_map.items():
+        app_index = app_indexes.get(application)
+        if not app_index:
+            plan["errors"].append(f"Application {application} not found")
+            continue
+        provider_id = app_index['provider']['id']
+        for e in eligibility:
+            eligibility_group = e["eligibility_group"]
+            provisioning_group = e["provisioning_group"]
+            eligibility_group_id = app_index['assignableGroups'].get(eligibility_group)
+            if not eligibility_group_id:
+                plan["errors"].append(f"Application {application}: Eligibility group {eligibility_group} not found")
+                continue
+            provisioning_group_id = app_index['groups'].get(provisioning_group)
+            if not provisioning_group_id:
+                plan["errors"].append(
+                    f"Application {application}: Provisioning group {provisioning_group} not found")
+                continue
+            eligibility_type = "PROVIDER_ELIGIBILITY" if not e["role_name"] else "ROLE_ELIGIBILITY"
+            if (provider_id, eligibility_group, eligibility_type) in planned:
+                # duplicate row
+                continue
+            planned.add((provider_id, eligibility_group, eligibility_type))
+            eligibility_obj = app_index['eligibilities'].get((eligibility_group, eligibility_type))
+            if eligibility_obj:
+                current_id = (eligibility_obj.get('provisioningGroupConfiguration') or {}).get('id')
+                if not cleanup or current_id == provisioning_group_id:
+                    plan["existing"].append(eligibility_obj)
                     continue
+                logger.info("Eligibility %s is mismatched with the provisioning group %s, deleting",
+                            eligibility_obj['eligibilityId'], current_id)
+                plan["delete"].append({"providerId": provider_id, "eligibilityId": eligibility_obj['eligibilityId']})
+            plan["create"].append({
+                "providerId": provider_id,
+                "eligibilityType": "PROVIDER_ELIGIBILITY",
+                "provisioningGroupId": provisioning_group_id,
+                "eligibleGroupIds": [eligibility_group_id],
+                "eligibilityConstraint": {"scopeType": "PROVIDER"},
+                "provisioningGroupConfiguration": {
+                    "name": provisioning_group,
+                    "id": provisioning_group_id
+                }
+            })
+    return plan
+
+
+def apply_eligibility_plan(
+        api_session: requests.Session, as_api_endpoint: str, plan: Dict[str, list],
+        max_workers: int = 8, retries: int = 3, dry_run: bool = False) -> Dict[str, list]:
+    """
+    Apply the plan with at most max_workers concurrent requests: the deletes first, then the
+    creates. The creates are not retried on server errors, a failed create is reported and
+    picked up by the next run. Returns the created eligibilities and the failed requests.
+    """
+    result = {"created": [], "deleted": [], "failed": []}
+    if dry_run:
+        for eligibility_data in plan["create"]:
+            logger.info("Dry run: Eligibility data: %s", eligibility_data)
+        for deletion in plan["delete"]:
+            logger.info("Dry run: deleting eligibility %s", deletion['eligibilityId'])
+        return result
+
+    def delete(deletion: dict):
+        return deletion, APIUtils.request_with_retry(
+            api_session, "DELETE",
+            f"{as_api_endpoint}/providers/{deletion['providerId']}/eligibilities/{deletion['eligibilityId']}",
+            retries=retries)
+
+    def create(eligibility_data: dict):
+        return eligibility_data, APIUtils.request_with_retry(
+            api_session, "POST", f"{as_api_endpoint}/providers/{eligibility_data['providerId']}/eligibilities",
+            retries=retries, json=eligibility_data)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for deletion, resp in executor.map(delete, plan["delete"]):
+            if resp.ok:
+                result["deleted"].append(deletion)
+            else:
+                logger.error("Failed to delete eligibility %s: %s", deletion['eligibilityId'], resp.status_code)
+                result["failed"].append({"request": deletion, "status": resp.status_code})
+        if plan["delete"]:
+            time.sleep(DELETE_SETTLE_S)
+        for eligibility_data, resp in executor.map(create, plan["create"]):
+            if resp.ok:
+                result["created"].append(resp.json())
+            else:
+                logger.error("Failed to create eligibility %s: %s %s",
+                             eligibility_data, resp.status_code, resp.text)
+                result["failed"].append({"request": eligibility_data, "status": resp.status_code})
+    return result
+
+
+def bulk_create_eligibilities(
+        as_api_endpoint: str,
+        as_inventory: AndromedaInventory,
+        api_session: requests.Session,
+        eligibility_file: str,
+        dry_run: bool = False, cleanup: bool = False,
+        max_workers: int = 8, retries: int = 3) -> Dict[str, list]:
+    """
+    Bulk version of create_eligibilities: the applications, their groups and eligibilities are
+    fetched once, the create / delete plan is computed locally and applied concurrently.
+    """
+    eligibilities_map = read_eligibilities_file(eligibility_file)
+    app_indexes = load_app_indexes(as_inventory, list(eligibilities_map))
+    for application, app_index in app_indexes.items():
+        try:
+            check_n_update_app_enforcement_mode(
+                as_inventory, api_session, as_api_endpoint, application, dry_run,
+                application_obj=app_index['provider'])
+        except (InvalidInputException, requests.HTTPError) as e:
+            logger.error("Invalid application: %s, error: %s", application, e)
+    plan = plan_eligibilities(app_indexes, eligibilities_map, cleanup)
+    for error in plan["errors"]:
+        logger.error("Invalid input: %s", error)
+    logger.info("eligibility plan: create %s delete %s existing %s errors %s",
+                len(plan["create"]), len(plan["delete"]), len(plan["existing"]), len(plan["errors"]))
+    result = apply_eligibility_plan(api_session, as_api_endpoint, plan, max_workers, retries, dry_run)
+    logger.info("eligibilities created %s deleted %s failed %s",
+                len(result["created"]), len(result["deleted"]), len(result["failed"]))
+    return result
 
 if __name__ == '__main__':
     args = _setup_args()
@@ -320,6 +511,11 @@ if __name__ == '__main__':
         output_dir="/tmp/andromeda-inventory",
         as_endpoint=args.as_api_endpoint, gql_endpoint=args.as_gql_endpoint)
     api_utils = APIUtils(api_endpoint=args.as_api_endpoint)
-    create_eligibilities(
-        args.as_api_endpoint, as_inventory, api_session,
-        args.eligibility_file, args.dry_run, args.cleanup)
+    if args.bulk:
+        bulk_create_eligibilities(
+            args.as_api_endpoint, as_inventory, api_session,
+            args.eligibility_file, args.dry_run, args.cleanup, args.max_workers, args.retries)
+    else:
+        create_eligibilities(
+            args.as_api_endpoint, as_inventory, api_session,
+            args.eligibility_file, args.dry_run, args.cleanup)
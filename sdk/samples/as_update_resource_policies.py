@@ -10,19 +10,26 @@ Step2:
     export AS_API_TOKEN=<api token>
 Example:
     python3 sdk/samples/as_update_resource_policies.py --resource_policies_location=/tmp/resource_policies.json --provider_id=aws_provider_id
+    # bulk mode: one policy lookup, unchanged policies are skipped, concurrent writes
+    python3 sdk/samples/as_update_resource_policies.py --resource_policies_location=/tmp/resource_policies.json --provider_id=aws_provider_id --bulk
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import json
 import os
 import time
+from typing import Optional
 from sdk.api_utils import APIUtils, InvalidInputException
 from sdk.as_inventory import AndromedaInventory
 import requests
 
 logger = logging.getLogger(__name__)
 
+# upper bound of the assignable policies prefetched in bulk mode
+MAX_PREFETCH_COUNT = 1000000
+
 
 def _setup_args() -> argparse.Namespace:
     help_str = """
@@ -57,6 +64,13 @@ def _setup_args() -> argparse.Namespace:
     parser.add_argument('--provider_id',
                         help='provider id to update the resource policies for',
                         required=True)
+    parser.add_argument('--bulk',
+                        action='store_true',
+                        help='Prefetch the policies once, skip the unchanged ones and write the others concurrently')
+    parser.add_argument('--max_workers', type=int, default=8,
+                        help='Concurrent requests in bulk mode')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='Retries of a failed request in bulk mode')
 
     return parser.parse_args()
 
@@ -87,6 +101,25 @@ def _get_api_session(api_endpoint: str, as_session_token: str, as_api_token: str
     raise InvalidInputException(
         "Either as_api_token or as_session_token must be provided")
 
+def _normalise_resource_policy(resource_policy: dict) -> dict:
+    """ Set the CUSTOM type and make sure the policy document data is stringified json """
+    resource_policy["type"] = "CUSTOM"
+    data = resource_policy["policyDocument"]["data"]
+    if isinstance(data, str):
+        try:
+            json.loads(data)
+        except json.JSONDecodeError:
+            logger.error("Invalid JSON data for resource policy: %s", resource_policy)
+            raise
+    elif isinstance(data, dict):
+        resource_policy["policyDocument"]["data"] = json.dumps(data)
+    else:
+        logger.error("Invalid data type for resource policy: %s", resource_policy)
+        raise InvalidInputException(
+            f"Invalid data type for resource policy: {resource_policy}")
+    return resource_policy
+
+
 def update_resource_policies(
         as_inventory: AndromedaInventory,
         api_session: requests.Session,
@@ -112,22 +145,7 @@ def update_resource_policies(
         policy_obj = next(as_inventory.provider_assignable_policies_itr(
             provider_id, provider, filters=filters), None)
         op = "put" if policy_obj else "post"
-        # check if the data is stringified json
-        resource_policy["type"] = "CUSTOM"
-        data = resource_policy["policyDocument"]["data"]
-        if isinstance(data, str):
-            try:
-                data = json.loads(data)
-                #resource_policy["policyDocument"]["data"] = data
-            except json.JSONDecodeError:
-                logger.error("Invalid JSON data for resource policy: %s", resource_policy)
-                raise
-        elif isinstance(data, dict):
-            resource_policy["policyDocument"]["data"] = json.dumps(data)
-        else:
-            logger.error("Invalid data type for resource policy: %s", resource_policy)
-            raise InvalidInputException(
-                f"Invalid data type for resource policy: {resource_policy}")
+        _normalise_resource_policy(resource_policy)
         #logger.info("Creating or updating resource policy: %s \n%s",
         #            name, json.dumps(resource_policy, indent=2))
 
@@ -152,6 +170,80 @@ def update_resource_policies(
             time.sleep(2)
         logger.info("Resource policy: op %s: %s", op, json.dumps(resource_policy, indent=2))
 
+def _policy_document_key(policy_document: Optional[dict]) -> str:
+    """ Comparable form of a policy document, the data is compared as parsed json """
+    policy_document = dict(policy_document or {})
+    data = policy_document.get("data")
+    if isinstance(data, str):
+        try:
+            policy_document["data"] = json.loads(data)
+        except json.JSONDecodeError:
+            pass
+    return json.dumps(policy_document, sort_keys=True)
+
+
+def bulk_update_resource_policies(
+        as_inventory: AndromedaInventory,
+        api_session: requests.Session,
+        as_api_endpoint: str,
+        resource_policies_location: str,
+        provider_id: str,
+        max_workers: int = 8,
+        retries: int = 3) -> dict:
+    """
+    Bulk version of update_resource_policies. The resource set policies of the provider are
+    fetched once into a name index, then every policy is handled on a worker pool: new ones are
+    created, existing ones are read and only written back when the policy document changed.
+    Returns the names of the created, updated, unchanged and failed policies.
+    """
+    with open(resource_policies_location, 'r', encoding='utf-8') as f:
+        resource_policies = json.load(f)
+    logger.info("Resource policies: %s", len(resource_policies))
+
+    provider = next(as_inventory.cloud_provider_itr(
+        filters={"type": {"equals": "PROVIDER_TYPE_AWS"}, "id": {"equals": provider_id}}))
+    assert provider['type'] == "PROVIDER_TYPE_AWS", f"Provider is not of type AWS {provider['type']}"
+    policy_index = {
+        policy['policyName']: policy['policyId']
+        for policy in as_inventory.provider_assignable_policies_itr(
+            provider_id, provider, filters={"eligibilityType": {"equals": "RESOURCE_SET_ELIGIBILITY"}},
+            max_count=MAX_PREFETCH_COUNT)}
+    logger.info("Existing resource policies: %s", len(policy_index))
+    policies_url = f"{as_api_endpoint}/providers/{provider['id']}/resource-policies"
+
+    def apply(resource_policy: dict) -> tuple:
+        name = resource_policy["name"]
+        try:
+            _normalise_resource_policy(resource_policy)
+            policy_id = policy_index.get(name)
+            if not policy_id:
+                APIUtils.request_with_retry(
+                    api_session, "POST", policies_url, retries, json=resource_policy).raise_for_status()
+                return "created", name
+            url = f"{policies_url}/{policy_id}"
+            response = APIUtils.request_with_retry(api_session, "GET", url, retries)
+            response.raise_for_status()
+            resource_policy_obj = response.json()
+            if _policy_document_key(resource_policy_obj.get('policyDocument')) == \
+                    _policy_document_key(resource_policy['policyDocument']):
+                return "unchanged", name
+            resource_policy_obj['policyDocument'] = resource_policy['policyDocument']
+            APIUtils.request_with_retry(
+                api_session, "PUT", url, retries, json=resource_policy_obj).raise_for_status()
+            return "updated", name
+        except (requests.RequestException, InvalidInputException, json.JSONDecodeError) as e:
+            logger.error("Resource policy %s failed: %s", name, e)
+            return "failed", name
+
+    result = {"created": [], "updated": [], "unchanged": [], "failed": []}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for op, name in executor.map(apply, resource_policies):
+            result[op].append(name)
+    logger.info("Resource policies created %s updated %s unchanged %s failed %s",
+                len(result["created"]), len(result["updated"]), len(result["unchanged"]), len(result["failed"]))
+    return result
+
+
 if __name__ == '__main__':
     args = _setup_args()
     _setup_logging()
@@ -164,6 +256,11 @@ if __name__ == '__main__':
         output_dir="/tmp/andromeda-inventory",
         as_endpoint=as_api_endpoint, gql_endpoint=args.as_gql_endpoint)
     api_utils = APIUtils(api_endpoint=args.as_api_endpoint)
-    update_resource_policies(
-        as_inventory, api_session, as_api_endpoint,
-        args.resource_policies_location, args.provider_id)
+    if args.bulk:
+        bulk_update_resource_policies(
+            as_inventory, api_session, as_api_endpoint,
+            args.resource_policies_location, args.provider_id, args.max_workers, args.retries)
+    else:
+        update_resource_policies(
+            as_inventory, api_session, as_api_endpoint,
+            args.resource_policies_location, args.provider_id)
@@ -152,11 +152,15 @@ def create_or_update_environments(api_session: requests.Session, au: api_utils.A
     """
     envs = config['settings'].get('environments', [])
     logger.info("Create or update %d environments", len(envs))
-    for env in envs:
-        if dry_run:
+    if dry_run:
+        for env in envs:
             logger.debug("Skipping environment setting %s", env)
-            continue
-        au.create_or_update_environment(api_session, env)
+        return
+    # one read of the existing environments, only the new or changed ones are written
+    results = au.upsert_resources_by_name(api_session, "environments", envs)
+    failed = [(env['name'], r.status_code, r.obj) for env, r in zip(envs, results) if r.op == api_utils.UPSERT_ERROR]
+    if failed:
+        raise Exception(f'Failed to create or update environments {failed}')
 
 
 def patch_environment_mappings(api_session: requests.Session, au: api_utils.APIUtils, config: dict, dry_run: bool = False) -> None:
@@ -0,0 +1,63 @@
+# Copyright 2025 Andromeda Security, Inc.
+#
+"""
+Request coalescing shared by the API session and the GraphQL transport.
+
+When the crawls fan out, several workers often ask for the same thing at the same moment
+(the same group members, provider config or user). SingleFlight runs one call per key at a
+time: the callers that arrive while the call is in flight wait for it and get its result or
+its exception. It is not a cache, a call made after the result is returned runs again.
+
+Example usage:
+    single_flight = SingleFlight()
+    response = single_flight.do(url, functools.partial(session.get, url), share_fn=copy.copy)
+"""
+import threading
+from typing import Callable, Hashable, Optional
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result = None
+        self.exc = None
+
+
+class SingleFlight:
+    """
+    Coalesces the identical concurrent calls of do(). When the result was shared, every
+    caller gets share_fn(result) (eg. a copy) so that no caller sees the changes of another.
+    """
+    def __init__(self) -> None:
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable, share_fn: Optional[Callable] = None):
+        """ Return fn(), or the result of the fn() of the same key already in flight """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.exc is not None:
+                raise call.exc
+            return share_fn(call.result) if share_fn else call.result
+
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.exc = exc
+            raise
+        finally:
+            with self._lock:
+                # no caller can join the call after this, waiters is final
+                del self._calls[key]
+            call.done.set()
+        return share_fn(call.result) if share_fn and call.waiters else call.result
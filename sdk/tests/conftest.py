@@ -0,0 +1,63 @@
+"""
+Shared fixtures of the offline AndromedaInventory tests. The GraphQL queries are validated
+against the schema in sdk/docs and answered by a fake transport, the REST calls by requests_mock.
+"""
+import os
+import pytest
+import requests
+import requests_mock
+from gql import Client
+from gql.transport import Transport
+from graphql import ExecutionResult, build_schema, print_ast
+from sdk.as_inventory import AndromedaInventory
+
+SCHEMA_FILE = os.path.join(os.path.dirname(__file__), "..", "docs", "schema.graphql")
+
+
+class FakeTransport(Transport):
+    """ Answers every query with the result of the responder and records the query text """
+    def __init__(self, responder):
+        self.responder = responder
+        self.queries = []
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    def execute(self, document, variable_values=None, operation_name=None, **kwargs):
+        query = print_ast(document)
+        self.queries.append(query)
+        return ExecutionResult(data=self.responder(query))
+
+
+@pytest.fixture(scope="session")
+def gql_schema():
+    with open(SCHEMA_FILE, "r", encoding="utf-8") as f:
+        return build_schema(f.read())
+
+
+@pytest.fixture
+def api_adapter():
+    """ requests_mock adapter of a mock://as session, with the identity-details of tenant-1 """
+    adapter = requests_mock.Adapter()
+    adapter.register_uri("GET", "mock://as/identity-details", json={"tenantId": "tenant-1"})
+    return adapter
+
+
+@pytest.fixture
+def api_session(api_adapter):
+    session = requests.Session()
+    session.mount("mock://", api_adapter)
+    return session
+
+
+@pytest.fixture
+def make_inventory(tmp_path, gql_schema, api_session):
+    """ make_inventory(responder, **kwargs) -> AndromedaInventory answered by FakeTransport(responder) """
+    def _make(responder, **kwargs):
+        gql_client = Client(schema=gql_schema, transport=FakeTransport(responder))
+        return AndromedaInventory(gql_client, api_session, output_dir=str(tmp_path),
+                                  as_endpoint="mock://as", **kwargs)
+    return _make
@@ -1,7 +1,15 @@
 import logging
+import pickle
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
 import requests
+import pytest
 import requests_mock
-from sdk.api_utils import APIUtils, InvalidInputException
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from sdk.api_utils import (APIUtils, InvalidInputException, MAX_RETRY_WAIT_S, UPSERT_CREATED, UpsertResult,
+                           create_api_session, retry_after_s)
 
 logger = logging.getLogger(__name__)
 
@@ -84,3 +92,366 @@ def test_create_or_update_subresource():
         session, f"providers/1234/aws/config", obj=aws_config)
     logger.info("obj %s", obj)
     assert obj['id'] == '1234'
+
+
+def test_api_session_pool_and_timeout():
+    au = APIUtils(api_endpoint="mock://api", pool_size=32, timeout=(3, 30))
+    session = au.get_api_session_w_cookie("foo")
+    adapter = session.get_adapter("https://api.live.andromedasecurity.com")
+    assert adapter._pool_maxsize == 32
+    assert adapter.timeout == (3, 30)
+    assert session.cookies.get('DS') == "foo"
+
+
+def test_reauth_session():
+    logins = []
+    expired = {"value": False}
+
+    def login(session):
+        logins.append(len(logins))
+        session.cookies.set('DS', f"cookie{len(logins)}")
+        expired["value"] = False
+        return True
+
+    def resource(request, context):
+        if expired["value"] or request.headers.get("Cookie") != f"DS=cookie{len(logins)}":
+            context.status_code = 401
+            return {}
+        return {"ok": True}
+
+    session = create_api_session(login_fn=login)
+    session.min_reauth_interval_s = 0
+    adapter = requests_mock.Adapter()
+    adapter.register_uri('GET', 'mock://api/resource', json=resource)
+    session.mount('mock://', adapter)
+    session.login()
+    assert session.get('mock://api/resource').json() == {"ok": True}
+
+    # the session expires while 8 workers are running, only one of them logs in again
+    expired["value"] = True
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda _: session.get('mock://api/resource'), range(8)))
+    assert all(r.status_code == 200 for r in responses)
+    assert len(logins) == 2 and session.auth_generation == 2
+
+
+def test_reauth_session_permission_error():
+    logins = []
+    session = create_api_session(login_fn=lambda s: logins.append(1) or True)
+    adapter = requests_mock.Adapter()
+    adapter.register_uri('GET', 'mock://api/forbidden', status_code=403)
+    session.mount('mock://', adapter)
+    session.login()
+    # a 403 right after the login is not retried with another login
+    assert session.get('mock://api/forbidden').status_code == 403
+    assert len(logins) == 1 and adapter.call_count == 1
+
+
+def test_reauth_session_only_on_expired_session():
+    logins = []
+    session = create_api_session(login_fn=lambda s: logins.append(1) or True)
+    session.min_reauth_interval_s = 0
+    adapter = requests_mock.Adapter()
+    adapter.register_uri('GET', 'mock://api/forbidden', status_code=403, json={"error": "permission denied"})
+    adapter.register_uri('GET', 'mock://api/expired', [
+        {"status_code": 403, "json": {"error": "Session expired, please log in"}}, {"json": {"ok": True}}])
+    session.mount('mock://', adapter)
+    session.login()
+    # a genuine 403 is returned without logging in again
+    assert session.get('mock://api/forbidden').status_code == 403
+    assert len(logins) == 1
+    # a 403 saying the session expired logs in again and is replayed
+    assert session.get('mock://api/expired').json() == {"ok": True}
+    assert len(logins) == 2
+
+
+def test_get_resource_by_name_index():
+    au = APIUtils(api_endpoint="mock://api", name_index_ttl_s=300)
+    adapter = requests_mock.Adapter()
+    session = au.get_api_session_w_cookie("foo")
+    session.mount('mock://', adapter)
+    list_mock = adapter.register_uri('GET', 'mock://api/environments', json={"results": [
+        {"name": "prod", "id": "1"}, {"name": "dev", "id": "2"}]})
+    adapter.register_uri('GET', 'mock://api/environments?filter= name = staging', json={"results": []})
+    adapter.register_uri('POST', 'mock://api/environments', json={"name": "staging", "id": "3"})
+
+    for _ in range(3):
+        assert au.get_resource_by_name(session, "environments", "prod") == (200, {"name": "prod", "id": "1"})
+    assert au.get_resource_by_name(session, "environments", "dev")[1]["id"] == "2"
+    assert list_mock.call_count == 1
+    # the returned resource is a copy of the indexed one
+    au.get_resource_by_name(session, "environments", "prod")[1]["id"] = "changed"
+    assert au.get_resource_by_name(session, "environments", "prod")[1]["id"] == "1"
+
+    # names missing from the index use the filtered get, a write by name updates the index
+    assert au.get_resource_by_name(session, "environments", "staging") == (404, None)
+    au.create_or_update_resource(session, "environments", resource_name="staging", obj={"name": "staging"})
+    assert au.get_resource_by_name(session, "environments", "staging") == (200, {"name": "staging", "id": "3"})
+    au.get_resource_by_name(session, "environments", "prod")
+    assert list_mock.call_count == 1
+    # a write by id invalidates it
+    adapter.register_uri('PUT', 'mock://api/environments/1', json={"name": "production", "id": "1"})
+    au.create_or_update_resource(session, "environments", resource_id="1", obj={"name": "production"})
+    au.get_resource_by_name(session, "environments", "dev")
+    assert list_mock.call_count == 2
+
+
+def test_name_index_is_opt_in_and_per_type():
+    au = APIUtils(api_endpoint="mock://api")
+    adapter = requests_mock.Adapter()
+    session = au.get_api_session_w_cookie("foo")
+    session.mount('mock://', adapter)
+    list_mock = adapter.register_uri('GET', 'mock://api/environments', json={"results": [{"name": "prod", "id": "1"}]})
+    for _ in range(2):
+        assert au.get_resource_by_name(session, "environments", "prod")[1]["id"] == "1"
+    # without a ttl every lookup is a filtered get
+    assert [r.qs.get("filter") for r in list_mock.request_history] == [[" name = prod"]] * 2
+
+    # a slow listing of one type does not block the lookups of another type
+    au = APIUtils(api_endpoint="mock://api", name_index_ttl_s=300)
+    session = au.get_api_session_w_cookie("foo")
+    session.mount('mock://', adapter)
+    listing, release = threading.Event(), threading.Event()
+
+    def slow_providers(request, context):
+        listing.set()
+        release.wait(5)
+        return {"results": [{"name": "aws", "id": "p1"}]}
+    adapter.register_uri('GET', 'mock://api/providers', json=slow_providers)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        provider = executor.submit(au.get_resource_by_name, session, "providers", "aws")
+        assert listing.wait(5)
+        assert au.get_resource_by_name(session, "environments", "prod")[1]["id"] == "1"
+        release.set()
+        assert provider.result()[1]["id"] == "p1"
+
+
+def _paged_resources(resources: list, cursor: bool = False):
+    def page(request, context):
+        qs = parse_qs(urlparse(request.url).query)
+        page_size = int(qs["pageSize"][0])
+        start = int(qs["cursor"][0]) if "cursor" in qs else int(qs.get("skip", ["0"])[0])
+        body = {"results": resources[start:start + page_size], "count": str(len(resources))}
+        if cursor and start + page_size < len(resources):
+            body = {"results": body["results"], "nextPageCursor": str(start + page_size)}
+        return body
+    return page
+
+
+def test_iter_resources():
+    au = APIUtils(api_endpoint="http://api.test")
+    adapter = requests_mock.Adapter(case_sensitive=True)
+    session = au.get_api_session_w_cookie("foo")
+    session.mount('http://', adapter)
+    environments = [{"name": f"env{i}", "id": str(i), "rules": []} for i in range(25)]
+
+    adapter.register_uri('GET', 'http://api.test/environments', json=_paged_resources(environments))
+    assert list(au.iter_resources(session, "environments", page_size=10)) == environments
+    assert adapter.call_count == 3
+    names = [r for r in au.iter_resources(session, "environments", page_size=4, max_workers=3, fields=["name"])]
+    assert names == [{"name": r["name"]} for r in environments]
+    assert au.get_resources(session, "environments") == (200, environments)
+
+    adapter.register_uri('GET', 'http://api.test/providers', json=_paged_resources(environments, cursor=True))
+    assert list(au.iter_resources(session, "providers", filter="name = x", page_size=10)) == environments
+    assert "cursor=20" in adapter.last_request.url and "filter=name" in adapter.last_request.url
+
+
+def test_create_or_update_resource_unchanged():
+    au = APIUtils(api_endpoint="mock://api")
+    adapter = requests_mock.Adapter()
+    session = au.get_api_session_w_cookie("foo")
+    session.mount('mock://', adapter)
+    existing = {"name": "prod", "id": "1", "criticality": "HIGH", "updatedAt": "2025-01-01"}
+    adapter.register_uri('GET', 'mock://api/environments', json={"results": [existing]})
+    put_mock = adapter.register_uri('PUT', 'mock://api/environments/1', json=dict(existing, criticality="LOW"))
+
+    result = au.create_or_update_resource(session, "environments", resource_name="prod",
+                                          obj={"name": "prod", "criticality": "HIGH", "updatedAt": "now"})
+    status_code, obj = result
+    assert (status_code, obj["id"], result.op) == (200, "1", "unchanged")
+    assert put_mock.call_count == 0
+    result = au.create_or_update_resource(session, "environments", resource_name="prod",
+                                          obj={"name": "prod", "criticality": "LOW"})
+    assert result.op == "updated" and put_mock.call_count == 1
+
+
+def test_create_or_update_provider_unchanged():
+    au = APIUtils(api_endpoint="mock://api")
+    adapter = requests_mock.Adapter()
+    session = au.get_api_session_w_cookie("foo")
+    session.mount('mock://', adapter)
+    url = au.get_resource_url("providers/1234/aws/config")
+    adapter.register_uri('GET', url, json={"id": "c1", "updatedAt": "t", "roleName": "as-role"})
+    put_mock = adapter.register_uri('PUT', url, json={"id": "c1", "roleName": "other"})
+    assert au.create_or_update_provider(session, "1234", {"roleName": "as-role"}, url).op == "unchanged"
+    assert au.create_or_update_provider(session, "1234", {"roleName": "other"}, url).op == "updated"
+    assert put_mock.call_count == 1
+
+
+def test_upsert_result_pickle():
+    result = UpsertResult(201, {"id": "p1"}, UPSERT_CREATED)
+    loaded = pickle.loads(pickle.dumps(result))
+    assert loaded == (201, {"id": "p1"}) and loaded.op == UPSERT_CREATED
+    assert isinstance(loaded, UpsertResult) and loaded.status_code == 201
+
+
+def test_upsert_resources_by_name():
+    au = APIUtils(api_endpoint="http://api.test")
+    adapter = requests_mock.Adapter()
+    session = au.get_api_session_w_cookie("foo")
+    session.mount('http://', adapter)
+    list_mock = adapter.register_uri('GET', 'http://api.test/environments', json={"results": [
+        {"name": "prod", "id": "1", "criticality": "HIGH"}, {"name": "dev", "id": "2", "criticality": "LOW"}]})
+    adapter.register_uri('PUT', 'http://api.test/environments/2', json={"name": "dev", "id": "2", "criticality": "HIGH"})
+    adapter.register_uri('POST', 'http://api.test/environments', [
+        {"json": {"name": "qa", "id": "3"}}, {"status_code": 400, "json": {"message": "invalid criticality"}}])
+    results = au.upsert_resources_by_name(session, "environments", [
+        {"name": "prod", "criticality": "HIGH"}, {"name": "dev", "criticality": "HIGH"}, {"name": "qa"},
+        {"name": "test", "criticality": "NONE"}])
+    assert [r.op for r in results] == ["unchanged", "updated", "created", "error"]
+    assert results[1].obj["criticality"] == "HIGH" and results[2].status_code == 200
+    assert results[3].status_code == 400 and results[3].obj == {"message": "invalid criticality"}
+    assert list_mock.call_count == 1
+
+
+def test_bulk_upsert():
+    au = APIUtils(api_endpoint="mock://api", name_index_ttl_s=0)
+    adapter = requests_mock.Adapter()
+    session = au.get_api_session_w_cookie("foo")
+    session.mount('mock://', adapter)
+    adapter.register_uri('GET', 'mock://api/providers', json={"results": []})
+    adapter.register_uri('POST', 'mock://api/providers', json=lambda request, context: {
+        "id": request.json()["name"] + "-id", "name": request.json()["name"]})
+    adapter.register_uri('GET', 'mock://api/providers/aws1-id/aws/config', json={})
+    adapter.register_uri('POST', 'mock://api/providers/aws1-id/aws/config',
+                         [{"status_code": 503, "json": {}}, {"json": {"id": "c1"}}])
+    adapter.register_uri('GET', 'mock://api/providers/aws2-id/aws/config', json={})
+    adapter.register_uri('POST', 'mock://api/providers/aws2-id/aws/config', status_code=400, json={})
+    adapter.register_uri('POST', 'mock://api/providers/broken-id/aws/config', json={})
+
+    items = [
+        {"key": "aws1", "resource_type": "providers", "obj": {"name": "aws1"}},
+        {"resource_type": "providers/{parent[id]}/aws/config", "obj": {"roleName": "r"},
+         "depends_on": "aws1", "singleton": True},
+        {"key": "aws2", "resource_type": "providers", "obj": {"name": "aws2"}},
+        {"key": "aws2-config", "resource_type": "providers/{parent[id]}/aws/config", "obj": {"roleName": "r"},
+         "depends_on": "aws2", "singleton": True},
+        {"resource_type": "environments", "obj": {"name": "never"}, "depends_on": "aws2-config"},
+    ]
+    results = au.bulk_upsert(session, items, max_workers=4, backoff_s=0)
+    assert [r["op"] for r in results[:3]] == ["created", "created", "created"]
+    assert results[1]["resourceType"] == "providers/aws1-id/aws/config" and results[1]["obj"] == {"id": "c1"}
+    # the config is looked up again before the create is retried
+    assert [r.method for r in adapter.request_history if r.path == "/providers/aws1-id/aws/config"] == [
+        "GET", "POST", "GET", "POST"]
+    assert results[3]["error"] == "status 400"
+    assert results[4]["error"] == "dependency aws2-config failed" and results[4]["statusCode"] is None
+
+    # a create that cannot be looked up again is not retried on a 5xx
+    post_mock = adapter.register_uri('POST', 'mock://api/accessrequests', status_code=503, json={})
+    results = au.bulk_upsert(session, [{"resource_type": "accessrequests", "obj": {"reason": "r"}}], backoff_s=0)
+    assert results[0]["error"] == "status 503" and post_mock.call_count == 1
+
+    for bad_items in ([{"key": "a", "resource_type": "providers", "obj": {}},
+                       {"key": "a", "resource_type": "providers", "obj": {}}],
+                      [{"key": "a", "resource_type": "providers", "obj": {}, "depends_on": "a"}],
+                      [{"key": "a", "resource_type": "providers", "obj": {}, "depends_on": "b"},
+                       {"key": "b", "resource_type": "providers", "obj": {}, "depends_on": "a"}]):
+        with pytest.raises(InvalidInputException):
+            au.bulk_upsert(session, bad_items)
+
+
+def test_request_with_retry():
+    session = requests.Session()
+    adapter = requests_mock.Adapter()
+    session.mount('mock://', adapter)
+    adapter.register_uri('PUT', 'mock://api/items/1', [{"status_code": 503}, {"status_code": 200}])
+    adapter.register_uri('POST', 'mock://api/items', [{"status_code": 503}, {"status_code": 201}])
+    adapter.register_uri('DELETE', 'mock://api/items/1',
+                         [{"status_code": 429, "headers": {"Retry-After": "0"}}, {"status_code": 204}])
+    assert APIUtils.request_with_retry(session, "PUT", "mock://api/items/1", backoff_s=0).status_code == 200
+    # a POST that failed with a 5xx may have created the item, it is not sent again
+    assert APIUtils.request_with_retry(session, "POST", "mock://api/items", backoff_s=0).status_code == 503
+    assert APIUtils.request_with_retry(session, "DELETE", "mock://api/items/1").status_code == 204
+    assert [r.method for r in adapter.request_history] == ["PUT", "PUT", "POST", "DELETE", "DELETE"]
+
+
+def test_retry_after_s():
+    def response(retry_after=None):
+        r = requests.Response()
+        if retry_after is not None:
+            r.headers['Retry-After'] = retry_after
+        return r
+
+    assert retry_after_s(response(), 2) == 2
+    assert retry_after_s(response("5"), 2) == 5
+    assert retry_after_s(response("not a date"), 2) == 2 and retry_after_s(response("nan"), 2) == 2
+    assert retry_after_s(response("3600"), 2) == MAX_RETRY_WAIT_S
+    # the HTTP date form, in the past or in the future
+    assert retry_after_s(response("Wed, 21 Oct 2015 07:28:00 GMT"), 2) == 0
+    assert 25 < retry_after_s(response(formatdate(time.time() + 30, usegmt=True)), 2) <= 30
+
+
+def test_response_cache():
+    def config(request, context):
+        if request.headers.get("If-None-Match") == '"v1"':
+            context.status_code = 304
+            return None
+        context.headers["ETag"] = '"v1"'
+        return {"id": "c1", "mode": "ENFORCE"}
+
+    au = APIUtils(api_endpoint="mock://api", cache_ttl_s=60)
+    session = au.get_api_session_w_cookie("foo")
+    adapter = requests_mock.Adapter()
+    adapter.register_uri('GET', 'mock://api/providers/p1/idpapplication/config', json=config)
+    adapter.register_uri('PUT', 'mock://api/providers/p1/idpapplication/config', json={"id": "c1"})
+    adapter.register_uri('GET', 'mock://api/tenantsettings', json={"name": "acme"})
+    session.mount('mock://', adapter)
+    url = 'mock://api/providers/p1/idpapplication/config'
+
+    # fresh responses are answered from the cache
+    assert session.get(url).json() == session.get(url).json() == {"id": "c1", "mode": "ENFORCE"}
+    assert adapter.call_count == 1 and session.response_cache.hits == 1
+
+    # a stale response is revalidated with its ETag
+    session.response_cache.ttl_s = 0
+    response = session.get(url)
+    assert response.status_code == 200 and response.json()["mode"] == "ENFORCE"
+    assert adapter.last_request.headers["If-None-Match"] == '"v1"'
+    assert session.response_cache.revalidations == 1
+
+    # a write drops the cached responses of the url and of its parents only
+    session.response_cache.ttl_s = 60
+    session.get('mock://api/tenantsettings')
+    session.put(url, json={"mode": "MONITOR"})
+    calls = adapter.call_count
+    session.get(url)
+    session.get('mock://api/tenantsettings')
+    assert adapter.call_count == calls + 1
+    assert "If-None-Match" not in adapter.last_request.headers
+
+
+def test_coalesced_gets():
+    def members(request, context):
+        time.sleep(0.2)
+        return {"results": [{"id": "u1"}]}
+
+    # coalescing is opt-in
+    assert create_api_session().single_flight is None
+    assert APIUtils(coalesce=True).get_api_session_w_cookie("foo").single_flight is not None
+
+    session = create_api_session(coalesce=True)
+    adapter = requests_mock.Adapter()
+    adapter.register_uri('GET', 'mock://api/groups/g1/members', json=members)
+    session.mount('mock://', adapter)
+    # 8 workers ask for the same members at the same time, one request is sent
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda _: session.get('mock://api/groups/g1/members'), range(8)))
+    assert adapter.call_count == 1 and session.single_flight.shared == 7
+    assert all(r.json() == {"results": [{"id": "u1"}]} for r in responses)
+    assert len({id(r) for r in responses}) == 8
+
+    # calls after the result is returned are not coalesced
+    session.get('mock://api/groups/g1/members')
+    assert adapter.call_count == 2
@@ -0,0 +1,58 @@
+from sdk.as_access_graph import AccessGraph
+
+
+def _provider_map() -> dict:
+    alice_origin = {"__typename": "IdentityOriginData", "originUserId": "u-alice",
+                    "identity": {"id": "alice", "username": "alice@acme.com"}}
+    admins = {"__typename": "Group", "id": "g-admins", "name": "admins"}
+    prod = {"__typename": "AccountScopeData", "id": "prod", "name": "prod"}
+    dev = {"__typename": "AccountScopeData", "id": "dev", "name": "dev"}
+    return {"aws": {
+        "id": "aws",
+        "humans": {"bob@acme.com": {"id": "bob", "username": "bob@acme.com",
+                                    "origins": [{"originUserId": "u-bob"}]}},
+        "accounts": {"prod": {"id": "prod", "name": "prod"}, "dev": {"id": "dev", "name": "dev"}},
+        "groups": {"admins": {"id": "g-admins", "name": "admins", "members": {
+            "humanUsers": {"edges": [{"node": {"originUserId": "u-bob"}}]}}}},
+        "activeBindings": {
+            "configured": [
+                {"roleData": {"policyId": "AdminAccess"}, "principalKey": "p1", "scopeKey": "s1"},
+                {"roleData": {"policyId": "ReadOnly"}, "principal": alice_origin, "scope": dev},
+            ],
+            "resolved": [
+                {"roleData": {"policyId": "AdminAccess"}, "principal": alice_origin, "scope": prod,
+                 "configuredAssignments": {"edges": [{"node": {"principal": admins, "scope": prod}}]}},
+            ],
+            "principals": {"p1": admins},
+            "scopes": {"s1": prod},
+        },
+    }}
+
+
+def test_access_graph():
+    graph = AccessGraph.from_provider_map(_provider_map())
+    who = graph.who_can_reach("account:aws:prod")
+    assert sorted(who) == ["identity:alice", "identity:bob"]
+    assert who["identity:bob"] == [
+        "identity:bob", "group:aws:g-admins", "role:aws:AdminAccess@account:aws:prod", "account:aws:prod"]
+    assert graph.blast_radius("identity:alice") == ["account:aws:dev", "account:aws:prod"]
+    assert graph.blast_radius("identity:bob") == ["account:aws:prod"]
+    assert graph.reverse_reachable("account:aws:dev", node_types=("identity",)) == ["identity:alice"]
+    assert graph.reachable("identity:bob", max_depth=1) == ["group:aws:g-admins"]
+    assert graph.who_can_reach("account:aws:missing") == {}
+    assert graph.node_names["account:aws:prod"] == "prod"
+
+
+def test_access_graph_eligibilities_and_nested_groups():
+    provider_map = _provider_map()
+    aws = provider_map["aws"]
+    aws["groups"]["oncall"] = {"id": "g-oncall", "name": "oncall", "members": {
+        "humanUsers": {"edges": []}, "groups": {"edges": [{"node": {"id": "g-admins", "name": "admins"}}]}}}
+    aws["eligibilities"] = {"aws|dev||": {
+        "eligibilityId": "e1", "eligibilityName": "dev break glass", "accountId": "dev",
+        "eligibleGroups": {"edges": [{"node": {"id": "g-oncall", "name": "oncall"}}]}}}
+    graph = AccessGraph.from_provider_map(provider_map)
+    # bob is in admins, a nested group of oncall, which is eligible to dev
+    assert graph.who_can_reach("account:aws:dev")["identity:bob"] == [
+        "identity:bob", "group:aws:g-admins", "group:aws:g-oncall", "eligibility:aws:e1", "account:aws:dev"]
+    assert graph.node_names["eligibility:aws:e1"] == "dev break glass"
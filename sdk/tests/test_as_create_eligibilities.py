@@ -0,0 +1,64 @@
+from sdk.as_offline_inventory import OfflineAndromedaInventory
+from sdk.samples.as_create_eligibilities import MAX_PREFETCH_COUNT, load_app_indexes, plan_eligibilities
+
+
+class _RecordingInventory(OfflineAndromedaInventory):
+    """ Offline inventory that records the kwargs of the prefetch iterators """
+    def __init__(self, provider_map: dict):
+        super().__init__(provider_map=provider_map)
+        self.itr_kwargs = {}
+
+    def provider_eligibilities_itr(self, provider_id, provider_data, filters=None, page_size=None, **kwargs):
+        self.itr_kwargs['eligibilities'] = kwargs
+        return super().provider_eligibilities_itr(provider_id, provider_data, filters, page_size)
+
+    def provider_assignable_groups_itr(self, provider_id, provider_data, filters=None, page_size=None, **kwargs):
+        self.itr_kwargs['assignableGroups'] = kwargs
+        return super().provider_assignable_groups_itr(provider_id, provider_data, filters, page_size)
+
+    def as_provider_groups_itr(self, provider_id, provider_data, filters=None, page_size=None, **kwargs):
+        self.itr_kwargs['groups'] = kwargs
+        return super().as_provider_groups_itr(provider_id, provider_data, filters, page_size)
+
+
+def _eligibility(eligibility_id: str, eligible_group: str, provisioning_group_id: str) -> dict:
+    return {"eligibilityId": eligibility_id, "eligibilityType": "PROVIDER_ELIGIBILITY",
+            "provisioningGroupConfiguration": {"id": provisioning_group_id},
+            "eligibleGroups": {"edges": [{"node": {"id": f"id-{eligible_group}", "name": eligible_group}}]}}
+
+
+def test_plan_eligibilities():
+    inventory = _RecordingInventory({"okta": {
+        "id": "okta", "name": "Okta", "category": "APPLICATION",
+        "assignableGroups": {name: {"groupDetails": {"id": f"id-{name}", "name": name}}
+                             for name in ("eng", "ops", "sales")},
+        "groups": {name: {"id": f"id-{name}", "name": name} for name in ("prov-a", "prov-b")},
+        "eligibilities": {"e1": _eligibility("e1", "eng", "id-prov-a"),
+                          "e2": _eligibility("e2", "ops", "id-prov-a")},
+    }})
+    app_indexes = load_app_indexes(inventory, ["Okta", "Unknown"])
+    assert list(app_indexes) == ["Okta"]
+    assert inventory.itr_kwargs == {"eligibilities": {"eligible_groups": True, "max_count": MAX_PREFETCH_COUNT},
+                                    "assignableGroups": {"max_count": MAX_PREFETCH_COUNT},
+                                    "groups": {"max_count": MAX_PREFETCH_COUNT}}
+
+    def row(eligibility_group: str, provisioning_group: str) -> dict:
+        return {"eligibility_group": eligibility_group, "provisioning_group": provisioning_group, "role_name": None}
+
+    eligibilities_map = {
+        "Okta": [row("eng", "prov-a"), row("ops", "prov-b"), row("sales", "prov-b"), row("sales", "prov-b"),
+                 row("missing", "prov-a"), row("eng", "missing")],
+        "Unknown": [row("eng", "prov-a")],
+    }
+    plan = plan_eligibilities(app_indexes, eligibilities_map)
+    # without cleanup the mismatched eligibility of ops is kept, the duplicate sales row is planned once
+    assert [e["eligibilityId"] for e in plan["existing"]] == ["e1", "e2"]
+    assert [(c["eligibleGroupIds"], c["provisioningGroupId"]) for c in plan["create"]] == [(["id-sales"], "id-prov-b")]
+    assert plan["delete"] == []
+    assert plan["errors"] == ["Application Okta: Eligibility group missing not found",
+                              "Application Okta: Provisioning group missing not found",
+                              "Application Unknown not found"]
+
+    plan = plan_eligibilities(app_indexes, eligibilities_map, cleanup=True)
+    assert plan["delete"] == [{"providerId": "okta", "eligibilityId": "e2"}]
+    assert [c["eligibleGroupIds"] for c in plan["create"]] == [["id-ops"], ["id-sales"]]
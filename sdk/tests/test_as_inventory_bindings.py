@@ -0,0 +1,42 @@
+PRINCIPAL = {"__typename": "Group", "id": "g1", "name": "admins"}
+SCOPE = {"__typename": "AccountScopeData", "id": "a1", "name": "prod", "isInherited": False}
+
+
+def _bindings_responder(principal: dict, scope: dict):
+    def responder(query: str) -> dict:
+        if "configuredAssignments(" in query:
+            return {"Provider": {"configuredAssignments": {"edges": [
+                {"node": {"roleName": "admin", "principal": dict(principal), "scope": dict(scope)}},
+                {"node": {"roleName": "viewer", "principal": dict(principal), "scope": dict(scope)}},
+            ]}}}
+        return {"Provider": {"userResolvedAssignments": {"edges": [
+            {"node": {"roleName": "admin", "principal": None, "scope": dict(scope),
+                      "configuredAssignments": {"edges": [
+                          {"node": {"principal": dict(principal), "scope": dict(scope)}}]}}},
+        ]}}}
+    return responder
+
+
+def test_active_bindings_inline(make_inventory):
+    ai = make_inventory(_bindings_responder(PRINCIPAL, SCOPE))
+    provider_data = {"id": "p1", "activeBindings": {"configured": [], "resolved": []}}
+    active_bindings = ai._fetch_active_bindings("p1", provider_data)
+    # the snapshot keeps the inline principal and scope by default
+    assert set(active_bindings) == {"configured", "resolved"}
+    assert active_bindings["configured"][0]["principal"] == PRINCIPAL
+    assert active_bindings["resolved"][0]["scope"] == SCOPE
+
+
+def test_active_bindings_dedup(make_inventory):
+    principal, scope = PRINCIPAL, SCOPE
+    ai = make_inventory(_bindings_responder(principal, scope), dedup_bindings=True)
+    provider_data = {"id": "p1", "activeBindings": {"configured": [], "resolved": []}}
+    active_bindings = ai._fetch_active_bindings("p1", provider_data)
+    assert len(active_bindings["configured"]) == 2 and len(active_bindings["resolved"]) == 1
+    assert list(active_bindings["principals"].values()) == [principal]
+    assert list(active_bindings["scopes"].values()) == [scope]
+    configured = active_bindings["configured"][0]
+    assert "principal" not in configured
+    assert active_bindings["principals"][configured["principalKey"]] == principal
+    nested = active_bindings["resolved"][0]["configuredAssignments"]["edges"][0]["node"]
+    assert nested["scopeKey"] == configured["scopeKey"]
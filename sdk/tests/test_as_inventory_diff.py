@@ -0,0 +1,62 @@
+import json
+from sdk.as_inventory_diff import (content_hash, diff_entity, diff_indexes, field_diffs_itr,
+                                   load_index, write_snapshot_index)
+
+
+def _provider(humans: dict) -> dict:
+    return {"id": "p1", "name": "aws", "humans": humans, "nhis": {},
+            "applicationAssignments": [{"app": "a"}],
+            "activeBindings": {"configured": [{"roleName": "admin"}], "resolved": [],
+                               "principals": {}, "scopes": {}}}
+
+
+def test_content_hash_is_key_order_independent():
+    assert content_hash({"a": 1, "b": [1, 2]}) == content_hash({"b": [1, 2], "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
+
+
+def test_diff_entity():
+    old = {"name": "alice", "risk": {"level": "LOW"}, "groups": ["g1"], "gone": 1}
+    new = {"name": "alice", "risk": {"level": "HIGH"}, "groups": ["g2"], "added": 2}
+    assert diff_entity(old, new) == [
+        {"path": "added", "old": None, "new": 2},
+        {"path": "gone", "old": 1, "new": None},
+        {"path": "groups[0]", "old": "g1", "new": "g2"},
+        {"path": "risk.level", "old": "LOW", "new": "HIGH"},
+    ]
+
+
+def test_snapshot_diff(tmp_path):
+    old_file = str(tmp_path / "old.json")
+    new_file = str(tmp_path / "new.json")
+    write_snapshot_index({"p1": _provider({
+        "alice": {"id": "1", "riskLevel": "LOW"}, "bob": {"id": "2"}})}, old_file)
+    write_snapshot_index({"p1": _provider({
+        "alice": {"riskLevel": "HIGH", "id": "1"}, "carol": {"id": "3"}})}, new_file)
+
+    diff = diff_indexes(load_index(old_file), load_index(new_file))
+    assert diff == {"p1": {"humans": {"added": ["carol"], "removed": ["bob"], "changed": ["alice"]}}}
+
+    field_diffs = list(field_diffs_itr(old_file, new_file))
+    assert field_diffs == [{"providerId": "p1", "entityType": "humans", "key": "alice",
+                            "changes": [{"path": "riskLevel", "old": "LOW", "new": "HIGH"}]}]
+    with open(tmp_path / "new.index.json", encoding="utf-8") as f:
+        assert "activeBindings.configured" in json.load(f)["p1"]
+
+
+def test_bindings_are_keyed_by_principal_role_and_scope(tmp_path):
+    def provider(*bindings) -> dict:
+        return {"p1": {"id": "p1", "activeBindings": {"configured": [
+            {"principalId": principal_id, "roleId": "r1", "roleName": "admin", "lastUsedAt": last_used,
+             "scope": {"__typename": "AccountScopeData", "id": "a1"}}
+            for principal_id, last_used in bindings], "resolved": []}}}
+
+    old_file = str(tmp_path / "old.json")
+    new_file = str(tmp_path / "new.json")
+    write_snapshot_index(provider(("u1", "2025-01-01"), ("u2", "2025-01-01")), old_file)
+    write_snapshot_index(provider(("u1", "2025-02-01"), ("u3", "2025-01-01")), new_file)
+    diff = diff_indexes(load_index(old_file), load_index(new_file))
+    assert diff == {"p1": {"activeBindings.configured": {
+        "added": ["u3|r1||a1"], "removed": ["u2|r1||a1"], "changed": ["u1|r1||a1"]}}}
+    assert [d["changes"] for d in field_diffs_itr(old_file, new_file)] == [
+        [{"path": "lastUsedAt", "old": "2025-01-01", "new": "2025-02-01"}]]
@@ -0,0 +1,48 @@
+import os
+from sdk.as_inventory_diff import snapshot_paths
+
+
+def test_download_inventory_cache(make_inventory, monkeypatch):
+    ai = make_inventory(lambda query: {})
+    crawls = []
+
+    def fake_crawl(provider_id=""):
+        crawls.append(provider_id)
+        ai.provider_map["p1"] = {"id": "p1", "humans": {"alice": {"id": "1"}}}
+        return ai.provider_map
+    monkeypatch.setattr(ai, "_fetch_ai_inventory", fake_crawl)
+
+    data_file = ai.download_inventory(provider_id="p1", write_index=False)
+    ai['provider_map'] = {}
+    assert ai.download_inventory(provider_id="p1", use_cached=True, write_index=False) == data_file
+    assert crawls == ["p1"]
+    assert ai.provider_map["p1"]["humans"]["alice"] == {"id": "1"}
+
+    # a different provider filter or an expired cache is crawled again
+    ai.download_inventory(provider_id="", use_cached=True, write_index=False)
+    ai.download_inventory(provider_id="", use_cached=True, write_index=False, max_age_s=-1)
+    assert crawls == ["p1", "", ""]
+
+    # the index of a cached snapshot is written on request, and only rewritten when it is stale
+    index_file, entities_file = snapshot_paths(data_file)
+    assert not os.path.exists(index_file)
+    ai.download_inventory(provider_id="", use_cached=True, write_index=True)
+    assert crawls == ["p1", "", ""] and os.path.exists(index_file) and os.path.exists(entities_file)
+    index_mtime = os.path.getmtime(index_file)
+    ai.download_inventory(provider_id="", use_cached=True, write_index=True)
+    assert os.path.getmtime(index_file) == index_mtime
+
+
+def test_download_inventory_cache_is_keyed_on_crawl_options(make_inventory, monkeypatch):
+    crawls = []
+    for dedup_bindings in (False, True, True):
+        ai = make_inventory(lambda query: {}, dedup_bindings=dedup_bindings)
+
+        def fake_crawl(provider_id="", ai=ai):
+            crawls.append(ai.dedup_bindings)
+            ai.provider_map["p1"] = {"id": "p1"}
+            return ai.provider_map
+        monkeypatch.setattr(ai, "_fetch_ai_inventory", fake_crawl)
+        ai.download_inventory(provider_id="p1", use_cached=True)
+    # a snapshot crawled without dedup_bindings is not reused for a dedup_bindings crawl
+    assert crawls == [False, True]
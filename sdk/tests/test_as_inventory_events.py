@@ -0,0 +1,51 @@
+import re
+
+
+def test_as_events_follow(make_inventory, tmp_path):
+    events = [{"id": "e1", "time": "2025-01-01T00:00:00Z"}, {"id": "e2", "time": "2025-01-01T00:01:00Z"}]
+
+    def responder(query: str) -> dict:
+        since = re.search(r'greaterThanOrEquals: "([^"]*)"', query).group(1)
+        skip = int(re.search(r'skip: (\d+)', query).group(1))
+        matching = [e for e in events if e["time"] >= since[:19]] if skip == 0 else []
+        return {"AndromedaEvents": {"edges": [{"node": e} for e in matching]}}
+
+    ai = make_inventory(responder)
+    delivered = []
+    state_file = str(tmp_path / "follow.json")
+    state = ai.as_events_follow(delivered.append, state_file=state_file, start_time="2025-01-01T00:00:00Z",
+                                lookback_s=120, min_interval_s=0, max_interval_s=0, max_polls=2)
+    # the second poll re-reads the lookback window, the seen ids are not delivered again
+    assert delivered == [events]
+    assert state["watermark"].startswith("2025-01-01T00:01:00")
+
+    # a late event inside the lookback window and a restart from the state file
+    events.append({"id": "e3", "time": "2025-01-01T00:00:30Z"})
+    ai.as_events_follow(delivered.append, state_file=state_file, min_interval_s=0, max_interval_s=0, max_polls=1)
+    assert delivered[1] == [events[2]]
+
+
+def test_as_events_follow_retries_and_orders_by_parsed_time(make_inventory, tmp_path):
+    # e2 is earlier than e1 once the offset is applied, a string sort gets it wrong
+    events = [{"id": "e1", "time": "2025-01-01T00:30:00Z"}, {"id": "e2", "time": "2025-01-01T01:00:00+01:00"}]
+    polls = []
+
+    def responder(query: str) -> dict:
+        polls.append(query)
+        if len(polls) == 1:
+            raise ConnectionError("gateway timeout")
+        return {"AndromedaEvents": {"edges": [{"node": e} for e in events]}
+                if 'skip: 0' in query else {"edges": []}}
+
+    ai = make_inventory(responder)
+    delivered = []
+    state_file = str(tmp_path / "follow.json")
+    state = ai.as_events_follow(delivered.append, filters={"eventType": {"equals": "ACCESS_EVENT"}}, state_file=state_file,
+                                start_time="2025-01-01T00:00:00Z", min_interval_s=0, max_interval_s=0, max_polls=2)
+    assert [[e["id"] for e in batch] for batch in delivered] == [["e2", "e1"]]
+    assert state["watermark"].startswith("2025-01-01T00:30:00")
+
+    # the state of other filters is not resumed
+    state = ai.as_events_follow(delivered.append, filters={"eventType": {"equals": "USER_EVENT"}}, state_file=state_file,
+                                start_time="2025-01-01T00:00:00Z", min_interval_s=0, max_interval_s=0, max_polls=1)
+    assert len(delivered) == 2 and state["filters"] == '{"eventType": {"equals": "USER_EVENT"}}'
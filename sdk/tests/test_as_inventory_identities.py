@@ -0,0 +1,132 @@
+import re
+import pytest
+
+
+def _identity(identity_id: str) -> dict:
+    return {
+        "id": identity_id, "name": identity_id.title(), "username": f"{identity_id}@acme.com",
+        "email": f"{identity_id}@acme.com", "riskLevel": "LOW",
+        "origins": {"edges": [{"node": {"originUserId": identity_id}}]},
+        "orgInfo": {"department": "eng"}, "opsInsights": None, "riskFactorsData": None,
+    }
+
+
+def _identity_cache_responder(query: str) -> dict:
+    if "Identities(" in query:
+        return {"Identities": {"edges": [{"node": _identity(i)} for i in ("alice", "bob")]}}
+    if "Account(" in query:
+        return {"Account": {"identities": {
+            "edges": [{"node": {"id": "alice", "username": "alice@acme.com"},
+                       "identityAccountData": {"isAdmin": True}}],
+            "pageInfo": None}}}
+    return {"Provider": {"identities": {
+        "edges": [{"node": {"id": i, "username": f"{i}@acme.com"},
+                   "identityProviderData": {"userId": f"{i}-user"}} for i in ("alice", "bob")],
+        "pageInfo": None}}}
+
+
+def test_identity_cache(make_inventory):
+    ai = make_inventory(_identity_cache_responder, identity_cache=True)
+    humans = ai.provider_humans_base_fn("p1", {}, None, page_size=10, skip=0)
+    assert [h["email"] for h in humans] == ["alice@acme.com", "bob@acme.com"]
+    assert humans[0]["identityProviderData"] == {"userId": "alice-user"}
+    assert humans[0]["origins"] == [{"originUserId": "alice"}]
+    # the shared identity attributes are not selected by the provider query
+    provider_query = ai.gql_client.transport.queries[0]
+    assert "Provider(" in provider_query and "orgInfo" not in provider_query
+
+    # the second provider is answered from the cache without another identities query
+    humans = ai.provider_humans_base_fn("p2", {}, None, page_size=10, skip=0)
+    assert humans[1]["orgInfo"] is ai.identity_cache["bob"]["orgInfo"]
+    assert sum("Identities(" in q for q in ai.gql_client.transport.queries) == 1
+
+    # account humans only get the trivial identity fields joined
+    humans = ai.account_humans_base_fn("p1", "a1", {"name": "a1"}, None, page_size=10, skip=0)
+    assert humans == [{"id": "alice", "name": "Alice", "username": "alice@acme.com",
+                       "email": "alice@acme.com", "riskLevel": "LOW",
+                       "identityAccountData": {"isAdmin": True}}]
+
+
+def test_accounts_identities_bulk(make_inventory):
+    humans = {"a1": ["u1", "u2", "u3"], "a3": ["u4"]}
+
+    def responder(query: str) -> dict:
+        # one aliased Account field per account page, answered from the humans map above
+        data = {}
+        for line in query.splitlines():
+            line = line.strip()
+            if line.startswith("account") and "Account(" in line:
+                alias = line.split(":")[0]
+                account_id = line.split('id: "')[1].split('"')[0]
+                data[alias] = {"identities": {"edges": []}}
+            if line.startswith("identities(") and "skip:" in line:
+                skip = int(line.split("skip: ")[1].split("}")[0])
+                names = humans.get(account_id, [])[skip:skip + 2]
+                data[alias]["identities"]["edges"] = [
+                    {"node": {"id": n, "username": n}, "identityAccountData": {}} for n in names]
+        return data
+
+    ai = make_inventory(responder, default_page_size=2, account_bulk_size=2)
+    provider_data = {"accounts": {
+        "a1": {"id": "a1", "identities": {"pageInfo": {"count": 3}}},
+        "a2": {"id": "a2", "identities": {"pageInfo": {"count": 0}}},
+        "a3": {"id": "a3"},
+    }}
+    ai._fetch_accounts_identities_bulk("p1", provider_data, "identities")
+    assert sorted(provider_data["accounts"]["a1"]["humans"]) == ["u1", "u2", "u3"]
+    assert provider_data["accounts"]["a2"]["humans"] == {}
+    assert list(provider_data["accounts"]["a3"]["humans"]) == ["u4"]
+    # a1 and a3 in the first query, the second page of a1 in the next, a2 is never queried
+    queries = ai.gql_client.transport.queries
+    assert len(queries) == 2
+    assert '"a2"' not in "".join(queries)
+
+
+def test_account_identities_shape(make_inventory, monkeypatch):
+    ai = make_inventory(lambda query: {})
+    ai.provider_map["p1"] = {"accounts": {"a1": {"id": "a1", "name": "prod"}}}
+    monkeypatch.setattr(ai, "account_humans_itr", lambda *args: iter([{"id": "u1", "username": "alice"}]))
+    monkeypatch.setattr(ai, "account_nhis_itr", lambda *args: iter([{"id": "n1", "username": "ci-bot"}]))
+    ai._fetch_account_humans("p1", "a1", {})
+    ai._fetch_account_nhis("p1", "a1", {})
+    # the per account fetch stores the identities like the bulk one, not next to the account fields
+    assert ai.provider_map["p1"]["accounts"]["a1"] == {
+        "id": "a1", "name": "prod",
+        "humans": {"alice": {"id": "u1", "username": "alice"}},
+        "nhis": {"ci-bot": {"id": "n1", "username": "ci-bot"}}}
+
+
+def test_bulk_lookup(make_inventory):
+    known = {f"user{i}@acme.com" for i in range(0, 250, 2)}
+
+    def responder(query: str) -> dict:
+        requested = re.search(r'email: \{in: \[([^\]]*)\]', query).group(1)
+        emails = [e.strip().strip('"') for e in requested.split(",")]
+        return {"Identities": {"edges": [{"node": _identity(e.split("@")[0]) | {"email": e}}
+                                         for e in emails if e in known]}}
+
+    ai = make_inventory(responder)
+    values = [f"user{i}@acme.com" for i in range(250)] + ["user0@acme.com"]
+    found = ai.bulk_lookup("humans", "email", values, chunk_size=50, max_workers=3)
+    assert set(found) == known
+    assert found["user2@acme.com"]["id"] == "user2"
+    # 250 unique values in chunks of 50
+    assert len(ai.gql_client.transport.queries) == 5
+    with pytest.raises(ValueError):
+        ai.bulk_lookup("provider_humans", "username", values)
+
+
+def test_identity_cache_miss(make_inventory, caplog):
+    def responder(query: str) -> dict:
+        if "Identities(" in query:
+            # bob is not returned by the identities queries
+            return {"Identities": {"edges": [{"node": _identity("alice")}]}}
+        return _identity_cache_responder(query)
+
+    ai = make_inventory(responder, identity_cache=True)
+    humans = ai.provider_humans_base_fn("p1", {}, None, page_size=10, skip=0)
+    assert humans[1] == {"id": "bob", "username": "bob@acme.com", "identityProviderData": {"userId": "bob-user"}}
+    assert "identity bob not found" in caplog.text
+    # bob is fetched on its own once, not again for the next provider
+    ai.provider_humans_base_fn("p2", {}, None, page_size=10, skip=0)
+    assert sum("Identities(" in q for q in ai.gql_client.transport.queries) == 2
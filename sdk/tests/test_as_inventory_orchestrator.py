@@ -0,0 +1,37 @@
+import json
+import pytest
+from sdk.api_utils import InvalidInputException
+from sdk.as_inventory_orchestrator import load_tenants, _order_by_previous_duration
+
+
+def test_load_tenants(tmp_path):
+    tenants_file = tmp_path / "tenants.yaml"
+    tenants_file.write_text("""
+tenants:
+  - name: acme
+    api_endpoint: mock://acme
+    gql_endpoint: mock://acme/graphql
+  - name: beatles
+    api_endpoint: mock://beatles
+    gql_endpoint: mock://beatles/graphql
+""")
+    tenants = load_tenants(str(tenants_file))
+    assert [t["name"] for t in tenants] == ["acme", "beatles"]
+
+    tenants_file.write_text("""
+tenants:
+  - name: acme
+  - name: acme
+""")
+    with pytest.raises(InvalidInputException):
+        load_tenants(str(tenants_file))
+
+
+def test_order_by_previous_duration(tmp_path):
+    tenants = [{"name": "a"}, {"name": "b"}, {"name": "c"}]
+    summary_file = tmp_path / "orchestrator-summary.json"
+    assert _order_by_previous_duration(tenants, str(summary_file)) == tenants
+    summary_file.write_text(json.dumps({"tenants": [
+        {"name": "a", "durationS": 10}, {"name": "b", "durationS": 300}]}))
+    ordered = _order_by_previous_duration(tenants, str(summary_file))
+    assert [t["name"] for t in ordered] == ["b", "a", "c"]
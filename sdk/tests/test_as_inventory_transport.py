@@ -0,0 +1,106 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests_mock
+from gql import Client, gql
+from gql.transport.requests import RequestsHTTPTransport
+from sdk.as_inventory import AndromedaInventory, SerialTransport, SessionHTTPTransport
+
+
+def test_gql_transport_shares_api_session(gql_schema, api_session, api_adapter):
+    api_session.cookies.set("DS", "cookie")
+    api_adapter.register_uri("POST", "mock://as/graphql", json={"data": {"__typename": "Query"}})
+    gql_client = AndromedaInventory.get_gql_client(api_session, "mock://as/graphql", schema=gql_schema)
+    for _ in range(2):
+        gql_client.execute(gql("{ __typename }"))
+    assert api_adapter.call_count == 2
+    assert api_adapter.last_request.headers["Cookie"] == "DS=cookie"
+    # the shared session is not closed with the transport
+    assert gql_client.transport.session is None and gql_client.transport.api_session is api_session
+
+
+def test_gql_transport_coalesces_identical_queries(tmp_path, gql_schema, api_session, api_adapter):
+    def graphql(request, context):
+        time.sleep(0.2)
+        return {"data": {"__typename": "Query"}}
+
+    api_adapter.register_uri("POST", "mock://as/graphql", json=graphql)
+    ai = AndromedaInventory(AndromedaInventory.get_gql_client(api_session, "mock://as/graphql", schema=gql_schema),
+                            api_session, as_endpoint="mock://as", output_dir=str(tmp_path))
+    # every worker has its own client, the identical queries still share one request
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: ai.gql_client.execute(gql("{ __typename }")), range(4)))
+    assert results == [{"__typename": "Query"}] * 4
+    assert sum(r.method == "POST" for r in api_adapter.request_history) == 1
+    assert len({id(r) for r in results}) == 4
+
+
+def test_gql_transport_does_not_coalesce_mutations(api_session, api_adapter):
+    def graphql(request, context):
+        time.sleep(0.2)
+        return {"data": {"touch": True}}
+
+    api_adapter.register_uri("POST", "mock://as/graphql", json=graphql)
+    transport = SessionHTTPTransport("mock://as/graphql", api_session)
+    transport.connect()
+    # every identical mutation is sent
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: transport.execute(gql("mutation Touch { touch }")), range(4)))
+    assert [r.data for r in results] == [{"touch": True}] * 4
+    assert sum(r.method == "POST" for r in api_adapter.request_history) == 4 and transport.single_flight.shared == 0
+
+
+def test_lazy_construction(tmp_path, gql_schema, api_session, api_adapter):
+    api_adapter.register_uri("POST", "mock://as/graphql", json={"data": {"__typename": "Query"}})
+    ai = AndromedaInventory(None, api_session, output_dir=str(tmp_path), as_endpoint="mock://as",
+                            gql_endpoint="mock://as/graphql", gql_schema=gql_schema)
+    # nothing is fetched or created until it is used
+    assert api_adapter.call_count == 0 and not list(tmp_path.iterdir())
+
+    assert ai.gql_client.execute(gql("{ __typename }")) == {"__typename": "Query"}
+    assert ai.gql_client is ai.gql_client and api_adapter.call_count == 1
+    assert ai.output_dir == f"{tmp_path}/tenant-1" and os.path.isdir(ai.output_dir)
+    assert ai.tenant_id == "tenant-1" and api_adapter.call_count == 2
+
+
+def test_gql_client_per_thread(tmp_path, gql_schema, api_session, api_adapter):
+    api_adapter.register_uri("POST", "mock://as/graphql", json={"data": {"__typename": "Query"}})
+    ai = AndromedaInventory(AndromedaInventory.get_gql_client(api_session, "mock://as/graphql", schema=gql_schema),
+                            api_session, as_endpoint="mock://as", output_dir=str(tmp_path))
+    main_transport = ai.gql_client.transport
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        client = executor.submit(lambda: ai.gql_client).result()
+    # a new transport on the same API session, sharing the coalescing of the main one
+    assert client.transport is not main_transport and client.schema is ai.gql_client.schema
+    assert client.transport.api_session is api_session and client.transport.session is None
+    assert client.transport.single_flight is main_transport.single_flight
+    assert client.execute(gql("{ __typename }")) == {"__typename": "Query"}
+
+
+class _CustomTransport(RequestsHTTPTransport):
+    """ A RequestsHTTPTransport subclass, its state cannot be copied """
+
+
+def test_gql_client_per_thread_other_transports(tmp_path, gql_schema, api_session):
+    def graphql(request, context):
+        time.sleep(0.1)
+        return {"data": {"__typename": "Query"}}
+
+    with requests_mock.Mocker() as m:
+        m.post("http://gql.test/graphql", json=graphql)
+        for transport_cls in (RequestsHTTPTransport, _CustomTransport):
+            transport = transport_cls(url="http://gql.test/graphql", headers={"X-Tenant": "t1"}, timeout=60)
+            ai = AndromedaInventory(Client(transport=transport, schema=gql_schema), api_session,
+                                    as_endpoint="mock://as", output_dir=str(tmp_path))
+            # a connected RequestsHTTPTransport raises when it is connected again by another thread
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(lambda _: ai.gql_client.execute(gql("{ __typename }")), range(8)))
+            assert results == [{"__typename": "Query"}] * 8
+            assert all(r.headers["X-Tenant"] == "t1" for r in m.request_history)
+            if transport_cls is RequestsHTTPTransport:
+                # the threads run on copies of the transport
+                assert ai.gql_client.transport is transport
+            else:
+                # the threads share it, one query at a time
+                assert isinstance(ai.gql_client.transport, SerialTransport)
+                assert ai.gql_client.transport.transport is transport
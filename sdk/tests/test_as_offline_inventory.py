@@ -0,0 +1,95 @@
+import json
+import pytest
+from sdk.api_utils import InvalidInputException
+from sdk.as_inventory import BULK_LOOKUP_ITRS
+from sdk.as_offline_inventory import OfflineAndromedaInventory, match_filters
+
+
+def _human(identity_id: str, risk_factors: list, provider_user: str) -> dict:
+    return {"id": identity_id, "username": f"{identity_id}@acme.com", "email": f"{identity_id}@acme.com",
+            "riskLevel": "HIGH" if risk_factors else "LOW", "numAgents": len(risk_factors),
+            "riskFactorsData": [{"type": r, "category": "HYGIENE"} for r in risk_factors],
+            "opsInsights": [], "orgInfo": {"department": "eng"},
+            "identityProviderData": {"userId": provider_user}}
+
+
+@pytest.fixture
+def offline_inventory(tmp_path) -> OfflineAndromedaInventory:
+    provider_map = {
+        "aws": {"id": "aws", "name": "AWS", "category": "CLOUD",
+                "humans": {"alice@acme.com": _human("alice", ["STALE"], "a1"),
+                           "bob@acme.com": _human("bob", [], "b1")},
+                "nhis": {"ci-bot": {"id": "ci-bot", "username": "ci-bot", "identityProviderData": {"userId": "n1"}}},
+                "groups": {"admins": {"id": "g1", "name": "admins"}},
+                "accounts": {"acc1": {"id": "acc1", "name": "prod",
+                                      "humans": {"alice@acme.com": {"id": "alice", "username": "alice@acme.com"}}}}},
+        "okta": {"id": "okta", "name": "Okta", "category": "APPLICATION",
+                 "humans": {"alice@acme.com": _human("alice", ["STALE"], "a2")},
+                 "groups": {"admins": {"id": "g1", "name": "admins"}, "eng": {"id": "g2", "name": "eng"}}},
+    }
+    inventory_file = tmp_path / "andromeda-inventory.json"
+    inventory_file.write_text(json.dumps(provider_map))
+    return OfflineAndromedaInventory(str(inventory_file))
+
+
+def test_match_filters():
+    entity = {"name": "alice", "risk": 10, "tags": ["a", "b"], "active": True}
+    assert match_filters(entity, {"name": {"equals": "alice"}, "active": True})
+    assert match_filters(entity, {"name": {"icontains": "ALI"}, "tags": {"all": ["a", "b"]}})
+    assert not match_filters(entity, {"tags": {"notIn": ["b"]}})
+    assert match_filters(entity, {"risk": {"greaterThan": "5", "lessThanOrEquals": 10}})
+    assert match_filters(entity, {"name": {"equals": "bob"}, "or": {"tags": {"in": ["b"]}}})
+    with pytest.raises(InvalidInputException):
+        match_filters(entity, {"name": {"like": "a%"}})
+
+
+def test_offline_humans(offline_inventory):
+    humans = list(offline_inventory.as_humans_itr(filters={"email": {"in": {"alice@acme.com", "carol@acme.com"}}}))
+    assert len(humans) == 1
+    assert humans[0]["providerId"] == ["aws", "okta"]
+    assert "identityProviderData" not in humans[0]
+    assert [h["id"] for h in offline_inventory.as_humans_itr(filters={"riskFactor": {"in": ["STALE"]}})] == ["alice"]
+    # the email index was built by the first query and is reused
+    assert (("humans",), "email") in offline_inventory._indexes
+
+    provider_humans = list(offline_inventory.provider_humans_itr(
+        "aws", {}, filters={"username": {"equals": "bob@acme.com"}}))
+    assert provider_humans[0]["identityProviderData"] == {"userId": "b1"}
+    assert [h["id"] for h in offline_inventory.account_humans_itr("aws", "acc1", {})] == ["alice"]
+
+
+def test_offline_unhashable_operand():
+    ai = OfflineAndromedaInventory(provider_map={"aws": {"id": "aws", "name": "AWS", "groups": {
+        "admins": {"id": "g1", "name": "admins", "tags": [["team", "eng"]]},
+        "ops": {"id": "g2", "name": "ops", "tags": [["team", "ops"]]}}}})
+    # a list operand is not looked up in the index, the entities are scanned
+    groups = ai.as_provider_groups_itr("aws", {}, filters={"tags": {"equals": ["team", "eng"]}})
+    assert [g["id"] for g in groups] == ["g1"]
+    groups = ai.as_provider_groups_itr("aws", {}, filters={"tags": {"in": [["team", "ops"]]}, "name": {"equals": "ops"}})
+    assert [g["id"] for g in groups] == ["g2"]
+
+
+def test_offline_providers(offline_inventory):
+    assert [p["id"] for p in offline_inventory.cloud_provider_itr()] == ["aws"]
+    okta = next(offline_inventory.app_provider_itr(filters={"id": {"equals": "okta"}}))
+    assert okta == {"id": "okta", "name": "Okta", "category": "APPLICATION"}
+    with pytest.raises(InvalidInputException):
+        list(offline_inventory.provider_humans_itr("gcp", {}))
+
+
+def test_offline_bulk_lookup(offline_inventory):
+    found = offline_inventory.bulk_lookup('humans', 'email', ["alice@acme.com", "carol@acme.com", None])
+    assert list(found) == ["alice@acme.com"] and found["alice@acme.com"]["id"] == "alice"
+    found = offline_inventory.bulk_lookup('provider_humans', 'username', ["bob@acme.com"], provider_id="aws")
+    assert found["bob@acme.com"]["id"] == "bob"
+    with pytest.raises(ValueError):
+        offline_inventory.bulk_lookup('provider_humans', 'username', ["bob@acme.com"])
+
+    # every entity of the online bulk_lookup is answered from the snapshot
+    assert all(hasattr(offline_inventory, itr) for itr in BULK_LOOKUP_ITRS.values())
+    found = offline_inventory.bulk_lookup('nhis', 'username', ["ci-bot"])
+    assert found["ci-bot"]["providerId"] == ["aws"] and "identityProviderData" not in found["ci-bot"]
+    found = offline_inventory.bulk_lookup('identities', 'id', ["alice", "bob", "ci-bot", "carol"])
+    assert sorted(found) == ["alice", "bob", "ci-bot"]
+    found = offline_inventory.bulk_lookup('groups', 'name', ["admins", "eng"])
+    assert found["admins"]["providerId"] == ["aws", "okta"] and found["eng"]["id"] == "g2"
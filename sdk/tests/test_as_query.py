@@ -0,0 +1,70 @@
+import pytest
+from sdk.api_utils import InvalidInputException
+from sdk.as_offline_inventory import match_filters
+from sdk.as_query import SnapshotQuery, days_ago
+
+
+def _human(identity_id: str, risk_factors: list, last_activity: str, agents: int) -> dict:
+    return {"id": identity_id, "username": f"{identity_id}@acme.com", "riskLevel": "HIGH" if risk_factors else "LOW",
+            "lastActivityAt": last_activity, "numAgents": agents, "orgInfo": {"department": "eng"},
+            "riskFactorsData": [{"type": r, "category": "HYGIENE"} for r in risk_factors]}
+
+
+@pytest.fixture
+def engine() -> SnapshotQuery:
+    return SnapshotQuery({
+        "aws": {"id": "aws", "name": "AWS", "tierId": "tier1", "humans": {
+            "alice": _human("alice", ["STALE"], "2020-01-01T00:00:00Z", 2),
+            "bob": _human("bob", [], days_ago(1), 0)}},
+        "okta": {"id": "okta", "name": "Okta", "tierId": "tier2", "humans": {
+            "carol": _human("carol", ["STALE", "NO_MFA"], "2020-01-01T00:00:00Z", 5)}},
+    })
+
+
+def test_query_where_select(engine):
+    result = engine.query("humans", where={"riskFactor": {"equals": "STALE"},
+                                           "provider.tierId": {"equals": "tier1"},
+                                           "lastActivityAt": {"lessThan": days_ago(90)}},
+                          select=["id", "provider.name", "orgInfo.department"])
+    assert result == [{"id": "alice", "provider.name": "AWS", "orgInfo.department": "eng"}]
+    assert [h["id"] for h in engine.query("humans", where={"numAgents": {"greaterThan": "1"}})] == ["alice", "carol"]
+    assert [h["id"] for h in engine.query("humans", where={"username": {"icontains": "BOB"}})] == ["bob"]
+    assert [h["id"] for h in engine.query("humans", where={
+        "riskLevel": {"equals": "LOW"}, "or": {"numAgents": {"greaterThanOrEquals": 5}}})] == ["bob", "carol"]
+    # the indexes built by the queries are reused
+    table = engine.table("humans")
+    assert "riskFactor" in table._hash_indexes and "numAgents" in table._sorted_indexes
+
+
+def test_query_group_by(engine):
+    assert engine.query("humans", group_by="riskFactor") == {"STALE": 2, "NO_MFA": 1}
+    assert engine.query("humans", where={"riskLevel": {"equals": "HIGH"}}, group_by="provider.name") == {
+        "AWS": 1, "Okta": 1}
+    with pytest.raises(InvalidInputException):
+        engine.query("widgets")
+
+
+def test_query_unhashable_operand():
+    engine = SnapshotQuery({"aws": {"id": "aws", "humans": {
+        "alice": {"id": "alice", "tags": [["team", "eng"]], "labels": {"env": "prod"}},
+        "bob": {"id": "bob", "tags": [["team", "ops"]], "labels": {"env": "dev"}}}}})
+    # list and dict operands are matched by the column scan instead of the hash index
+    assert [h["id"] for h in engine.query("humans", where={"tags": {"equals": ["team", "eng"]}})] == ["alice"]
+    assert [h["id"] for h in engine.query("humans", where={"tags": {"in": [["team", "ops"], "x"]}})] == ["bob"]
+    assert [h["id"] for h in engine.query("humans", where={"labels": {"equals": {"env": "dev"}}})] == ["bob"]
+    assert "tags" not in engine.table("humans")._hash_indexes
+
+
+def test_query_range_on_mixed_column():
+    engine = SnapshotQuery({"aws": {"id": "aws", "humans": {
+        "alice": {"id": "alice", "score": 10}, "bob": {"id": "bob", "score": "7"},
+        "carol": {"id": "carol", "score": 2.5}, "dave": {"id": "dave", "score": None},
+        "erin": {"id": "erin", "score": ["high", 20]}}}})
+    # numbers compare with numbers, strings with strings, the other values never match
+    assert [h["id"] for h in engine.query("humans", where={"score": {"greaterThan": "5"}})] == ["alice", "bob", "erin"]
+    assert [h["id"] for h in engine.query("humans", where={"score": {"lessThan": 5}})] == ["carol"]
+    assert [h["id"] for h in engine.query("humans", where={"score": {"greaterThanOrEquals": "a"}})] == ["erin"]
+    assert set(engine.table("humans").sorted_index("score")) == {"number", "str"}
+    # the indexed result is the one of the filter semantics of the offline inventory
+    rows = engine.table("humans").rows
+    assert [r["id"] for r in rows if match_filters(r, {"score": {"greaterThan": "5"}})] == ["alice", "bob", "erin"]
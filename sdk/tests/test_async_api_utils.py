@@ -0,0 +1,108 @@
+import asyncio
+import inspect
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from sdk.api_utils import UPSERT_CREATED, UPSERT_UNCHANGED, UPSERT_UPDATED, APIUtils, APIUtilsBase
+from sdk.async_api_utils import AsyncAPIUtils
+
+
+def _app(state: dict) -> web.Application:
+    """ Fake API: login, a providers collection and the aws config of the providers """
+    routes = web.RouteTableDef()
+
+    def logged_in(request) -> bool:
+        return request.cookies.get('DS') == f"cookie{state['logins']}" and not state['expired']
+
+    @routes.post('/login/access-key')
+    async def login(request):
+        state['logins'] += 1
+        state['expired'] = False
+        response = web.json_response({})
+        response.set_cookie('DS', f"cookie{state['logins']}")
+        return response
+
+    @routes.get('/providers')
+    async def list_providers(request):
+        if not logged_in(request):
+            return web.json_response({}, status=401)
+        state['lists'] += 1
+        skip = int(request.query.get('skip', 0))
+        page = state['providers'][skip:skip + int(request.query.get('pageSize', 100))]
+        return web.json_response({"results": page, "count": len(state['providers'])})
+
+    @routes.post('/providers')
+    async def create_provider(request):
+        obj = dict(await request.json(), id=f"p{len(state['providers'])}")
+        state['providers'].append(obj)
+        return web.json_response(obj)
+
+    @routes.get('/providers/{provider_id}/aws/config')
+    async def get_config(request):
+        if not logged_in(request):
+            return web.json_response({}, status=401)
+        return web.json_response(state['configs'].get(request.match_info['provider_id']))
+
+    @routes.post('/providers/{provider_id}/aws/config')
+    @routes.put('/providers/{provider_id}/aws/config')
+    async def put_config(request):
+        obj = dict(await request.json(), updatedAt="now")
+        obj.setdefault('id', f"c-{request.match_info['provider_id']}")
+        state['configs'][request.match_info['provider_id']] = obj
+        state['writes'] += 1
+        return web.json_response(obj)
+
+    app = web.Application()
+    app.add_routes(routes)
+    return app
+
+
+def test_async_api_utils():
+    state = {"logins": 0, "expired": False, "lists": 0, "writes": 0, "configs": {},
+             "providers": [{"id": f"p{i}", "name": f"provider{i}"} for i in range(5)]}
+
+    async def run():
+        async with TestServer(_app(state)) as server:
+            async with AsyncAPIUtils(api_endpoint=str(server.make_url('')).rstrip('/'), pool_size=4,
+                                     name_index_ttl_s=300, min_reauth_interval_s=0) as au:
+                session = await au.get_api_session_w_api_token("token")
+                # one listing answers all the concurrent lookups
+                results = await asyncio.gather(*(
+                    au.get_resource_by_name(session, "providers", f"provider{i}") for i in range(5)))
+                assert [obj['id'] for _, obj in results] == [f"p{i}" for i in range(5)]
+                assert state['lists'] == 1
+
+                result = await au.create_or_update_resource(
+                    session, "providers", resource_name="provider5", obj={"name": "provider5"})
+                assert result.op == UPSERT_CREATED and result.obj['id'] == "p5"
+
+                # the session expires, the config calls log in once again and are replayed
+                state['expired'] = True
+                results = await asyncio.gather(*(
+                    au.create_or_update_aws_provider_config(session, f"p{i}", {"roleArn": f"arn{i}"})
+                    for i in range(5)))
+                assert [r.op for r in results] == [UPSERT_CREATED] * 5
+                assert state['logins'] == 2 and au.auth_generation == 2
+
+                result = await au.create_or_update_aws_provider_config(session, "p0", {"roleArn": "arn0"})
+                assert result.op == UPSERT_UNCHANGED and state['writes'] == 5
+                result = await au.create_or_update_aws_provider_config(session, "p0", {"roleArn": "arn-new"})
+                assert result.op == UPSERT_UPDATED and result.obj['id'] == "c-p0"
+            assert au.api_session is None
+
+    asyncio.run(run())
+
+
+def test_async_api_utils_surface():
+    assert not issubclass(AsyncAPIUtils, APIUtils) and issubclass(APIUtils, APIUtilsBase)
+    au = AsyncAPIUtils(api_endpoint="http://api.test")
+    # the request methods of APIUtils without an async variant are not there at all
+    for name in ("iter_resources", "bulk_upsert", "upsert_resources_by_name", "request_with_retry"):
+        assert not hasattr(au, name)
+    # every request method is async, defined here or delegating to an async method
+    for name, method in inspect.getmembers(AsyncAPIUtils, inspect.isfunction):
+        params = inspect.signature(method).parameters
+        if name.startswith('__') or 'api_session' not in params:
+            continue
+        result = getattr(au, name)(*[None] * (len(params) - 1))
+        assert inspect.iscoroutine(result), name
+        result.close()
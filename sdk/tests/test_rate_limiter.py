@@ -0,0 +1,20 @@
+import time
+from sdk.rate_limiter import RateLimiter
+
+
+def test_rate_limiter_spacing():
+    limiter = RateLimiter(20)
+    start = time.time()
+    for _ in range(5):
+        limiter.wait()
+    # first slot is immediate, the next 4 are 50ms apart
+    assert time.time() - start >= 0.19
+
+
+def test_rate_limiter_parent():
+    parent = RateLimiter(10)
+    child = RateLimiter(0, parent=parent)
+    start = time.time()
+    for _ in range(3):
+        child.wait()
+    assert time.time() - start >= 0.19